@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""Load test of the webservice against local stand-ins for DynamoDB and S3.
+
+Starts a moto server, creates the table (same keys and LSI as terraform/main_serverless.py)
+and the bucket, seeds it with posts shaped like terraform/data.py, starts webservice/app.py
+with uvicorn pointed at moto, then drives a mixed POST/GET/DELETE workload. Latencies and
+throughput come from the mixed phase. Memory is then measured per endpoint: each endpoint is
+driven alone for --rss-seconds, one after the other in WORKLOAD order, and the report gives
+the peak RSS of the webservice during its phase and the growth over the RSS it started from.
+
+    python benchmark/bench.py                  # run and compare with benchmark/baseline.json
+    python benchmark/bench.py --save-baseline  # run and store the result as the new baseline
+
+The run fails (exit code 1) when, compared to the baseline, the median latency of an endpoint
+listed in GATED_ENDPOINTS or the total throughput regresses by more than --tolerance, or its
+p95 latency by more than twice --tolerance. Endpoints with fewer than MIN_SAMPLES measured
+requests are reported but not gated, and neither is memory. Latencies depend on the machine:
+record the baseline on the machine that runs the comparison.
+
+The baseline must be re-recorded, in the same commit, by any change meant to alter the
+behaviour of a gated endpoint (caching, admission control, what a request reads or writes...),
+and when the configuration or the machine changes. Otherwise the gate compares with a service
+that no longer exists.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import boto3
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+WEBSERVICE_DIR = ROOT / "webservice"
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+
+sys.path.insert(0, str(ROOT / "terraform"))
+from data import data as SAMPLE_POSTS  # noqa: E402
+
+TABLE = "MyDynamoDB"
+BUCKET = "postagram-bench-bucket"
+REGION = "us-east-1"
+LABELS = ["Sword", "Weapon", "Person", "Robot", "Anime", "Art", "Blade", "Toy", "Poster", "Face"]
+
+# Part de chaque type de requête dans la charge
+WORKLOAD = {
+    "GET /posts": 0.45,
+    "GET /posts?user=": 0.30,
+    "POST /posts": 0.20,
+    "DELETE /posts/{id}": 0.05,
+}
+GATED_ENDPOINTS = ["GET /posts", "GET /posts?user=", "POST /posts"]
+MIN_SAMPLES = 20
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def rss_mb(pid):
+    """Resident memory of a process, read from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def aws_env(endpoint_url):
+    return {
+        "AWS_ENDPOINT_URL": endpoint_url,
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": REGION,
+    }
+
+
+def create_resources(endpoint_url):
+    dynamodb = boto3.resource("dynamodb", endpoint_url=endpoint_url, region_name=REGION)
+    dynamodb.create_table(
+        TableName=TABLE,
+        KeySchema=[{"AttributeName": "user", "KeyType": "HASH"}, {"AttributeName": "id", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "user", "AttributeType": "S"},
+            {"AttributeName": "id", "AttributeType": "S"},
+            {"AttributeName": "created_at", "AttributeType": "S"},
+        ],
+        LocalSecondaryIndexes=[{
+            "IndexName": "created_at-index",
+            "KeySchema": [{"AttributeName": "user", "KeyType": "HASH"}, {"AttributeName": "created_at", "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": "ALL"},
+        }],
+        ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+    )
+    boto3.client("s3", endpoint_url=endpoint_url, region_name=REGION).create_bucket(Bucket=BUCKET)
+    return dynamodb.Table(TABLE)
+
+
+def seed(table, users, posts_per_user, rng):
+    """Write users x posts_per_user posts built from the rows of terraform/data.py."""
+    user_names = [f"user{i:04d}" for i in range(users)]
+    ids = []
+    with table.batch_writer() as batch:
+        for user in user_names:
+            for n in range(posts_per_user):
+                sample = rng.choice(SAMPLE_POSTS)
+                post_id = str(uuid.UUID(int=rng.getrandbits(128)))
+                filename = sample["image"].rsplit("/", 1)[-1]
+                batch.put_item(Item={
+                    "user": user,
+                    "id": post_id,
+                    "title": f"{sample['title']} #{n}",
+                    "body": sample["body"],
+                    "image": f"{user}/{post_id}/{filename}",
+                    "labels": rng.sample(LABELS, 3),
+                    "created_at": f"2025-05-04T10:{n // 60 % 60:02d}:{n % 60:02d}.000000Z",
+                })
+                ids.append((user, post_id))
+    return user_names, ids
+
+
+def wait_for(url, process, name):
+    deadline = time.time() + 30
+    while time.time() < deadline and process.poll() is None:
+        try:
+            httpx.get(url, timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{name} did not start")
+
+
+def start_moto(port, log):
+    # Processus séparé : moto ne doit pas partager le GIL avec le générateur de charge.
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    return wait_for(f"http://127.0.0.1:{port}/moto-api/", process, "moto server")
+
+
+def start_webservice(endpoint_url, port, log):
+    env = dict(os.environ, **aws_env(endpoint_url), BUCKET=BUCKET, DYNAMO_TABLE=TABLE)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=WEBSERVICE_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    return wait_for(f"http://127.0.0.1:{port}/docs", process, "webservice")
+
+
+class Workload:
+    def __init__(self, base_url, users, post_ids, seed_value):
+        self.base_url = base_url
+        self.users = users
+        self.post_ids = list(post_ids)
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.seed_value = seed_value
+
+    def _pick(self, rng):
+        roll = rng.random()
+        for name, share in WORKLOAD.items():
+            roll -= share
+            if roll <= 0:
+                return name
+        return name
+
+    def _request(self, client, name, rng):
+        user = rng.choice(self.users)
+        if name == "GET /posts":
+            return client.get("/posts")
+        if name == "GET /posts?user=":
+            return client.get("/posts", params={"user": user})
+        if name == "POST /posts":
+            response = client.post("/posts", json={"title": "Bench", "body": "Publication de test"}, headers={"authorization": user})
+            if response.status_code == 201:
+                with self.lock:
+                    self.post_ids.append((user, response.json()["id"]))
+            return response
+        with self.lock:
+            if not self.post_ids:
+                return None
+            owner, post_id = self.post_ids.pop(rng.randrange(len(self.post_ids)))
+        return client.delete(f"/posts/{post_id}", headers={"authorization": owner})
+
+    def worker(self, worker_id, stop_at, record_after, only=None):
+        """Send requests until `stop_at`, recording them after `record_after`; only `only` if given."""
+        rng = random.Random(self.seed_value * 1000 + worker_id)
+        with httpx.Client(base_url=self.base_url, timeout=30) as client:
+            while time.time() < stop_at:
+                name = only or self._pick(rng)
+                started = time.perf_counter()
+                response = self._request(client, name, rng)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if response is None and only:
+                    # Plus aucun post à supprimer.
+                    break
+                if response is None or time.time() < record_after:
+                    continue
+                with self.lock:
+                    if response.status_code >= 400:
+                        self.errors[name] += 1
+                    else:
+                        self.latencies[name].append(elapsed_ms)
+
+
+def drive(workload, process, concurrency, stop_at, record_after, only=None):
+    """Run `concurrency` workers until `stop_at` and return the peak RSS of `process` meanwhile."""
+    peak_rss = rss_mb(process.pid) or 0.0
+    threads = [threading.Thread(target=workload.worker, args=(i, stop_at, record_after, only)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        peak_rss = max(peak_rss, rss_mb(process.pid) or 0.0)
+        time.sleep(0.2)
+    return peak_rss
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    log = open(args.log, "w")
+    moto_port = free_port()
+    moto = start_moto(moto_port, log)
+    endpoint_url = f"http://127.0.0.1:{moto_port}"
+    os.environ.update(aws_env(endpoint_url))
+    process = None
+    try:
+        table = create_resources(endpoint_url)
+        users, post_ids = seed(table, args.users, args.posts, rng)
+        print(f"Seeded {len(post_ids)} posts for {len(users)} users")
+
+        port = free_port()
+        process = start_webservice(endpoint_url, port, log)
+        workload = Workload(f"http://127.0.0.1:{port}", users, post_ids, args.seed)
+
+        started = time.time()
+        record_after = started + args.warmup
+        stop_at = record_after + args.duration
+        peak_rss = drive(workload, process, args.concurrency, stop_at, record_after)
+
+        memory = {}
+        for name in WORKLOAD if args.rss_seconds > 0 else []:
+            before = rss_mb(process.pid) or 0.0
+            stop_at = time.time() + args.rss_seconds
+            peak = drive(workload, process, args.concurrency, stop_at, stop_at, only=name)
+            memory[name] = {"rss_peak_mb": round(peak, 1), "rss_growth_mb": round(max(0.0, peak - before), 1)}
+            peak_rss = max(peak_rss, peak)
+
+        results = {}
+        for name in WORKLOAD:
+            samples = workload.latencies[name]
+            results[name] = {
+                "requests": len(samples),
+                "errors": workload.errors[name],
+                "throughput_rps": round(len(samples) / args.duration, 2),
+                "p50_ms": round(percentile(samples, 50), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+                "mean_ms": round(statistics.fmean(samples), 2) if samples else 0.0,
+                **memory.get(name, {}),
+            }
+        return {
+            "config": {k: getattr(args, k) for k in ("users", "posts", "concurrency", "duration", "rss_seconds", "seed")},
+            "peak_rss_mb": round(peak_rss, 1),
+            "throughput_rps": round(sum(r["throughput_rps"] for r in results.values()), 2),
+            "endpoints": results,
+        }
+    finally:
+        for child in (process, moto):
+            if child:
+                child.terminate()
+                child.wait(timeout=10)
+        log.close()
+
+
+def compare(result, baseline, tolerance):
+    """Return the list of regressions of `result` against `baseline`."""
+    regressions = []
+    if result["config"] != baseline.get("config"):
+        print(f"WARNING the baseline was recorded with {baseline.get('config')}, this run uses {result['config']}")
+    for name in GATED_ENDPOINTS:
+        current = result["endpoints"].get(name)
+        reference = baseline["endpoints"].get(name)
+        if not current or not reference or min(current["requests"], reference["requests"]) < MIN_SAMPLES:
+            print(f"Not enough samples to gate {name}")
+            continue
+        if current["p50_ms"] > reference["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {current['p50_ms']} ms > baseline {reference['p50_ms']} ms")
+        if current["p95_ms"] > reference["p95_ms"] * (1 + 2 * tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms > baseline {reference['p95_ms']} ms")
+        if current["errors"] > reference["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors > baseline {reference['errors']}")
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput_rps']} req/s < baseline {baseline['throughput_rps']} req/s")
+    return regressions
+
+
+def print_report(result):
+    print(f"\n{'endpoint':<22}{'req':>7}{'err':>5}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'RSS MB':>9}{'growth':>8}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<22}{stats['requests']:>7}{stats['errors']:>5}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+              f"{stats.get('rss_peak_mb', '-'):>9}{stats.get('rss_growth_mb', '-'):>8}")
+    print(f"total: {result['throughput_rps']} req/s, peak RSS of the webservice: {result['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--posts", type=int, default=20, help="posts per user")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds run before measuring")
+    parser.add_argument("--rss-seconds", type=float, default=5, help="seconds each endpoint is driven alone for its RSS, 0 to skip")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", type=Path, help="also write the result as JSON")
+    parser.add_argument("--log", type=Path, default=Path(__file__).resolve().parent / "bench.log",
+                        help="output of moto and of the webservice")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print("No baseline to compare with, run with --save-baseline first.")
+        return 0
+    regressions = compare(result, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
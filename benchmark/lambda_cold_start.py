@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Cold start and warm latency of the Rekognition lambda (terraform/lambda/lambda_function.py).
+
+Local mode (default) runs the handler in fresh python processes against a moto server:
+each process reports the time to import the module (the lambda's init phase) and the
+latency of its first and following invocations, per record.
+
+    python benchmark/lambda_cold_start.py --runs 5 --records 4
+
+Remote mode measures the deployed function for each memory size. The function configuration
+is updated before every run (new memory size and a nonce variable) so that each first
+invocation is a cold start; "Init Duration" and "Duration" are read from the REPORT line of
+the invocation log. The image must already be in the bucket; after the first invocation its
+labels come from the label cache, so warm latencies are those of a cache hit.
+
+    python benchmark/lambda_cold_start.py --remote --bucket my-bucket --key user/post/image.jpg \\
+        --memory 128 256 512 1024
+
+The remote mode changes the function configuration: it restores the original memory size and
+environment at the end, run it outside of traffic.
+"""
+
+import argparse
+import base64
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+
+import boto3
+
+from bench import REGION, aws_env, free_port, percentile, start_moto
+
+ROOT = Path(__file__).resolve().parent.parent
+LAMBDA_DIR = ROOT / "terraform" / "lambda"
+SAMPLE_IMAGE = next((ROOT / "terraform" / "s3").rglob("*.jp*g"))
+
+TABLE = "MyDynamoDB"
+LABEL_CACHE_TABLE = "LabelCache"
+BUCKET = "postagram-coldstart-bucket"
+FUNCTION_NAME = "postagram-rekognition-lambda"
+
+REPORT_PATTERN = re.compile(r"(Init Duration|Duration): ([\d.]+) ms")
+
+
+def s3_event(bucket, keys):
+    return {"Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key}}} for key in keys]}
+
+
+def create_resources(endpoint_url, posts):
+    dynamodb = boto3.client("dynamodb", endpoint_url=endpoint_url, region_name=REGION)
+    dynamodb.create_table(
+        TableName=TABLE,
+        KeySchema=[{"AttributeName": "user", "KeyType": "HASH"}, {"AttributeName": "id", "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": "user", "AttributeType": "S"}, {"AttributeName": "id", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName=LABEL_CACHE_TABLE,
+        KeySchema=[{"AttributeName": "content_hash", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "content_hash", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name=REGION)
+    s3.create_bucket(Bucket=BUCKET)
+    image = SAMPLE_IMAGE.read_bytes()
+    keys = []
+    for n in range(posts):
+        post_id = str(uuid.uuid4())
+        dynamodb.put_item(TableName=TABLE, Item={
+            "user": {"S": "bench"}, "id": {"S": post_id}, "title": {"S": f"Post {n}"}, "body": {"S": "Corps"},
+        })
+        # Contenus distincts : sinon tout sauf le premier passerait par le cache de labels.
+        key = f"bench/{post_id}/image{n}.jpg"
+        s3.put_object(Bucket=BUCKET, Key=key, Body=image + n.to_bytes(4, "big"))
+        keys.append(key)
+    return keys
+
+
+# Exécuté dans un interpréteur neuf (un démarrage à froid) : rien n'y est importé avant la mesure de l'init.
+CHILD_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import lambda_function
+init_ms = (time.perf_counter() - started) * 1000
+invocations = []
+for event in json.loads(sys.argv[1]):
+    started = time.perf_counter()
+    lambda_function.lambda_handler(event, None)
+    invocations.append((time.perf_counter() - started) * 1000 / len(event["Records"]))
+print(json.dumps({"init_ms": init_ms, "invocations_ms": invocations}))
+"""
+
+
+def run_local(args):
+    log = open(args.log, "w")
+    moto_port = free_port()
+    moto = start_moto(moto_port, log)
+    endpoint_url = f"http://127.0.0.1:{moto_port}"
+    os.environ.update(aws_env(endpoint_url))
+    try:
+        per_run = args.records * args.invocations
+        all_keys = create_resources(endpoint_url, per_run * args.runs)
+        runs = []
+        for run in range(args.runs):
+            # Nouveaux posts à chaque processus : le cache de labels est froid comme après un déploiement.
+            keys = all_keys[run * per_run:(run + 1) * per_run]
+            env = dict(os.environ, **aws_env(endpoint_url), DYNAMO_TABLE=TABLE, LABEL_CACHE_TABLE=LABEL_CACHE_TABLE,
+                       BUCKET=BUCKET, PREWARM_CLIENTS="1" if args.prewarm else "0")
+            events = [s3_event(BUCKET, keys[start:start + args.records]) for start in range(0, per_run, args.records)]
+            output = subprocess.run(
+                [sys.executable, "-c", CHILD_SCRIPT, json.dumps(events)],
+                cwd=LAMBDA_DIR, env=env, stdout=subprocess.PIPE, stderr=log, check=True, text=True,
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        moto.terminate()
+        moto.wait(timeout=10)
+        log.close()
+
+    init = [r["init_ms"] for r in runs]
+    first = [r["invocations_ms"][0] for r in runs]
+    warm = [ms for r in runs for ms in r["invocations_ms"][1:]]
+    return {"local": {
+        "runs": args.runs,
+        "records_per_invocation": args.records,
+        "init_p50_ms": round(statistics.median(init), 1),
+        "init_max_ms": round(max(init), 1),
+        "first_invocation_per_record_p50_ms": round(statistics.median(first), 1),
+        "warm_per_record_p50_ms": round(percentile(warm, 50), 1) if warm else None,
+        "warm_per_record_p95_ms": round(percentile(warm, 95), 1) if warm else None,
+    }}
+
+
+def invoke(lambda_client, function_name, event):
+    response = lambda_client.invoke(FunctionName=function_name, Payload=json.dumps(event).encode(), LogType="Tail")
+    if response.get("FunctionError"):
+        raise RuntimeError(f"{function_name} failed: {response['Payload'].read()[:500]}")
+    report = dict(REPORT_PATTERN.findall(base64.b64decode(response["LogResult"]).decode()))
+    return float(report.get("Init Duration", 0.0)), float(report["Duration"])
+
+
+def run_remote(args):
+    lambda_client = boto3.client("lambda", region_name=REGION)
+    original = lambda_client.get_function_configuration(FunctionName=args.function)
+    variables = original.get("Environment", {}).get("Variables", {})
+    event = s3_event(args.bucket, [args.key] * args.records)
+    waiter = lambda_client.get_waiter("function_updated_v2")
+    results = {}
+    try:
+        for memory in args.memory:
+            init, first, warm = [], [], []
+            for _ in range(args.runs):
+                # Toute modification de configuration recycle les environnements : la prochaine invocation est froide.
+                lambda_client.update_function_configuration(
+                    FunctionName=args.function, MemorySize=memory,
+                    Environment={"Variables": dict(variables, COLD_START_NONCE=uuid.uuid4().hex)},
+                )
+                waiter.wait(FunctionName=args.function)
+                init_ms, duration_ms = invoke(lambda_client, args.function, event)
+                init.append(init_ms)
+                first.append(duration_ms / args.records)
+                for _ in range(args.invocations - 1):
+                    warm.append(invoke(lambda_client, args.function, event)[1] / args.records)
+            results[memory] = {
+                "init_p50_ms": round(statistics.median(init), 1),
+                "first_invocation_per_record_p50_ms": round(statistics.median(first), 1),
+                "warm_per_record_p50_ms": round(percentile(warm, 50), 1) if warm else None,
+                "warm_per_record_p95_ms": round(percentile(warm, 95), 1) if warm else None,
+            }
+            print(f"{memory} MB: {results[memory]}")
+    finally:
+        lambda_client.update_function_configuration(
+            FunctionName=args.function, MemorySize=original["MemorySize"], Environment={"Variables": variables},
+        )
+    return {"remote": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts measured (per memory size with --remote)")
+    parser.add_argument("--invocations", type=int, default=5, help="invocations per cold start, the first one included")
+    parser.add_argument("--records", type=int, default=4, help="S3 records per invocation")
+    parser.add_argument("--prewarm", action="store_true", help="local mode: build the AWS clients during init")
+    parser.add_argument("--remote", action="store_true", help="measure the deployed function instead")
+    parser.add_argument("--function", default=FUNCTION_NAME)
+    parser.add_argument("--memory", type=int, nargs="+", default=[128, 256, 512, 1024])
+    parser.add_argument("--bucket", help="remote mode: bucket of the image")
+    parser.add_argument("--key", help="remote mode: key of an image of an existing post")
+    parser.add_argument("--output", type=Path, help="also write the result as JSON")
+    parser.add_argument("--log", type=Path, default=Path(__file__).resolve().parent / "bench.log",
+                        help="output of moto and of the lambda")
+    args = parser.parse_args()
+
+    if args.remote and not (args.bucket and args.key):
+        parser.error("--remote requires --bucket and --key")
+
+    result = run_remote(args) if args.remote else run_local(args)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
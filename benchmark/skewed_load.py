@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+"""Throughput of the webservice under a skewed load, without and with write sharding.
+
+Users are drawn from a Zipf distribution, so a handful of accounts receive most of the
+POST /posts and GET /posts?user= requests. The run is repeated for every value of --shards
+(USER_SHARDS of the webservice, see webservice/sharding.py) on a fresh table.
+
+moto does not throttle, so the webservice talks to it through a proxy that enforces
+per-partition capacity the way DynamoDB does: every value of the `user` hash key gets its own
+token buckets of --partition-rcu read units and --partition-wcu write units per second (one
+second of burst), and a request to an exhausted partition gets a
+ProvisionedThroughputExceededException that botocore retries with backoff. Reads are charged
+after the response (0.5 unit per 4 KB, eventually consistent), writes before (1 unit per KB).
+Only the posts table is limited; DynamoDB's adaptive capacity and burst credits are not modelled.
+
+The limits are scaled down to what moto can serve: it answers every call on its own CPU, so
+the extra queries of a scatter-gather read cost more there than they would on DynamoDB, where
+they run in parallel. Keep --concurrency low enough for moto not to be the bottleneck.
+
+    python benchmark/skewed_load.py                       # USER_SHARDS=1 then 4
+    python benchmark/skewed_load.py --shards 1 4 8 --zipf 1.5 --partition-wcu 1
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+from bench import (SAMPLE_POSTS, TABLE, aws_env, create_resources, free_port, percentile, start_moto,
+                   start_webservice)
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webservice"))
+from sharding import ShardScheme  # noqa: E402
+
+WORKLOAD = {"POST /posts": 0.5, "GET /posts?user=": 0.5}
+THROTTLED = {
+    "__type": "com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException",
+    "message": "The level of configured provisioned throughput for the table was exceeded (simulated partition limit)",
+}
+READ_OPERATIONS = {"GetItem", "Query"}
+WRITE_OPERATIONS = {"PutItem", "UpdateItem", "DeleteItem"}
+# Hop-by-hop ou recalculés par le proxy.
+SKIPPED_HEADERS = {"host", "content-length", "transfer-encoding", "connection", "content-encoding"}
+
+
+def partition_of(operation, request):
+    """Value of the `user` hash key a single-partition request targets, or None."""
+    if operation == "PutItem":
+        return request.get("Item", {}).get("user", {}).get("S")
+    if operation in ("GetItem", "UpdateItem", "DeleteItem"):
+        return request.get("Key", {}).get("user", {}).get("S")
+    if operation == "Query":
+        aliases = [alias for alias, name in request.get("ExpressionAttributeNames", {}).items() if name == "user"]
+        for alias in aliases + ["user"]:
+            match = re.search(rf"(?<![\w#]){re.escape(alias)}\s*=\s*(:\w+)", request.get("KeyConditionExpression", ""))
+            if match:
+                return request.get("ExpressionAttributeValues", {}).get(match.group(1), {}).get("S")
+    return None
+
+
+class PartitionLimiter:
+    """Token buckets per (partition, read|write), refilled continuously up to one second of capacity."""
+
+    def __init__(self, rcu, wcu):
+        self.rates = {"read": rcu, "write": wcu}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.throttles = defaultdict(int)
+        self.consumed = defaultdict(float)
+
+    def _bucket(self, partition, kind, now):
+        bucket = self._buckets.get((partition, kind))
+        rate = self.rates[kind]
+        if bucket is None:
+            bucket = self._buckets[(partition, kind)] = [rate, now]
+        bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        return bucket
+
+    def admit(self, partition, kind):
+        with self._lock:
+            if self._bucket(partition, kind, time.monotonic())[0] > 0:
+                return True
+            self.throttles[kind] += 1
+            return False
+
+    def charge(self, partition, kind, units):
+        # Le solde peut devenir négatif : une grosse lecture rend la partition indisponible plus longtemps.
+        with self._lock:
+            self._bucket(partition, kind, time.monotonic())[0] -= units
+            self.consumed[partition] += units
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self.throttles.clear()
+            self.consumed.clear()
+
+
+def make_proxy(upstream, limiter, table_name):
+    client = httpx.Client(base_url=upstream, timeout=30)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, headers, body):
+            self.send_response(status)
+            for name, value in headers:
+                if name.lower() not in SKIPPED_HEADERS:
+                    self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _forward(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            target = self.headers.get("X-Amz-Target", "")
+            operation = target.rsplit(".", 1)[-1] if target.startswith("DynamoDB_") else None
+            kind = "read" if operation in READ_OPERATIONS else "write" if operation in WRITE_OPERATIONS else None
+            partition = None
+            if kind:
+                request = json.loads(body or b"{}")
+                if request.get("TableName") == table_name:
+                    partition = partition_of(operation, request)
+            if partition is not None and not limiter.admit(partition, kind):
+                return self._reply(400, [("Content-Type", "application/x-amz-json-1.0")], json.dumps(THROTTLED).encode())
+            if partition is not None and kind == "write":
+                limiter.charge(partition, kind, max(1, math.ceil(len(body) / 1024)))
+            headers = [(name, value) for name, value in self.headers.items() if name.lower() not in SKIPPED_HEADERS]
+            response = client.request(self.command, self.path, content=body, headers=headers)
+            if partition is not None and kind == "read":
+                limiter.charge(partition, kind, 0.5 * max(1, math.ceil(len(response.content) / 4096)))
+            self._reply(response.status_code, response.headers.multi_items(), response.content)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _forward
+
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def zipf_weights(users, exponent):
+    return [1 / rank ** exponent for rank in range(1, users + 1)]
+
+
+def seed(table, scheme, users, posts_per_user, rng):
+    """A few posts per user, written straight to moto under the keys of `scheme`."""
+    with table.batch_writer() as batch:
+        for user in users:
+            for n in range(posts_per_user):
+                sample = rng.choice(SAMPLE_POSTS)
+                batch.put_item(Item=scheme.to_storage({
+                    "user": user,
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "title": f"{sample['title']} #{n}",
+                    "body": sample["body"],
+                    "created_at": f"2025-05-04T10:{n // 60 % 60:02d}:{n % 60:02d}.000000Z",
+                }))
+
+
+class Workload:
+    def __init__(self, base_url, users, weights, seed_value):
+        self.base_url = base_url
+        self.users = users
+        self.cumulative = list(_accumulate(weights))
+        self.seed_value = seed_value
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.hot_requests = 0
+
+    def worker(self, worker_id, stop_at, record_after):
+        rng = random.Random(self.seed_value * 1000 + worker_id)
+        names, shares = list(WORKLOAD), list(WORKLOAD.values())
+        with httpx.Client(base_url=self.base_url, timeout=60) as client:
+            while time.time() < stop_at:
+                name = rng.choices(names, shares)[0]
+                user = rng.choices(self.users, cum_weights=self.cumulative)[0]
+                started = time.perf_counter()
+                if name == "POST /posts":
+                    response = client.post("/posts", json={"title": "Skew", "body": "Publication de test"},
+                                           headers={"authorization": user})
+                else:
+                    response = client.get("/posts", params={"user": user, "limit": 20})
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if time.time() < record_after:
+                    continue
+                with self.lock:
+                    if user == self.users[0]:
+                        self.hot_requests += 1
+                    if response.status_code >= 400:
+                        self.errors[name] += 1
+                    else:
+                        self.latencies[name].append(elapsed_ms)
+
+
+def _accumulate(weights):
+    total = 0.0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+def run_scheme(shards, args, moto_url, proxy_url, limiter, log):
+    httpx.post(f"{moto_url}/moto-api/reset")
+    table = create_resources(moto_url)
+    rng = random.Random(args.seed)
+    users = [f"user{i:04d}" for i in range(args.users)]
+    seed(table, ShardScheme(shards), users, args.posts, rng)
+
+    os.environ.update(USER_SHARDS=str(shards), USER_SHARDS_LEGACY_READS="0")
+    port = free_port()
+    process = start_webservice(proxy_url, port, log)
+    try:
+        workload = Workload(f"http://127.0.0.1:{port}", users, zipf_weights(args.users, args.zipf), args.seed)
+        started = time.time()
+        record_after = started + args.warmup
+        stop_at = record_after + args.duration
+        threads = [threading.Thread(target=workload.worker, args=(i, stop_at, record_after)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        time.sleep(max(0.0, record_after - time.time()))
+        limiter.reset()
+        for thread in threads:
+            thread.join()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    endpoints = {}
+    for name in WORKLOAD:
+        samples = workload.latencies[name]
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": workload.errors[name],
+            "throughput_rps": round(len(samples) / args.duration, 2),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "mean_ms": round(statistics.fmean(samples), 2) if samples else 0.0,
+        }
+    total = sum(stats["requests"] + stats["errors"] for stats in endpoints.values())
+    hottest = max(limiter.consumed.values(), default=0.0)
+    return {
+        "shards": shards,
+        "throughput_rps": round(sum(stats["throughput_rps"] for stats in endpoints.values()), 2),
+        "hot_user_share": round(workload.hot_requests / total, 3) if total else 0.0,
+        "throttles": dict(limiter.throttles),
+        "hottest_partition_units_per_s": round(hottest / args.duration, 1),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(results):
+    print(f"\n{'shards':>6} {'endpoint':<18}{'ok':>7}{'err':>5}{'req/s':>9}{'p50':>9}{'p95':>9}")
+    for result in results:
+        for name, stats in result["endpoints"].items():
+            print(f"{result['shards']:>6} {name:<18}{stats['requests']:>7}{stats['errors']:>5}"
+                  f"{stats['throughput_rps']:>9}{stats['p50_ms']:>9}{stats['p95_ms']:>9}")
+        throttles = result["throttles"]
+        print(f"{'':>6} total {result['throughput_rps']} req/s, throttled reads {throttles.get('read', 0)}, "
+              f"writes {throttles.get('write', 0)}, hottest partition {result['hottest_partition_units_per_s']} units/s, "
+              f"hot user {result['hot_user_share']:.0%} of requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 4], help="USER_SHARDS values to compare")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=10, help="posts per user seeded before the run")
+    parser.add_argument("--zipf", type=float, default=1.2, help="exponent of the user distribution")
+    parser.add_argument("--partition-rcu", type=float, default=2, help="read units per second and partition")
+    parser.add_argument("--partition-wcu", type=float, default=2, help="write units per second and partition")
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds run before measuring")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="also write the results as JSON")
+    parser.add_argument("--log", type=Path, default=Path(__file__).resolve().parent / "skewed_load.log",
+                        help="output of moto and of the webservice")
+    args = parser.parse_args()
+
+    log = open(args.log, "w")
+    moto_port = free_port()
+    moto = start_moto(moto_port, log)
+    moto_url = f"http://127.0.0.1:{moto_port}"
+    os.environ.update(aws_env(moto_url))
+    limiter = PartitionLimiter(args.partition_rcu, args.partition_wcu)
+    proxy = make_proxy(moto_url, limiter, TABLE)
+    proxy_url = f"http://127.0.0.1:{proxy.server_address[1]}"
+    results = []
+    try:
+        for shards in args.shards:
+            print(f"USER_SHARDS={shards}: {args.concurrency} clients for {args.duration:.0f} s...")
+            results.append(run_scheme(shards, args, moto_url, proxy_url, limiter, log))
+    finally:
+        proxy.shutdown()
+        moto.terminate()
+        moto.wait(timeout=10)
+        log.close()
+
+    print_report(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,53 +1,316 @@
+#!/usr/bin/env python
+"""Remplit le bucket S3 et la table DynamoDB de la partie serverless.
+
+Envoie les images du dossier s3/ et les posts de data.py, puis, à la demande, des
+utilisateurs, posts et images synthétiques pour les tests de charge. Les fichiers sont
+envoyés en parallèle (multipart au-delà de --multipart-mb) et les items par
+batch_write_item depuis plusieurs threads.
+
+Le bucket et la table sont lus dans les outputs terraform :
+
+    cdktf output cdktf_serverless --outputs-file outputs.json
+    python import_data.py                                  # données d'exemple
+    python import_data.py --users 200 --posts-per-user 50  # + 10 000 posts synthétiques
+
+Un manifeste (--manifest) garde l'ETag de chaque objet envoyé et les lots d'items écrits :
+relancer la commande après une interruption reprend là où elle s'était arrêtée, et un
+fichier inchangé (même ETag) n'est pas renvoyé.
+
+Avec --shards N (par défaut USER_SHARDS), les posts sont écrits sous les clés user#shard du
+webservice ; shard_posts.py range les posts déjà importés sans découpage.
+"""
+import argparse
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
-from os import walk
-import os 
 
 from data import data
 
-bucket = "my-cdtf-test-bucket20250504105753107800000001"
-table_name = "MyDynamoDB"
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "webservice"))
+from sharding import ShardScheme  # noqa: E402
+
+try:
+    # Pillow génère des images synthétiques variées ; sans lui on réutilise celles de s3/.
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+MB = 1024 * 1024
+ITEM_CHUNK_SIZE = 500
+
+TITLES = ["Nouvelle figurine", "Fan art", "Cosplay du week-end", "Combat final", "Souvenir de convention",
+          "Dessin du jour", "Collection complète", "Premier essai", "Scène culte", "Affiche rétro"]
+BODIES = ["Qu'en pensez-vous ?", "Fait main, deux semaines de travail.", "Le meilleur épisode de la saison !",
+          "Trouvé en brocante.", "Encore un peu de peinture et c'est fini.", "Photo prise hier soir."]
+
+
+def read_outputs(path, stack="cdktf_serverless"):
+    """Bucket and table names from `cdktf output --outputs-file`."""
+    with open(path) as f:
+        outputs = json.load(f)
+    outputs = outputs.get(stack, outputs)
+
+    def find(prefix):
+        # cdktf peut suffixer le nom des outputs : on cherche par préfixe.
+        for name, value in outputs.items():
+            if name.startswith(prefix):
+                return value
+        raise KeyError(f"Output '{prefix}' absent de {path}")
+
+    return find("bucket_name_output"), find("table_name_output")
+
+
+def etag_of(stream, threshold, chunk_size):
+    """ETag S3 attendu pour ce contenu, envoyé avec la même TransferConfig."""
+    whole = hashlib.md5()
+    digests = []
+    size = 0
+    while block := stream.read(chunk_size):
+        whole.update(block)
+        digests.append(hashlib.md5(block).digest())
+        size += len(block)
+    if size < threshold:
+        return whole.hexdigest()
+    # Objet multipart : MD5 des MD5 des parties, suivi du nombre de parties.
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+class Manifest:
+    """État de la reprise, sauvegardé régulièrement pendant l'import."""
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.objects = {}
+        self.item_chunks = set()
+        self._lock = threading.Lock()
+        self._dirty = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.objects = saved.get("objects", {})
+            if saved.get("fingerprint") == fingerprint:
+                self.item_chunks = set(saved.get("item_chunks", []))
+
+    def uploaded(self, key, etag):
+        with self._lock:
+            self.objects[key] = etag
+            self._dirty += 1
+        if self._dirty >= 100:
+            self.save()
+
+    def chunk_written(self, index):
+        with self._lock:
+            self.item_chunks.add(index)
+            self._dirty += 1
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {"fingerprint": self.fingerprint, "objects": self.objects, "item_chunks": sorted(self.item_chunks)}
+            self._dirty = 0
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+
+
+def sample_files():
+    """(clé S3, chemin local) de toutes les images du dossier s3/."""
+    root = os.path.join(HERE, "s3")
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            yield os.path.relpath(path, root).replace(os.sep, "/"), path
 
 
-s3 = boto3.resource('s3')
+def synthetic_image(rng, size):
+    if Image is None:
+        return None
+    image = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size), rng.randrange(size)
+        r = rng.randrange(size // 16, size // 3)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
 
-print(f"Téléversement des fichiers du dossier 's3' vers le bucket '{bucket}'...")
-for dirpath, dirnames, filenames in walk("s3"):
-    if filenames:
-        local_file_path = os.path.join(dirpath, filenames[0])
-        s3_key = "/".join(dirpath.split(os.sep)[1:]) + "/" + filenames[0]
-        if not s3_key.startswith('/'):
-            print(f"  -> Téléversement de '{local_file_path}' vers 's3://{bucket}/{s3_key}'")
+
+def synthetic_dataset(args):
+    """Items et images (clé S3, fonction ouvrant le contenu) synthétiques, identiques d'un lancement à l'autre."""
+    rng = random.Random(args.seed)
+    samples = [path for _, path in sample_files()]
+    items, images = [], []
+    for u in range(args.users):
+        user = f"user{u:05d}"
+        for n in range(args.posts_per_user):
+            post_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            item = {
+                "user": user,
+                "id": post_id,
+                "title": f"{rng.choice(TITLES)} #{n}",
+                "body": rng.choice(BODIES),
+                "image": None,
+                "labels": [],
+                "created_at": f"2025-05-{1 + n // 1440 % 28:02d}T{n // 60 % 24:02d}:{n % 60:02d}:00.000000Z",
+            }
+            if rng.random() < args.image_ratio:
+                item["image"] = f"{user}/{post_id}/image-{n}.jpg"
+                images.append((item["image"], rng.getrandbits(32)))
+            items.append(item)
+
+    def open_image(seed):
+        generated = synthetic_image(random.Random(seed), args.image_size)
+        if generated is not None:
+            return io.BytesIO(generated)
+        return open(samples[seed % len(samples)], "rb")
+
+    return items, [(key, lambda seed=seed: open_image(seed)) for key, seed in images]
+
+
+def upload_all(s3_client, bucket, sources, manifest, args, transfer_config):
+    """Envoie les (clé, fonction ouvrant le contenu) en parallèle ; renvoie les compteurs de l'envoi."""
+    stats = {"uploaded": 0, "skipped": 0, "bytes": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def upload(key, open_body):
+        with open_body() as body:
+            etag = etag_of(body, transfer_config.multipart_threshold, transfer_config.multipart_chunksize)
+            size = body.tell()
+            if manifest.objects.get(key) == etag:
+                outcome = "skipped"
+            else:
+                body.seek(0)
+                content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+                s3_client.upload_fileobj(body, bucket, key, ExtraArgs={"ContentType": content_type}, Config=transfer_config)
+                manifest.uploaded(key, etag)
+                outcome = "uploaded"
+        with lock:
+            stats[outcome] += 1
+            stats["bytes"] += size if outcome == "uploaded" else 0
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(upload, key, load): key for key, load in sources}
+        for future in as_completed(futures):
             try:
-                with open(local_file_path, 'rb') as file_body:
-                    s3.Object(bucket, s3_key).put(Body=file_body)
+                future.result()
             except Exception as e:
-                print(f"  ERREUR lors du téléversement de {local_file_path}: {e}")
-        else:
-             print(f"  Ignoré: Fichier directement dans le dossier racine 's3': {local_file_path}")
-
-
-print(f"\nÉcriture batch dans la table DynamoDB '{table_name}'...")
-my_config = Config(
-    region_name='us-east-1',
-    signature_version='v4',
-)
-
-dynamodb = boto3.resource('dynamodb', config=my_config)
-table_object = dynamodb.Table(table_name)
-
-if data:
-    try:
-        with table_object.batch_writer() as batch:
-            item_count = 0
-            for row in data:
-                batch.put_item(Item=row)
-                item_count += 1
-            print(f"  {item_count} items envoyés à l'écriture batch.")
-        print("  Écriture batch terminée.")
-    except Exception as e:
-        print(f"  ERREUR durant l'écriture batch DynamoDB: {e}")
-else:
-    print("  Aucune donnée à écrire dans DynamoDB (variable 'data' vide ou non importée).")
-
-print("\nScript import_data.py terminé.")
\ No newline at end of file
+                stats["errors"] += 1
+                print(f"  ERREUR lors du téléversement de {futures[future]}: {e}")
+    manifest.save()
+    return stats
+
+
+def write_items(table, items, manifest, args):
+    """Écrit les items par lots de ITEM_CHUNK_SIZE, plusieurs lots en parallèle."""
+    chunks = [items[start:start + ITEM_CHUNK_SIZE] for start in range(0, len(items), ITEM_CHUNK_SIZE)]
+    todo = [index for index in range(len(chunks)) if index not in manifest.item_chunks]
+    stats = {"written": 0, "skipped": sum(len(chunks[i]) for i in manifest.item_chunks if i < len(chunks)), "errors": 0}
+
+    def write(index):
+        # batch_writer regroupe par 25 et renvoie lui-même les UnprocessedItems.
+        with table.batch_writer() as batch:
+            for item in chunks[index]:
+                batch.put_item(Item=item)
+        manifest.chunk_written(index)
+        return len(chunks[index])
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(write, index): index for index in todo}
+        for future in as_completed(futures):
+            try:
+                stats["written"] += future.result()
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"  ERREUR durant l'écriture du lot {futures[future]}: {e}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outputs", default=os.path.join(HERE, "outputs.json"), help="fichier de `cdktf output --outputs-file`")
+    parser.add_argument("--bucket", help="bucket S3 (sinon lu dans les outputs)")
+    parser.add_argument("--table", help="table DynamoDB (sinon lue dans les outputs)")
+    parser.add_argument("--manifest", default=os.path.join(HERE, ".import-manifest.json"), help="fichier de reprise ('' pour aucun)")
+    parser.add_argument("--workers", type=int, default=16, help="envois S3 / lots DynamoDB en parallèle")
+    parser.add_argument("--multipart-mb", type=int, default=8, help="taille à partir de laquelle un fichier part en multipart")
+    parser.add_argument("--users", type=int, default=0, help="utilisateurs synthétiques")
+    parser.add_argument("--posts-per-user", type=int, default=0, help="posts synthétiques par utilisateur")
+    parser.add_argument("--image-ratio", type=float, default=0.8, help="part des posts synthétiques avec une image")
+    parser.add_argument("--image-size", type=int, default=640, help="côté des images synthétiques, en pixels")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-samples", action="store_true", help="ne pas importer s3/ et data.py")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("USER_SHARDS", "1")),
+                        help="partitions par utilisateur, comme USER_SHARDS du webservice")
+    args = parser.parse_args()
+
+    bucket, table_name = args.bucket, args.table
+    if not bucket or not table_name:
+        try:
+            output_bucket, output_table = read_outputs(args.outputs)
+        except (OSError, KeyError, ValueError) as e:
+            parser.error(f"impossible de lire les outputs terraform ({e}) : lancez "
+                         f"`cdktf output cdktf_serverless --outputs-file outputs.json` ou passez --bucket et --table")
+        bucket, table_name = bucket or output_bucket, table_name or output_table
+
+    fingerprint = f"{table_name}:{args.users}:{args.posts_per_user}:{args.image_ratio}:{args.seed}:{args.skip_samples}:{args.shards}"
+    manifest = Manifest(args.manifest, fingerprint)
+    transfer_config = TransferConfig(
+        multipart_threshold=args.multipart_mb * MB,
+        multipart_chunksize=args.multipart_mb * MB,
+        max_concurrency=4,
+    )
+    client_config = Config(region_name="us-east-1", max_pool_connections=args.workers * transfer_config.max_concurrency)
+    s3_client = boto3.client("s3", config=client_config)
+    table = boto3.resource("dynamodb", config=client_config).Table(table_name)
+
+    items, sources = [], []
+    if not args.skip_samples:
+        items.extend(data)
+        sources.extend((key, lambda path=path: open(path, "rb")) for key, path in sample_files())
+    if args.users and args.posts_per_user:
+        synthetic_items, synthetic_sources = synthetic_dataset(args)
+        items.extend(synthetic_items)
+        sources.extend(synthetic_sources)
+    scheme = ShardScheme(args.shards)
+    items = [scheme.to_storage(item) for item in items]
+
+    print(f"Téléversement de {len(sources)} fichiers vers le bucket '{bucket}' ({args.workers} en parallèle)...")
+    started = time.perf_counter()
+    upload_stats = upload_all(s3_client, bucket, sources, manifest, args, transfer_config)
+    upload_seconds = max(time.perf_counter() - started, 1e-6)
+    print(f"  {upload_stats['uploaded']} envoyés, {upload_stats['skipped']} inchangés, {upload_stats['errors']} en erreur "
+          f"en {upload_seconds:.1f} s : {upload_stats['uploaded'] / upload_seconds:.1f} fichiers/s, "
+          f"{upload_stats['bytes'] / MB / upload_seconds:.2f} Mo/s")
+
+    print(f"\nÉcriture de {len(items)} items dans la table DynamoDB '{table_name}'...")
+    started = time.perf_counter()
+    item_stats = write_items(table, items, manifest, args)
+    item_seconds = max(time.perf_counter() - started, 1e-6)
+    print(f"  {item_stats['written']} écrits, {item_stats['skipped']} déjà présents, {item_stats['errors']} lots en erreur "
+          f"en {item_seconds:.1f} s : {item_stats['written'] / item_seconds:.0f} items/s")
+
+    print("\nScript import_data.py terminé.")
+    if upload_stats["errors"] or item_stats["errors"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
+import io
 import json
+import threading
+import zlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
 from urllib.parse import unquote_plus
 import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import os
 import logging
@@ -9,107 +17,448 @@ print('Loading function')
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
-s3_client = boto3.client('s3')
-rekognition = boto3.client('rekognition')
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "8"))
 
-dynamodb_resource = None
-table = None
+
+def client_config():
+    """Mêmes réglages que webservice/aws_clients.py, avec un pool à la taille des threads de la lambda."""
+    return Config(
+        max_pool_connections=int(os.getenv("AWS_MAX_POOL_CONNECTIONS", str(MAX_WORKERS * 2))),
+        tcp_keepalive=os.getenv("AWS_TCP_KEEPALIVE", "true").lower() in ("1", "true", "yes"),
+        retries={
+            "mode": os.getenv("AWS_RETRY_MODE", "adaptive"),
+            "total_max_attempts": int(os.getenv("AWS_MAX_ATTEMPTS", "5")),
+        },
+        connect_timeout=float(os.getenv("AWS_CONNECT_TIMEOUT", "2")),
+        read_timeout=float(os.getenv("AWS_READ_TIMEOUT", "10")),
+    )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def aws_client(service):
+    """Client boto3 créé au premier usage : une invocation qui n'en a pas besoin (ex. Rekognition
+    quand les labels sont en cache) ne paie pas sa construction."""
+    client = _clients.get(service)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service)
+            if client is None:
+                client = _clients[service] = boto3.client(service, config=client_config())
+    return client
+
+
+# Client DynamoDB bas niveau plutôt que la couche resource, plus lente à construire.
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def to_dynamodb(values):
+    return {k: _serializer.serialize(v) for k, v in values.items()}
+
+
+def from_dynamodb(item):
+    return {k: _deserializer.deserialize(v) for k, v in (item or {}).items()}
+
+
+_pillow = None
+
+
+def pillow():
+    """(Image, ImageOps), importés au premier redimensionnement plutôt qu'à l'init ; None sans la layer Pillow."""
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image, ImageOps
+            _pillow = (Image, ImageOps)
+        except ImportError:
+            # Pillow est fourni par une layer : sans elle, seules les images originales sont servies.
+            _pillow = ()
+    return _pillow or None
+
+
+# Erreurs qu'aucune nouvelle tentative ne corrigera (image illisible ou supprimée, post supprimé) :
+# le record est journalisé puis ignoré au lieu de repasser par SQS jusqu'à la DLQ.
+PERMANENT_ERRORS = {
+    "InvalidImageFormatException", "ImageTooLargeException", "InvalidS3ObjectException",
+    "InvalidParameterException", "ConditionalCheckFailedException", "NoSuchKey", "404",
+}
+
+MAX_LABELS = 5
+MIN_CONFIDENCE = 75
+LABEL_CACHE_TTL = int(os.getenv("LABEL_CACHE_TTL_DAYS", "30")) * 24 * 3600
+
+# Les dérivés sont rangés à côté de l'original : user/post_id/_derived/<size>-<name>.<ext>
+DERIVED_DIR = "_derived"
+DERIVATIVE_SIZES = {"thumb": 160, "feed": 640}
+DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "WEBP").upper()
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
 
 table_name = os.getenv("DYNAMO_TABLE")
+label_cache_name = os.getenv("LABEL_CACHE_TABLE")
+label_index_name = os.getenv("LABEL_INDEX_TABLE")
 
-if table_name:
+# Même découpage que webservice/sharding.py : partition user#shard, shard tiré de l'id du post.
+USER_SHARDS = max(1, int(os.getenv("USER_SHARDS", "1")))
+LEGACY_READS = USER_SHARDS > 1 and os.getenv("USER_SHARDS_LEGACY_READS", "1") == "1"
+
+
+def candidate_keys(user, post_id):
+    """Clés possibles du post, celle du découpage courant d'abord (backfill éventuellement pas fini)."""
+    if USER_SHARDS == 1:
+        return [{'user': user, 'id': post_id}]
+    keys = [{'user': f"{user}#{zlib.crc32(post_id.encode('utf-8')) % USER_SHARDS}", 'id': post_id}]
+    if LEGACY_READS:
+        keys.append({'user': user, 'id': post_id})
+    return keys
+
+# Même tier partagé que le webservice (FEED_CACHE_URL=redis://...) ; seul redis est joignable d'ici.
+feed_cache_url = os.getenv("FEED_CACHE_URL", "")
+_feed_cache = None
+
+
+def feed_cache():
+    """Client redis du cache de feed partagé, créé à la première invalidation ; None si non configuré."""
+    global _feed_cache
+    if _feed_cache is None:
+        _feed_cache = False
+        if feed_cache_url.startswith(("redis://", "rediss://")):
+            try:
+                # Client redis optionnel (layer) : sert à invalider le cache de feed partagé du webservice.
+                import redis
+                _feed_cache = redis.Redis.from_url(feed_cache_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            except ImportError:
+                logger.error("FEED_CACHE_URL is set but the redis package is not available, feeds will refresh on TTL only.")
+    return _feed_cache or None
+
+if not table_name:
+    logger.error("Environment variable DYNAMO_TABLE is not set!")
+
+if os.getenv("PREWARM_CLIENTS") == "1":
+    # Provisioned concurrency / SnapStart : l'init est faite avant le trafic, autant y construire les clients.
+    for service in ("dynamodb", "s3", "rekognition"):
+        aws_client(service)
+
+# Gardé entre deux invocations d'un même conteneur chaud.
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+def content_hash(bucket_name, key, s3_object):
+    """Identify the image bytes by their S3 ETag (MD5 for single-part uploads)."""
+    etag = s3_object.get("eTag")
+    if not etag:
+        etag = aws_client('s3').head_object(Bucket=bucket_name, Key=key)["ETag"]
+    etag = etag.strip('"')
+    # Les paramètres de détection font partie de la clé : les changer invalide le cache.
+    return f"{etag}:{MAX_LABELS}:{MIN_CONFIDENCE}"
+
+
+def cached_labels(cache_key):
+    if not label_cache_name:
+        return None
+    try:
+        item = from_dynamodb(aws_client('dynamodb').get_item(
+            TableName=label_cache_name, Key=to_dynamodb({'content_hash': cache_key})).get('Item'))
+    except ClientError as e:
+        logger.warning(f"Label cache lookup failed for '{cache_key}': {e}")
+        return None
+    if not item or item.get('expires_at', 0) < time.time():
+        return None
+    return list(item.get('labels', []))
+
+
+def store_labels(cache_key, labels):
+    if not label_cache_name:
+        return
     try:
-        dynamodb_resource = boto3.resource('dynamodb')
-        table = dynamodb_resource.Table(table_name)
-        logger.info(f"Successfully initialized DynamoDB table object for table: {table_name}")
+        aws_client('dynamodb').put_item(TableName=label_cache_name, Item=to_dynamodb({
+            'content_hash': cache_key,
+            'labels': labels,
+            'expires_at': int(time.time()) + LABEL_CACHE_TTL,
+        }))
+    except ClientError as e:
+        logger.warning(f"Label cache write failed for '{cache_key}': {e}")
+
+
+def emit_cache_metrics(hits, misses):
+    """Publish the label cache hit ratio with the CloudWatch Embedded Metric Format (a log line)."""
+    if hits + misses == 0:
+        return
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": "Postagram",
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [
+                    {"Name": "LabelCacheHits", "Unit": "Count"},
+                    {"Name": "LabelCacheMisses", "Unit": "Count"},
+                    {"Name": "LabelCacheHitRatio", "Unit": "Percent"},
+                ],
+            }],
+        },
+        "FunctionName": os.getenv("AWS_LAMBDA_FUNCTION_NAME", "postagram-rekognition-lambda"),
+        "LabelCacheHits": hits,
+        "LabelCacheMisses": misses,
+        "LabelCacheHitRatio": 100 * hits / (hits + misses),
+    }))
+
+
+def sync_label_index(post, old_labels, new_labels):
+    """Keep the label -> post index (GET /posts?label=...) in line with the post's labels."""
+    if not label_index_name:
+        return
+    # Même normalisation et même clé de tri que webservice/label_index.py.
+    old = {" ".join(label.split()).lower() for label in old_labels if isinstance(label, str)}
+    new = {" ".join(label.split()).lower() for label in new_labels}
+    sort_key = f"{post.get('created_at') or ''}#{post['user']}#{post['id']}"
+    requests = [{'DeleteRequest': {'Key': to_dynamodb({'label': label, 'post': sort_key})}} for label in old - new]
+    # Réécrites même si elles existent : une relivraison SQS répare un index resté incomplet.
+    requests += [{'PutRequest': {'Item': to_dynamodb({'label': label, 'post': sort_key, 'user': post['user'], 'id': post['id']})}}
+                 for label in new]
+    for start in range(0, len(requests), 25):
+        pending = requests[start:start + 25]
+        for attempt in range(5):
+            if attempt:
+                time.sleep(0.05 * 2 ** attempt)
+            response = aws_client('dynamodb').batch_write_item(RequestItems={label_index_name: pending})
+            pending = response.get('UnprocessedItems', {}).get(label_index_name)
+            if not pending:
+                break
+        else:
+            raise RuntimeError(f"{len(pending)} label index writes still unprocessed for post {post['id']}")
+
+
+def bump_feed_versions(user):
+    """Invalidate the webservice's cached global and per-user feeds after a post changed."""
+    client = feed_cache()
+    if client is None:
+        return
+    try:
+        pipeline = client.pipeline(transaction=False)
+        pipeline.incr("feed-version:all")
+        pipeline.incr(f"feed-version:user:{user}")
+        pipeline.execute()
     except Exception as e:
-        logger.error(f"Failed to initialize DynamoDB table resource for table name '{table_name}': {e}", exc_info=True)
-else:
-    logger.error("Environment variable DYNAMO_TABLE is not set!")
+        # Le post est à jour en base : au pire le feed en cache expire avec son TTL.
+        logger.warning(f"Could not bump feed cache versions for user '{user}': {e}")
 
 
-def lambda_handler(event, context):
+def make_derivatives(bucket_name, key):
+    """Write resized copies of the image next to it and return {size_name: derivative_key}."""
+    if pillow() is None:
+        return {}
+    Image, ImageOps = pillow()
+    user, post_id, filename = key.split('/', 2)
+    stem = PurePosixPath(filename).stem
+    image_format, extension, content_type = (
+        ("WEBP", "webp", "image/webp") if DERIVATIVE_FORMAT == "WEBP" else ("JPEG", "jpg", "image/jpeg"))
 
-    if not table:
-         logger.error("DynamoDB table resource is not initialized. Aborting.")
-         return {'statusCode': 500, 'body': json.dumps('Internal server error: Table not configured or initialization failed')}
+    s3_client = aws_client('s3')
+    body = s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    with Image.open(io.BytesIO(body)) as original:
+        largest = max(DERIVATIVE_SIZES.values())
+        # Décode les JPEG directement à une échelle réduite : bien moins de mémoire sur 128 Mo.
+        original.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    derivatives = {}
+    for size_name, max_side in sorted(DERIVATIVE_SIZES.items(), key=lambda s: -s[1]):
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=DERIVATIVE_QUALITY)
+        derivative_key = f"{user}/{post_id}/{DERIVED_DIR}/{size_name}-{stem}.{extension}"
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=derivative_key,
+            Body=buffer.getvalue(),
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable",
+        )
+        derivatives[size_name] = derivative_key
+    return derivatives
+
+
+def is_permanent(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in PERMANENT_ERRORS
+
+
+def find_post(user, post_id):
+    """(clé de stockage, item avec labels et created_at) du post, ou (None, None) s'il n'existe plus."""
+    dynamodb = aws_client('dynamodb')
+    for key_values in candidate_keys(user, post_id):
+        post = from_dynamodb(dynamodb.get_item(
+            TableName=table_name,
+            Key=to_dynamodb(key_values),
+            ProjectionExpression="#user, id, labels, created_at",
+            ExpressionAttributeNames={'#user': 'user'},
+        ).get('Item'))
+        if post:
+            return {'user': post['user'], 'id': post_id}, post
+    return None, None
+
+
+def process_s3_record(record):
+    """Detect the labels of one uploaded image and store them on its post.
+
+    Returns "hit" or "miss" for the label cache, None for a skipped record. Raises on
+    errors worth retrying; records that can never succeed (see PERMANENT_ERRORS) are
+    logged and skipped.
+    """
+    try:
+        return label_s3_record(record)
+    except ClientError as e:
+        if not is_permanent(e):
+            raise
+        logger.error(f"Skipping record, {e.response['Error']['Code']} will not go away on retry: {e}")
+        return None
+
+
+def label_s3_record(record):
+    s3_data = record.get("s3", {})
+    bucket_name = s3_data.get("bucket", {}).get("name")
+    object_key = s3_data.get("object", {}).get("key")
+
+    if not bucket_name or not object_key:
+        logger.warning(f"Skipping record due to missing bucket name or object key: {record}")
+        return
+
+    key = unquote_plus(object_key)
+    if key.startswith("_internal/"):
+        # Fichiers du webservice (snapshot de l'index de recherche), pas des images de posts.
+        return
+    logger.info(f"Processing object s3://{bucket_name}/{key}")
 
-    for record in event.get("Records", []):
+    parts = key.split('/')
+    if len(parts) < 3:
+        logger.error(f"Invalid key format: '{key}'. Expected 'user/post_id/filename'. Skipping.")
+        return
+    if parts[2] == DERIVED_DIR:
+        # Écrit par cette lambda : ne pas relabelliser ni redimensionner ses propres dérivés.
+        return
+
+    user = parts[0]
+    post_id = parts[1]
+
+    logger.info(f"Extracted from key: user='{user}', post_id='{post_id}'")
+
+    # Lu d'abord : pas d'appel Rekognition ni de dérivés pour un post supprimé entre-temps. Sert aussi
+    # pour la clé de stockage (partition shardée ou non) et les anciens labels à retirer de l'index.
+    stored_key, post = find_post(user, post_id)
+    if post is None:
+        logger.warning(f"Post '{post_id}' of user '{user}' no longer exists, skipping '{key}'")
+        return None
+
+    cache_key = content_hash(bucket_name, key, s3_data.get("object", {}))
+    labels = cached_labels(cache_key)
+    cache_status = "hit" if labels is not None else "miss"
+
+    if labels is None:
+        logger.info(f"Calling Rekognition for bucket='{bucket_name}', key='{key}'")
         try:
-            s3_data = record.get("s3", {})
-            bucket_name = s3_data.get("bucket", {}).get("name")
-            object_key = s3_data.get("object", {}).get("key")
+            label_data = aws_client('rekognition').detect_labels(
+                Image={"S3Object": {
+                    "Bucket": bucket_name,
+                    "Name": key
+                    }
+                },
+                MaxLabels=MAX_LABELS,
+                MinConfidence=MIN_CONFIDENCE
+            )
+            logger.debug(f"Rekognition raw response keys: {label_data.keys()}")
+        except ClientError as e:
+            logger.error(f"Rekognition ClientError for key '{key}': {e}", exc_info=not is_permanent(e))
+            raise
 
-            if not bucket_name or not object_key:
-                logger.warning(f"Skipping record due to missing bucket name or object key: {record}")
-                continue
+        labels = [label["Name"] for label in label_data.get("Labels", [])]
+        store_labels(cache_key, labels)
+    logger.info(f"Labels ({cache_status}): {labels}")
 
-            key = unquote_plus(object_key)
-            logger.info(f"Processing object s3://{bucket_name}/{key}")
+    try:
+        derivatives = make_derivatives(bucket_name, key)
+    except Exception as e:
+        # L'original reste servi si le redimensionnement échoue.
+        logger.warning(f"Could not build derivatives for '{key}': {e}", exc_info=True)
+        derivatives = {}
 
-            parts = key.split('/')
-            if len(parts) < 3:
-                logger.error(f"Invalid key format: '{key}'. Expected 'user/post_id/filename'. Skipping.")
-                continue
+    logger.info(f"Attempting to update DynamoDB item with Key: user='{user}', id='{post_id}'")
+    try:
+        dynamodb = aws_client('dynamodb')
+        # Index de labels avec l'utilisateur réel, pas la partition user#shard.
+        post = {**post, 'user': user, 'id': post_id}
+        old_labels = post.get('labels') or []
+        update_expression = "SET image = :img, labels = :lbl, derivatives = :drv"
+        values = {
+            ':img': key,
+            ':lbl': labels,
+            ':drv': derivatives,
+        }
+        if stored_key['user'] != user:
+            update_expression += ", author = :author"
+            values[':author'] = user
+        update_response = dynamodb.update_item(
+            TableName=table_name,
+            Key=to_dynamodb(stored_key),
+            # Un post supprimé pendant le traitement n'est pas recréé avec seulement son image et ses labels.
+            ConditionExpression="attribute_exists(id)",
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=to_dynamodb(values),
+            ReturnValues="UPDATED_NEW"
+        )
+        logger.info(f"DynamoDB update successful for post '{post_id}'. Updated attributes: {update_response.get('Attributes')}")
+        sync_label_index(post, old_labels, labels)
+        bump_feed_versions(user)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.error(f"DynamoDB update failed for post '{post_id}': Item does not exist or condition failed.")
+        else:
+            logger.error(f"DynamoDB ClientError updating post '{post_id}': {e}", exc_info=True)
+        raise
 
-            user = parts[0]
-            post_id = parts[1]
+    return cache_status
 
-            logger.info(f"Extracted from key: user='{user}', post_id='{post_id}'")
 
-            logger.info(f"Calling Rekognition for bucket='{bucket_name}', key='{key}'")
-            try:
-                label_data = rekognition.detect_labels(
-                    Image={"S3Object": {
-                        "Bucket": bucket_name,
-                        "Name": key
-                        }
-                    },
-                    MaxLabels=5,
-                    MinConfidence=75
-                )
-                logger.debug(f"Rekognition raw response keys: {label_data.keys()}")
-            except ClientError as e:
-                 logger.error(f"Rekognition ClientError for key '{key}': {e}", exc_info=True)
-                 continue
-            except Exception as e:
-                 logger.error(f"Unexpected error calling Rekognition for key '{key}': {e}", exc_info=True)
-                 continue
-
-            labels = [label["Name"] for label in label_data.get("Labels", [])]
-            logger.info(f"Labels detected: {labels}")
-
-            logger.info(f"Attempting to update DynamoDB item with Key: user='{user}', id='{post_id}'")
-            try:
-                update_response = table.update_item(
-                    Key={
-                        'user': user,
-                        'id': post_id
-                    },
-                    UpdateExpression="SET image = :img, labels = :lbl",
-                    ExpressionAttributeValues={
-                        ':img': key,
-                        ':lbl': labels
-                    },
-                    ReturnValues="UPDATED_NEW"
-                )
-                logger.info(f"DynamoDB update successful for post '{post_id}'. Updated attributes: {update_response.get('Attributes')}")
-
-            except ClientError as e:
-                 if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                     logger.error(f"DynamoDB update failed for post '{post_id}': Item does not exist or condition failed.", exc_info=True)
-                 else:
-                      logger.error(f"DynamoDB ClientError updating post '{post_id}': {e}", exc_info=True)
-                 continue
-            except Exception as e:
-                  logger.error(f"Unexpected error updating DynamoDB for post '{post_id}': {e}", exc_info=True)
-                  continue
+def iter_s3_records(event):
+    """Yield (item_identifier, s3_record) for a direct S3 event or an SQS batch of S3 events."""
+    for index, record in enumerate(event.get("Records", [])):
+        if record.get("eventSource") == "aws:sqs":
+            s3_event = json.loads(record.get("body") or "{}")
+            # S3 envoie un message "s3:TestEvent" sans Records à la création de la notification.
+            for s3_record in s3_event.get("Records", []):
+                yield record["messageId"], s3_record
+        else:
+            yield index, record
 
+
+def lambda_handler(event, context):
+
+    if not table_name:
+         logger.error("DynamoDB table is not configured. Aborting.")
+         return {'statusCode': 500, 'body': json.dumps('Internal server error: Table not configured or initialization failed')}
+
+    # Les images sont traitées en parallèle : la durée d'un lot est celle de la plus lente,
+    # pas la somme de toutes.
+    futures = [(item_id, record, executor.submit(process_s3_record, record)) for item_id, record in iter_s3_records(event)]
+
+    failed = []
+    cache_statuses = []
+    for item_id, record, future in futures:
+        try:
+            cache_statuses.append(future.result())
         except Exception as e:
             logger.error(f"Error processing record: {record}. Error: {e}", exc_info=True)
-            continue
+            if item_id not in failed:
+                failed.append(item_id)
+
+    emit_cache_metrics(cache_statuses.count("hit"), cache_statuses.count("miss"))
+
+    if any(record.get("eventSource") == "aws:sqs" for record in event.get("Records", [])):
+        # Seuls les messages en échec reviennent dans la file (ReportBatchItemFailures).
+        return {"batchItemFailures": [{"itemIdentifier": item_id} for item_id in failed]}
 
     return {
         'statusCode': 200,
-        'body': json.dumps('Finished processing S3 event.')
-    }
\ No newline at end of file
+        'body': json.dumps(f'Finished processing S3 event, {len(failed)} failed record(s).')
+    }
@@ -13,6 +13,8 @@ from cdktf_cdktf_provider_aws.security_group import SecurityGroup, SecurityGroup
 from cdktf_cdktf_provider_aws.data_aws_caller_identity import DataAwsCallerIdentity
 
 import base64
+import os
+import secrets
 
 # Mettez ici le nom du bucket S3 crée dans la partie serverless
 bucket="my-cdtf-test-bucket20250504143255658800000001"
@@ -20,6 +22,58 @@ bucket="my-cdtf-test-bucket20250504143255658800000001"
 # Mettez ici le nom de la table dynamoDB créée dans la partie serverless
 dynamo_table="MyDynamoDB"
 
+# Index des labels créé dans la partie serverless (GET /posts?label=...)
+label_index_table="PostagramLabelIndex"
+
+# Secret partagé par les instances pour signer les curseurs de pagination de GET /posts.
+# Il doit rester le même d'un déploiement à l'autre : sinon le user data (donc le launch template)
+# change à chaque synth et tous les curseurs déjà distribués deviennent invalides. Sans CURSOR_SECRET,
+# il est tiré une seule fois et gardé dans .cursor-secret (hors git).
+CURSOR_SECRET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cursor-secret")
+
+
+def persistent_cursor_secret():
+    if os.getenv("CURSOR_SECRET"):
+        return os.environ["CURSOR_SECRET"]
+    if not os.path.exists(CURSOR_SECRET_FILE):
+        # O_EXCL : deux synth lancés en même temps ne tirent pas deux secrets différents.
+        try:
+            fd = os.open(CURSOR_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+    with open(CURSOR_SECRET_FILE) as f:
+        return f.read().strip()
+
+
+cursor_secret = persistent_cursor_secret()
+
+# Nombre maximal d'instances du groupe d'autoscaling.
+asg_max_size = int(os.getenv("ASG_MAX_SIZE", "4"))
+
+# Cache de feed partagé entre les instances (ex. redis://<endpoint elasticache>:6379/0), à donner aussi
+# à main_serverless.py pour que la lambda invalide les feeds dont elle ajoute les labels.
+# Vide : chaque instance garde ses propres versions et ne voit pas les écritures des autres. Avec une seule
+# instance le cache reste actif ; avec plusieurs, le cache de réponses et les ETag sont désactivés
+# (FEED_CACHE_TTL=0) pour qu'aucune instance ne serve, ou ne valide en 304, un post supprimé ailleurs.
+feed_cache_url = os.getenv("FEED_CACHE_URL", "")
+feed_cache_ttl = os.getenv("FEED_CACHE_TTL") or ("30" if feed_cache_url or asg_max_size == 1 else "0")
+if not feed_cache_url and asg_max_size > 1 and float(feed_cache_ttl) > 0:
+    print(f"ATTENTION : {asg_max_size} instances sans FEED_CACHE_URL et FEED_CACHE_TTL={feed_cache_ttl}, "
+          f"une suppression peut rester visible {feed_cache_ttl} s sur les autres instances.")
+
+# Nombre de partitions par utilisateur (user#0..), même valeur que pour la lambda (main_serverless.py).
+# Les posts existants sont déplacés avec shard_posts.py.
+user_shards = os.getenv("USER_SHARDS", "1")
+
+# Capacité de la table (5 RCU / 5 WCU dans main_serverless.py) laissée à chaque instance : au-delà le
+# webservice répond 429 + Retry-After. Partagée entre les asg_max_size instances possibles, pour que
+# l'ASG au complet n'admette pas plus que ce que la table peut servir.
+TABLE_CAPACITY_UNITS = 5
+admission_rcu = os.getenv("ADMISSION_RCU") or f"{TABLE_CAPACITY_UNITS / asg_max_size:g}"
+admission_wcu = os.getenv("ADMISSION_WCU") or f"{TABLE_CAPACITY_UNITS / asg_max_size:g}"
+
 # Mettez ici l'url de votre dépôt github. Votre dépôt doit être public !!!
 your_repo="https://github.com/JunENSAI/postagram_ensai.git"
 
@@ -35,6 +89,14 @@ source venv/bin/activate
 rm .env
 echo 'BUCKET={bucket}' >> .env
 echo 'DYNAMO_TABLE={dynamo_table}' >> .env
+echo 'LABEL_INDEX_TABLE={label_index_table}' >> .env
+echo 'SEARCH_SNAPSHOT=s3://{bucket}/_internal/search-index.snap' >> .env
+echo 'CURSOR_SECRET={cursor_secret}' >> .env
+echo 'FEED_CACHE_URL={feed_cache_url}' >> .env
+echo 'FEED_CACHE_TTL={feed_cache_ttl}' >> .env
+echo 'USER_SHARDS={user_shards}' >> .env
+echo 'ADMISSION_RCU={admission_rcu}' >> .env
+echo 'ADMISSION_WCU={admission_wcu}' >> .env
 pip3 install -r requirements.txt
 venv/bin/python app.py
 echo "userdata-end""".encode("ascii")).decode("ascii")
@@ -98,7 +160,7 @@ class ServerStack(TerraformStack):
         asg = AutoscalingGroup(
             self, "asg",
             min_size=1,
-            max_size=4,
+            max_size=asg_max_size,
             desired_capacity=1, 
             launch_template={"id": launch_template.id}, 
             vpc_zone_identifier=subnets ,
@@ -1,16 +1,51 @@
 #!/usr/bin/env python
+import json
+import os
 from constructs import Construct
 from cdktf import App, TerraformStack, TerraformOutput, TerraformAsset, AssetType
 from cdktf_cdktf_provider_aws.provider import AwsProvider
 from cdktf_cdktf_provider_aws.default_vpc import DefaultVpc
 from cdktf_cdktf_provider_aws.default_subnet import DefaultSubnet
-from cdktf_cdktf_provider_aws.lambda_function import LambdaFunction
-from cdktf_cdktf_provider_aws.lambda_permission import LambdaPermission
+from cdktf_cdktf_provider_aws.lambda_function import LambdaFunction, LambdaFunctionSnapStart, LambdaFunctionVpcConfig
+from cdktf_cdktf_provider_aws.lambda_alias import LambdaAlias
+from cdktf_cdktf_provider_aws.lambda_provisioned_concurrency_config import LambdaProvisionedConcurrencyConfig
+from cdktf_cdktf_provider_aws.lambda_event_source_mapping import LambdaEventSourceMapping
 from cdktf_cdktf_provider_aws.data_aws_caller_identity import DataAwsCallerIdentity
 from cdktf_cdktf_provider_aws.s3_bucket import S3Bucket
 from cdktf_cdktf_provider_aws.s3_bucket_cors_configuration import S3BucketCorsConfiguration, S3BucketCorsConfigurationCorsRule
-from cdktf_cdktf_provider_aws.s3_bucket_notification import S3BucketNotification, S3BucketNotificationLambdaFunction
-from cdktf_cdktf_provider_aws.dynamodb_table import DynamodbTable, DynamodbTableAttribute
+from cdktf_cdktf_provider_aws.s3_bucket_notification import S3BucketNotification, S3BucketNotificationQueue
+from cdktf_cdktf_provider_aws.sqs_queue import SqsQueue
+from cdktf_cdktf_provider_aws.sqs_queue_policy import SqsQueuePolicy
+from cdktf_cdktf_provider_aws.dynamodb_table import DynamodbTable, DynamodbTableAttribute, DynamodbTableLocalSecondaryIndex, DynamodbTableTtl
+
+# Layer Pillow (même version de python que la lambda) pour générer les miniatures des images.
+# Sans layer la lambda ne fait que la détection des labels.
+pillow_layer_arn = os.getenv("PILLOW_LAYER_ARN")
+
+# Même valeur que pour le webservice : la lambda y incrémente les versions des feeds qu'elle modifie.
+# Elle doit alors joindre redis : layer avec le client redis et lambda dans le VPC de l'ElastiCache, sur
+# des subnets qui atteignent aussi S3, DynamoDB et Rekognition (NAT ou endpoints VPC).
+feed_cache_url = os.getenv("FEED_CACHE_URL", "")
+redis_layer_arn = os.getenv("REDIS_LAYER_ARN")
+lambda_subnet_ids = [s for s in os.getenv("LAMBDA_SUBNET_IDS", "").split(",") if s]
+lambda_security_group_ids = [s for s in os.getenv("LAMBDA_SECURITY_GROUP_IDS", "").split(",") if s]
+if feed_cache_url and not (redis_layer_arn and lambda_subnet_ids and lambda_security_group_ids):
+    # Sans invalidation par la lambda, le webservice validerait en 304 des feeds sans les labels.
+    raise ValueError("FEED_CACHE_URL requires REDIS_LAYER_ARN, LAMBDA_SUBNET_IDS and LAMBDA_SECURITY_GROUP_IDS")
+
+# Même valeur que pour le webservice (main_server.py) : partition user#shard des posts.
+user_shards = os.getenv("USER_SHARDS", "1")
+
+# Le CPU d'une lambda est proportionnel à sa mémoire : à 128 Mo l'init (boto3) et Pillow sont lents.
+# Mesurer avec benchmark/lambda_cold_start.py avant de changer la valeur.
+lambda_memory_size = int(os.getenv("LAMBDA_MEMORY_SIZE", "512"))
+lambda_runtime = os.getenv("LAMBDA_RUNTIME", "python3.10")
+# Démarrages à froid supprimés pour N instances (facturées en continu), servies via l'alias "live".
+provisioned_concurrency = int(os.getenv("LAMBDA_PROVISIONED_CONCURRENCY", "0"))
+# SnapStart (gratuit, python3.12 minimum) : l'init est faite au publish puis restaurée depuis un snapshot.
+snap_start = os.getenv("LAMBDA_SNAPSTART", "").lower() in ("1", "true", "yes")
+if snap_start and tuple(map(int, lambda_runtime.removeprefix("python").split("."))) < (3, 12):
+    raise ValueError(f"LAMBDA_SNAPSTART requires LAMBDA_RUNTIME python3.12 or later, got {lambda_runtime}")
 
 class ServerlessStack(TerraformStack):
     def __init__(self, scope: Construct, id: str):
@@ -42,11 +77,44 @@ class ServerlessStack(TerraformStack):
             attribute=[
                 DynamodbTableAttribute(name="user",type="S" ),
                 DynamodbTableAttribute(name="id",type="S" ),
+                DynamodbTableAttribute(name="created_at",type="S" ),
             ],
+            # Les posts d'un utilisateur du plus récent au plus ancien, page par page.
+            # Un LSI ne peut être ajouté qu'à la création de la table.
+            local_secondary_index=[DynamodbTableLocalSecondaryIndex(
+                name="created_at-index",
+                range_key="created_at",
+                projection_type="ALL"
+            )],
             billing_mode="PROVISIONED",
             read_capacity=5,
             write_capacity=5
         )
+        # Labels déjà calculés, indexés par l'ETag de l'image : un doublon ne repasse pas par Rekognition.
+        label_cache_table = DynamodbTable(
+            self, "label-cache-table",
+            name="PostagramLabelCache",
+            hash_key="content_hash",
+            attribute=[
+                DynamodbTableAttribute(name="content_hash",type="S" ),
+            ],
+            ttl=DynamodbTableTtl(attribute_name="expires_at", enabled=True),
+            billing_mode="PAY_PER_REQUEST"
+        )
+        # Index inversé label -> posts, tenu à jour par la lambda et par DELETE /posts.
+        # La clé de tri "created_at#user#id" rend les posts d'un label du plus récent au plus ancien.
+        label_index_table = DynamodbTable(
+            self, "label-index-table",
+            name="PostagramLabelIndex",
+            hash_key="label",
+            range_key="post",
+            attribute=[
+                DynamodbTableAttribute(name="label",type="S" ),
+                DynamodbTableAttribute(name="post",type="S" ),
+            ],
+            billing_mode="PAY_PER_REQUEST"
+        )
+
         TerraformOutput(
             self, "table_name_output",
             value=dynamo_table.name,
@@ -69,39 +137,106 @@ class ServerlessStack(TerraformStack):
         lambda_function = LambdaFunction(
             self, "lambda",
             function_name="postagram-rekognition-lambda",
-            runtime="python3.10",
-            memory_size=128,
+            runtime=lambda_runtime,
+            memory_size=lambda_memory_size,
             timeout=60,
             role=f"arn:aws:iam::{account_id}:role/LabRole",
             filename= code.path,
             handler="lambda_function.lambda_handler",
+            layers=[arn for arn in (pillow_layer_arn, redis_layer_arn) if arn] or None,
+            vpc_config=LambdaFunctionVpcConfig(
+                subnet_ids=lambda_subnet_ids, security_group_ids=lambda_security_group_ids,
+            ) if feed_cache_url else None,
             environment={"variables":{
                 "DYNAMO_TABLE": dynamo_table.name,
                 "BUCKET": bucket.bucket,
-            }}
+                "MAX_WORKERS": "8",
+                "LABEL_CACHE_TABLE": label_cache_table.name,
+                "LABEL_CACHE_TTL_DAYS": "30",
+                "LABEL_INDEX_TABLE": label_index_table.name,
+                "DERIVATIVE_FORMAT": "WEBP",
+                "FEED_CACHE_URL": feed_cache_url,
+                "USER_SHARDS": user_shards,
+                # Init payée hors trafic : les clients AWS y sont construits d'avance.
+                "PREWARM_CLIENTS": "1" if provisioned_concurrency or snap_start else "0",
+            }},
+            publish=bool(provisioned_concurrency or snap_start),
+            snap_start=LambdaFunctionSnapStart(apply_on="PublishedVersions") if snap_start else None,
         )
 
-        # NE PAS TOUCHER !!!!
-        permission = LambdaPermission(
-            self, "lambda_permission",
-            action="lambda:InvokeFunction",
-            statement_id="AllowExecutionFromS3Bucket",
-            function_name=lambda_function.arn,
-            principal="s3.amazonaws.com",
-            source_arn=bucket.arn,
-            source_account=account_id,
-            depends_on=[lambda_function, bucket]
+        # Provisioned concurrency et SnapStart ne s'appliquent qu'à une version publiée :
+        # la file appelle alors l'alias plutôt que $LATEST.
+        lambda_target = lambda_function.arn
+        if provisioned_concurrency or snap_start:
+            alias = LambdaAlias(
+                self, "lambda_live",
+                name="live",
+                function_name=lambda_function.function_name,
+                function_version=lambda_function.version,
+            )
+            lambda_target = alias.arn
+            if provisioned_concurrency:
+                LambdaProvisionedConcurrencyConfig(
+                    self, "lambda_provisioned_concurrency",
+                    function_name=lambda_function.function_name,
+                    qualifier=alias.name,
+                    provisioned_concurrent_executions=provisioned_concurrency,
+                )
+
+        # Les notifications S3 passent par une file SQS : la lambda reçoit les uploads par lots
+        # et ne renvoie dans la file que les messages en échec.
+        dead_letter_queue = SqsQueue(
+            self, "upload_dlq",
+            name="postagram-upload-dlq",
+            message_retention_seconds=1209600
+        )
+
+        upload_queue = SqsQueue(
+            self, "upload_queue",
+            name="postagram-upload-queue",
+            # Au moins 6 fois le timeout de la lambda (recommandation AWS)
+            visibility_timeout_seconds=360,
+            redrive_policy=json.dumps({
+                "deadLetterTargetArn": dead_letter_queue.arn,
+                "maxReceiveCount": 3
+            })
+        )
+
+        queue_policy = SqsQueuePolicy(
+            self, "upload_queue_policy",
+            queue_url=upload_queue.url,
+            policy=json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [{
+                    "Effect": "Allow",
+                    "Principal": {"Service": "s3.amazonaws.com"},
+                    "Action": "sqs:SendMessage",
+                    "Resource": upload_queue.arn,
+                    "Condition": {
+                        "ArnEquals": {"aws:SourceArn": bucket.arn},
+                        "StringEquals": {"aws:SourceAccount": account_id}
+                    }
+                }]
+            })
         )
 
-        #NE PAS TOUCHER !!!!
         notification = S3BucketNotification(
             self, "notification",
-            lambda_function=[S3BucketNotificationLambdaFunction(
-                lambda_function_arn=lambda_function.arn,
+            queue=[S3BucketNotificationQueue(
+                queue_arn=upload_queue.arn,
                 events=["s3:ObjectCreated:*"]
             )],
             bucket=bucket.id,
-            depends_on=[permission]
+            depends_on=[queue_policy]
+        )
+
+        LambdaEventSourceMapping(
+            self, "upload_queue_mapping",
+            event_source_arn=upload_queue.arn,
+            function_name=lambda_target,
+            batch_size=10,
+            maximum_batching_window_in_seconds=5,
+            function_response_types=["ReportBatchItemFailures"]
         )
 
 
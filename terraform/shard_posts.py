@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""Range les posts existants sous les clés du découpage user#shard (webservice/sharding.py).
+
+Chaque post qui n'est pas sous la clé attendue pour --shards partitions (partition `user`
+d'avant le découpage, ou découpage précédent) est réécrit sous la bonne clé et supprimé de
+l'ancienne dans la même transaction. La suppression n'a lieu que si l'ancien item est encore
+celui qui a été lu : si la lambda l'a modifié entre-temps (image, labels...), la transaction
+est annulée, le post relu puis déplacé avec son nouveau contenu. Un post n'est donc jamais
+perdu ni dupliqué, et relancer la commande ne refait rien de ce qui est déjà en place. La
+table est lue par un scan parallèle.
+
+    python shard_posts.py --shards 8 --dry-run   # compte les posts à déplacer
+    python shard_posts.py --shards 8             # déplace
+    python shard_posts.py --shards 1             # revient à une partition par utilisateur
+
+Ordre des opérations :
+  - de 1 à N partitions : déployer USER_SHARDS=N d'abord (les lectures regardent aussi l'ancienne
+    partition tant que USER_SHARDS_LEGACY_READS=1), puis lancer ce script ;
+  - de N à 1 : lancer ce script avec --shards 1 tant que USER_SHARDS=N est déployé, redéployer
+    avec USER_SHARDS=1, puis le relancer pour les posts écrits entre-temps ;
+  - pour changer N, repasser par 1.
+Le webservice et la lambda doivent avoir la même valeur de USER_SHARDS.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from import_data import read_outputs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "webservice"))
+from sharding import ShardScheme, author  # noqa: E402
+
+# Deux opérations (Put + Delete) par post, 100 au plus par transaction.
+POSTS_PER_TRANSACTION = 25
+# Tentatives pour un post modifié pendant son déplacement, relu avant chaque nouvel essai.
+MOVE_ATTEMPTS = 3
+# Attributs que la lambda ajoute après coup : leur absence fait aussi partie de l'état lu.
+LATE_ATTRIBUTES = ("image", "labels", "derivatives", "author", "view")
+
+
+def target_item(item, scheme):
+    """L'item tel qu'il doit être rangé avec `scheme`, ou None s'il l'est déjà."""
+    user = author(item)
+    partition = scheme.partition(user, item["id"])
+    if partition == item["user"]:
+        return None
+    moved = {**item, "user": partition}
+    if scheme.enabled:
+        moved["author"] = user
+    else:
+        moved.pop("author", None)
+    return moved
+
+
+def unchanged_condition(item):
+    """Condition vraie tant que l'item stocké est exactement `item` (hors clé)."""
+    conditions, names, values = [], {}, {}
+    attributes = [name for name in item if name not in ("user", "id")]
+    for i, name in enumerate(attributes):
+        names[f"#a{i}"] = name
+        values[f":a{i}"] = item[name]
+        conditions.append(f"#a{i} = :a{i}")
+    for i, name in enumerate(name for name in LATE_ATTRIBUTES if name not in item):
+        names[f"#m{i}"] = name
+        conditions.append(f"attribute_not_exists(#m{i})")
+    names["#id"] = "id"
+    conditions.insert(0, "attribute_exists(#id)")
+    condition = {"ConditionExpression": " AND ".join(conditions), "ExpressionAttributeNames": names}
+    if values:
+        condition["ExpressionAttributeValues"] = values
+    return condition
+
+
+def transaction(table_name, moves):
+    actions = []
+    for old, new in moves:
+        actions.append({"Put": {
+            "TableName": table_name,
+            "Item": new,
+            "ConditionExpression": "attribute_not_exists(#id)",
+            "ExpressionAttributeNames": {"#id": "id"},
+        }})
+        actions.append({"Delete": {
+            "TableName": table_name,
+            "Key": {"user": old["user"], "id": old["id"]},
+            **unchanged_condition(old),
+        }})
+    return actions
+
+
+class Mover:
+    def __init__(self, client, table_name, scheme, dry_run):
+        self.client = client
+        self.table_name = table_name
+        self.scheme = scheme
+        self.dry_run = dry_run
+        self.stats = {"scanned": 0, "moved": 0, "in_place": 0, "retried": 0, "gone": 0, "conflicts": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def move(self, moves, attempt=1):
+        if self.dry_run or not moves:
+            self.count(moved=len(moves))
+            return
+        try:
+            self.client.transact_write_items(TransactItems=transaction(self.table_name, moves))
+            self.count(moved=len(moves))
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "TransactionCanceledException" and len(moves) > 1:
+                # Un post en conflit annule toute la transaction : on reprend les posts un par un.
+                for single in moves:
+                    self.move([single])
+            elif code == "TransactionCanceledException" and attempt < MOVE_ATTEMPTS:
+                self.retry(moves[0][0], attempt)
+            elif code == "TransactionCanceledException":
+                # Toujours modifié, ou déjà présent sous la nouvelle clé : une nouvelle passe le reprendra.
+                self.count(conflicts=1)
+            else:
+                self.count(errors=len(moves))
+                print(f"  ERREUR pour {len(moves)} posts : {e}")
+
+    def retry(self, old, attempt):
+        """Relit un post modifié (par la lambda) depuis le scan et le déplace avec son contenu actuel."""
+        self.count(retried=1)
+        current = self.client.get_item(TableName=self.table_name, Key={"user": old["user"], "id": old["id"]},
+                                       ConsistentRead=True).get("Item")
+        if current is None:
+            # Supprimé entre-temps : plus rien à déplacer.
+            self.count(gone=1)
+            return
+        moved = target_item(current, self.scheme)
+        if moved is None:
+            self.count(in_place=1)
+            return
+        self.move([(current, moved)], attempt + 1)
+
+    def segment(self, segment, total_segments, batch):
+        kwargs = {"TableName": self.table_name, "Segment": segment, "TotalSegments": total_segments}
+        moves = []
+        while True:
+            response = self.client.scan(**kwargs)
+            items = response.get("Items", [])
+            in_place = 0
+            for item in items:
+                moved = target_item(item, self.scheme)
+                if moved is None:
+                    in_place += 1
+                    continue
+                moves.append((item, moved))
+                if len(moves) == batch:
+                    self.move(moves)
+                    moves = []
+            self.count(scanned=len(items), in_place=in_place)
+            if "LastEvaluatedKey" not in response:
+                break
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        self.move(moves)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outputs", default=os.path.join(HERE, "outputs.json"), help="fichier de `cdktf output --outputs-file`")
+    parser.add_argument("--table", help="table DynamoDB (sinon lue dans les outputs)")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("USER_SHARDS", "0")) or None,
+                        help="partitions par utilisateur visées (défaut : USER_SHARDS)")
+    parser.add_argument("--segments", type=int, default=8, help="segments du scan parallèle")
+    parser.add_argument("--batch", type=int, default=POSTS_PER_TRANSACTION, help="posts par transaction (50 au plus)")
+    parser.add_argument("--dry-run", action="store_true", help="compter sans rien écrire")
+    args = parser.parse_args()
+    if not args.shards:
+        parser.error("--shards (ou USER_SHARDS) est requis")
+    if not 1 <= args.batch <= 50:
+        parser.error("--batch doit être entre 1 et 50")
+
+    table_name = args.table
+    if not table_name:
+        try:
+            _, table_name = read_outputs(args.outputs)
+        except (OSError, KeyError, ValueError) as e:
+            parser.error(f"impossible de lire les outputs terraform ({e}) : passez --table")
+
+    config = Config(region_name="us-east-1", max_pool_connections=args.segments,
+                    retries={"mode": "adaptive", "total_max_attempts": 8})
+    # Client de la couche resource : items en types python, comme dans le webservice.
+    client = boto3.resource("dynamodb", config=config).meta.client
+    mover = Mover(client, table_name, ShardScheme(args.shards, legacy_reads=False), args.dry_run)
+
+    print(f"{'Simulation : ' if args.dry_run else ''}rangement des posts de '{table_name}' sur "
+          f"{args.shards} partition(s) par utilisateur ({args.segments} segments)...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.segments) as pool:
+        futures = [pool.submit(mover.segment, segment, args.segments, args.batch) for segment in range(args.segments)]
+        for future in futures:
+            future.result()
+    seconds = max(time.perf_counter() - started, 1e-6)
+    stats = mover.stats
+    print(f"  {stats['scanned']} lus, {stats['moved']} {'à déplacer' if args.dry_run else 'déplacés'}, "
+          f"{stats['in_place']} déjà en place, {stats['retried']} relus après modification, "
+          f"{stats['gone']} supprimés entre-temps, {stats['conflicts']} en conflit, {stats['errors']} en erreur "
+          f"en {seconds:.1f} s")
+    if stats["conflicts"]:
+        print("  Relancez la commande pour reprendre les posts en conflit.")
+    if stats["errors"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,7 @@ function HomePage({name}) {
   const fetchUserPosts = async () => {
     axios.get("/posts",
      { headers: { Authorization: getToken()} ,
-      params: { user: name } })
+      params: { user: name, size: "feed" } })
       .then(res => {
         console.log(res.data)
         setUserPosts(res.data)
@@ -30,7 +30,7 @@ function HomePage({name}) {
   }
 
   const fetchAllPosts = async () => {
-    axios.get("/posts", { headers: { Authorization: getToken()} })
+    axios.get("/posts", { headers: { Authorization: getToken()}, params: { size: "feed" } })
       .then(res => {
         console.log(res.data)
         setPosts(res.data)
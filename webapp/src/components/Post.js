@@ -1,14 +1,63 @@
 import { Badge, Card, Col, ListGroup, CloseButton, Button, ProgressBar } from "react-bootstrap";
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { getToken } from "../App";
 import axios from 'axios';
 
 
-function Post({ post, removePost, updatePost }) {
+function Post({ post: initialPost, removePost, updatePost }) {
+    const [post, setPost] = useState(initialPost);
     const [showCard, setShowCard] = useState(true);
     const [attachment, setAttachment] = useState(null);
     const [isUploading, setIsUploading] = useState(false);
     const [isLabeling, setIsLabeling] = useState(false);
+    const eventsRef = useRef(null);
+
+    useEffect(() => {
+        setPost(initialPost);
+    }, [initialPost]);
+
+    // Ferme le flux d'événements si la carte disparaît avant la fin de la labellisation.
+    useEffect(() => () => {
+        if (eventsRef.current) {
+            eventsRef.current.close();
+            eventsRef.current = null;
+        }
+    }, []);
+
+    // Attend la fin du traitement de l'image par la lambda : le serveur pousse le post
+    // (url de l'image et labels) au lieu de recharger les deux listes de posts.
+    const waitForLabels = () => {
+        const params = new URLSearchParams({ user: getToken(), size: "feed" });
+        if (eventsRef.current) {
+            eventsRef.current.close();
+        }
+        const events = new EventSource(`${axios.defaults.baseURL || ""}/posts/${post.id}/events?${params}`);
+        eventsRef.current = events;
+        const done = () => {
+            events.close();
+            eventsRef.current = null;
+            setIsLabeling(false);
+        };
+        events.addEventListener("labels", (e) => {
+            done();
+            setPost(JSON.parse(e.data));
+        });
+        events.addEventListener("deleted", () => {
+            done();
+            setShowCard(false);
+        });
+        events.addEventListener("timeout", () => {
+            done();
+            updatePost();
+        });
+        events.onerror = () => {
+            // EventSource se reconnecte seul ; on ne retombe sur un rechargement que si le flux est fermé.
+            if (events.readyState === EventSource.CLOSED) {
+                done();
+                updatePost();
+            }
+        };
+    };
 
     const handleFileChange = (e) => {
         const files = e.target.files || e.dataTransfer.files;
@@ -95,10 +144,7 @@ function Post({ post, removePost, updatePost }) {
         if (uploadSuccess) {
             console.log("Upload successful. Waiting for labeling...");
             setIsLabeling(true);
-            setTimeout(() => {
-                setIsLabeling(false);
-                updatePost();
-            }, 5000); 
+            waitForLabels();
         }
     };
 
@@ -194,7 +240,7 @@ function Post({ post, removePost, updatePost }) {
                             
                             {isLabeling && (
                                  <ListGroup.Item>
-                                    <ProgressLabeling />
+                                    <ProgressBar animated now={100} label="Detecting labels" />
                                  </ListGroup.Item>
                             )}
 
@@ -208,27 +254,4 @@ function Post({ post, removePost, updatePost }) {
 }
 
 
-function ProgressLabeling() {
-    const [progress, setProgress] = useState(0);
-  
-    useEffect(() => {
-      const timer = setInterval(() => {
-        if (progress < 100) {
-          setProgress(progress + 1);
-        }
-      }, 10);
-  
-      return () => {
-        clearInterval(timer);
-      };
-    }, [progress]);
-  
-    return (
-      <div className="App">
-        <ProgressBar now={progress} label="Detecting labels" />
-      </div>
-    );
-  }
-
-
 export default Post;
\ No newline at end of file
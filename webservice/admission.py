@@ -0,0 +1,257 @@
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.routing import Match
+
+import metrics
+
+READ_OPERATIONS = {"GetItem", "Query", "Scan", "BatchGetItem", "TransactGetItems"}
+# Jamais limités : supervision et documentation ne lisent pas la table.
+EXEMPT_PATHS = ("/metrics", "/stats", "/docs", "/redoc", "/openapi.json")
+
+
+def parse_limits(raw):
+    """'GET /posts=8,POST /posts=16' -> {'GET /posts': 8, 'POST /posts': 16}."""
+    limits = {}
+    for part in (raw or "").split(","):
+        route, _, limit = part.rpartition("=")
+        if route.strip():
+            limits[route.strip()] = int(limit)
+    return limits
+
+
+def rejection(reason, retry_after):
+    """Body and headers of a 429 answer for `reason`, retry in `retry_after` seconds."""
+    body = json.dumps({"message": f"Too many requests ({reason}), retry later"}).encode()
+    return body, {"content-type": "application/json", "retry-after": str(max(1, math.ceil(retry_after)))}
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst`. Thread-safe: charged from the IO executor threads."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount=1):
+        """Take `amount` tokens and return 0, or return the seconds until they are available."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def consume(self, amount, max_debt=None):
+        # Le coût n'est connu qu'après l'appel : le solde peut devenir négatif, une dette remboursée au rythme `rate`.
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            if max_debt is not None:
+                self.tokens = max(self.tokens, -max_debt)
+
+    def debt(self):
+        """Seconds until the balance is positive again, 0 if it is."""
+        with self._lock:
+            self._refill()
+            return 0.0 if self.tokens > 0 else -self.tokens / self.rate
+
+    def level(self):
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+
+class CapacityGuard:
+    """Read and write capacity of a provisioned DynamoDB table, charged with the ConsumedCapacity
+    DynamoDB reports for every call (see metrics.add_capacity_listener).
+
+    The buckets refill at the provisioned rate and hold `burst_seconds` of it. A request is
+    admitted while the bucket of its kind (GET reads, other methods write) is not in debt: its
+    own cost is only known afterwards, so one expensive scan may overdraw the bucket, and the
+    requests that follow are turned away until the table has had time to absorb it, instead of
+    all of them waiting in botocore's throttling retries. The debt is capped at one burst, so a
+    full-table scan blocks the route for at most `2 x burst_seconds`; DynamoDB's own burst
+    credits absorb the rest. Calls made outside a request (the search index rebuild) are not
+    charged: no request asked for them, and they are not worth shedding requests for.
+    """
+
+    def __init__(self, table_name, rcu=0, wcu=0, burst_seconds=5):
+        self.table_name = table_name
+        self.buckets = {}
+        if rcu > 0:
+            self.buckets["read"] = TokenBucket(rcu, rcu * burst_seconds)
+        if wcu > 0:
+            self.buckets["write"] = TokenBucket(wcu, wcu * burst_seconds)
+
+    @property
+    def enabled(self):
+        return bool(self.buckets)
+
+    def record(self, table_name, operation, units, route=None):
+        if table_name != self.table_name or route == "background":
+            return
+        bucket = self.buckets.get("read" if operation in READ_OPERATIONS else "write")
+        if bucket is not None:
+            bucket.consume(units, max_debt=bucket.burst)
+
+    def wait(self, method):
+        """Seconds before a request of `method` may touch the table, 0 to admit it now."""
+        bucket = self.buckets.get("read" if method in ("GET", "HEAD") else "write")
+        return bucket.debt() if bucket is not None else 0.0
+
+    def stats(self):
+        return {kind: {"rate": bucket.rate, "burst": bucket.burst, "tokens": round(bucket.level(), 2)}
+                for kind, bucket in self.buckets.items()}
+
+
+class KeyedRateLimiter:
+    """One token bucket per key: the Authorization header of the caller.
+
+    Only the `max_keys` most recently seen keys are kept: memory stays bounded, and an evicted
+    key simply starts again with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def wait(self, key):
+        """Take a token for `key` and return 0, or return the seconds until one is available."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+    def stats(self):
+        return {"rate": self.rate, "burst": self.burst, "keys": len(self._buckets)}
+
+
+class ConcurrencyLimits:
+    """At most `limits[route]` (else `default`, 0 = unlimited) requests of a route in progress.
+
+    No queue: a request over the limit is rejected at once, so waiting never builds up in the
+    service. Only used from the event loop, plain counters are enough.
+    """
+
+    def __init__(self, limits=None, default=0):
+        self.limits = dict(limits or {})
+        self.default = default
+        self.in_progress = {}
+
+    def limit(self, route):
+        return self.limits.get(route, self.default)
+
+    def try_acquire(self, route):
+        limit = self.limit(route)
+        current = self.in_progress.get(route, 0)
+        if limit and current >= limit:
+            return False
+        self.in_progress[route] = current + 1
+        return True
+
+    def release(self, route):
+        self.in_progress[route] -= 1
+
+    def stats(self):
+        return {route: {"in_progress": count, "limit": self.limit(route)} for route, count in self.in_progress.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware rejecting with a 429 and a Retry-After header the requests the service
+    cannot serve now, before they reach a handler or DynamoDB.
+
+    Checks, cheapest first: the rate of an authorized caller (`users`), the write capacity left
+    on the table (`capacity`), then the requests of the route already in progress (`concurrency`).
+    Read capacity is not checked here: a GET may be answered by a 304 or from the feed cache
+    without reading the table, so read handlers check `capacity.wait("GET")` themselves once they
+    know they will read it. Routes are named "METHOD /template" from `routes`, the router's list,
+    since the router has not matched the request yet at this point; `route_key(scope, name)` may
+    refine the name (e.g. to give unfiltered scans their own limit), and is left in
+    scope["admission_route"] for the handlers. Requests matching no route and EXEMPT_PATHS pass
+    through.
+    """
+
+    def __init__(self, app, routes, concurrency=None, capacity=None, users=None, route_key=None):
+        self.app = app
+        self.routes = routes
+        self.concurrency = concurrency
+        self.capacity = capacity
+        self.users = users
+        self.route_key = route_key
+
+    def _match(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    def _caller(self, scope):
+        # Sans Authorization pas de limite par appelant : derrière le load balancer, toutes les
+        # requêtes anonymes ont la même adresse. La concurrence et la capacité les bornent.
+        for name, value in scope["headers"]:
+            if name == b"authorization" and value:
+                return value.decode("latin-1")
+        return None
+
+    async def _reject(self, send, route, reason, retry_after):
+        metrics.admission_rejections.inc(route, reason)
+        body, headers = rejection(reason, retry_after)
+        headers["content-length"] = str(len(body))
+        await send({"type": "http.response.start", "status": 429,
+                    "headers": [(name.encode(), value.encode()) for name, value in headers.items()]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"].startswith(EXEMPT_PATHS):
+            return await self.app(scope, receive, send)
+        matched = self._match(scope)
+        if matched is None:
+            return await self.app(scope, receive, send)
+        # Le routeur le renseignera aussi : ici pour que MetricsMiddleware attribue les 429 à leur route.
+        scope["route"] = matched
+        route = f"{scope['method']} {matched.path}"
+        if self.route_key:
+            route = self.route_key(scope, route)
+        scope["admission_route"] = route
+
+        caller = self._caller(scope)
+        if caller and self.users is not None and self.users.enabled:
+            wait = self.users.wait(caller)
+            if wait:
+                return await self._reject(send, route, "user_rate", wait)
+        if self.capacity is not None and self.capacity.enabled and scope["method"] not in ("GET", "HEAD"):
+            wait = self.capacity.wait(scope["method"])
+            if wait:
+                return await self._reject(send, route, "capacity", wait)
+        if self.concurrency is None:
+            return await self.app(scope, receive, send)
+        if not self.concurrency.try_acquire(route):
+            # Une requête de la route se termine vite en général : réessayer dans la seconde.
+            return await self._reject(send, route, "concurrency", 1)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.concurrency.release(route)
@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("uvicorn")
+
+
+class IOExecutor:
+    """Runs blocking boto3 calls off the event loop in a bounded thread pool.
+
+    `max_concurrency` caps how many calls may be submitted at once (running or queued in the
+    pool); callers above it wait on the event loop without holding a thread.
+    """
+
+    def __init__(self, max_workers=16, max_concurrency=None):
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency or max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aws-io")
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+
+    async def run(self, fn, *args, **kwargs):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # Le contexte suit l'appel dans le thread (comme asyncio.to_thread) : métriques par route.
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, context.run, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a sleep of `interval` seconds.
+
+    A lag close to zero means nothing blocks the loop; a lag in the tens of ms means some
+    handler is running blocking code on it.
+    """
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.total_lag_ms = 0.0
+        self.samples = 0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - started - self.interval) * 1000)
+            self.last_lag_ms = lag_ms
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            self.total_lag_ms += lag_ms
+            self.samples += 1
+            if lag_ms > 100:
+                logger.warning(f"Event loop lag of {lag_ms:.0f} ms")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "interval_ms": self.interval * 1000,
+            "last_lag_ms": round(self.last_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "mean_lag_ms": round(self.total_lag_ms / self.samples, 2) if self.samples else 0.0,
+            "samples": self.samples,
+        }
@@ -60,19 +60,246 @@ bucket = os.getenv("BUCKET")
 ##                                                                                                ##
 ####################################################################################################
 
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from itertools import chain
+from typing import List, Literal
+from urllib.parse import parse_qs
+
+from fastapi import Query
+from fastapi.middleware import Middleware
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
+
+import aws_clients
+import metrics
+from admission import AdmissionMiddleware, CapacityGuard, ConcurrencyLimits, KeyedRateLimiter, parse_limits, rejection
+from aio import IOExecutor, LoopLagMonitor
+from batch_write import BATCH_WRITE_SIZE, batch_write, chunks
+from compression import CompressionMiddleware
+from feed_cache import GLOBAL_SCOPE, FeedCache, shared_store_from_url, user_scope
+from label_index import LabelIndex, batch_get_posts, normalize_label
+from metrics import MetricsMiddleware, SampledLogger
+from pagination import CursorCodec, InvalidCursor
+from post_view import FastJSONResponse, parse_fields, projection, render_fields, render_post
+from presign_cache import PresignedUrlCache
+from presigner import BatchPresigner
+from scan import ParallelScanner
+from search import SearchIndex, load_snapshot, save_snapshot
+from sharding import ShardedReader, ShardScheme
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Tâches de fond lancées au démarrage du service et arrêtées à sa fin."""
+    loop_monitor.start()
+    warm_up_calls = {'dynamodb': lambda: table.meta.client.describe_endpoints()}
+    if bucket:
+        warm_up_calls['s3'] = lambda: s3_client.head_bucket(Bucket=bucket)
+    await io_executor.run(aws_clients.prewarm, warm_up_calls)
+    search_task = asyncio.create_task(maintain_search_index())
+    yield
+    search_task.cancel()
+    await loop_monitor.stop()
+    io_executor.shutdown()
+
+
+# Branchés sur l'app créée plus haut, avant la déclaration des routes.
+app.router.lifespan_context = lifespan
+app.router.default_response_class = FastJSONResponse
+# Logs des chemins chauds (lectures, url présignées) : échantillonnés, LOG_SAMPLE_RATE=1 pour tout voir.
+hot_log = SampledLogger(logger)
+
+# En-têtes lisibles par la webapp : le CORS ajouté plus haut est remplacé à la même place de la pile.
+app.user_middleware = [
+    Middleware(CORSMiddleware, **{**middleware.kwargs, "expose_headers": [
+        "X-Next-Cursor", "X-Cache", "X-Total-Count", "ETag", "Retry-After"]})
+    if middleware.cls is CORSMiddleware else middleware
+    for middleware in app.user_middleware
+]
+# Brotli ou gzip selon Accept-Encoding, à partir de COMPRESS_MIN_SIZE octets.
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESS_MIN_SIZE", "1024")))
+# Ajouté en dernier donc le plus externe : mesure aussi le temps passé dans CORS.
+app.add_middleware(MetricsMiddleware)
+
+
+class BatchDelete(BaseModel):
+    ids: Union[List[str], None] = None
+    all: bool = False
+
+
+# Clients partagés (pool, keep-alive, retries, timeouts réglés par l'environnement) à la place de ceux
+# créés plus haut.
+dynamodb = aws_clients.resource('dynamodb')
+table = dynamodb.Table(os.getenv("DYNAMO_TABLE"))
+metrics.instrument_dynamodb(dynamodb.meta.client)
+s3_client = aws_clients.client('s3')
+
+MAX_PAGE_SIZE = 1000
+S3_DELETE_BATCH_SIZE = 1000
+BATCH_MAX_POSTS = int(os.getenv("BATCH_MAX_POSTS", "1000"))
+# LSI (user, created_at) pour lire les posts d'un utilisateur du plus récent au plus ancien.
+CREATED_AT_INDEX = os.getenv("CREATED_AT_INDEX", "created_at-index")
+
+io_executor = IOExecutor(
+    max_workers=int(os.getenv("IO_MAX_WORKERS", "16")),
+    max_concurrency=int(os.getenv("IO_MAX_CONCURRENCY", "0")) or None,
+)
+loop_monitor = LoopLagMonitor(interval=float(os.getenv("LOOP_LAG_INTERVAL", "0.25")))
+metrics.registry.gauge("postagram_io_executor_in_flight", "Blocking AWS calls running in the IO executor.",
+                       lambda: io_executor.in_flight)
+metrics.registry.gauge("postagram_io_executor_waiting", "Calls waiting for a slot of the IO executor.",
+                       lambda: io_executor.waiting)
+metrics.registry.gauge("postagram_event_loop_lag_seconds", "Last measured event loop lag.",
+                       lambda: loop_monitor.last_lag_ms / 1000)
+
+
+def admission_route(scope, route):
+    """Nom de route du contrôle d'admission : un GET /posts sans user ni label parcourt toute la table."""
+    if route == "GET /posts":
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        if not query.get("user") and not query.get("label"):
+            return "GET /posts (scan)"
+    return route
+
+
+# Contrôle d'admission : 429 + Retry-After plutôt qu'une file d'attente sans fin dans les retries de boto3.
+# ADMISSION_RCU/WCU = capacité de la table pour cette instance (0 : pas de suivi de la capacité).
+capacity_guard = CapacityGuard(
+    os.getenv("DYNAMO_TABLE"),
+    rcu=float(os.getenv("ADMISSION_RCU", "0")),
+    wcu=float(os.getenv("ADMISSION_WCU", "0")),
+    burst_seconds=float(os.getenv("ADMISSION_BURST_SECONDS", "5")),
+)
+metrics.add_capacity_listener(capacity_guard.record)
+route_limits = ConcurrencyLimits(
+    parse_limits(os.getenv("ADMISSION_ROUTE_LIMITS", "GET /posts (scan)=4,GET /posts/{post_id}/events=256")),
+    default=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "64")),
+)
+user_limits = KeyedRateLimiter(
+    rate=float(os.getenv("ADMISSION_USER_RATE", "10")),
+    burst=float(os.getenv("ADMISSION_USER_BURST", "20")),
+)
+# Ajouté à la fin de la liste (add_middleware insère en tête) donc le plus interne : les 429 passent
+# par CORS (Retry-After lisible) et sont mesurés.
+app.user_middleware.append(Middleware(AdmissionMiddleware, routes=app.router.routes, concurrency=route_limits,
+                                      capacity=capacity_guard, users=user_limits, route_key=admission_route))
+for kind in capacity_guard.buckets:
+    metrics.registry.gauge(f"postagram_admission_{kind}_capacity_units", f"{kind.capitalize()} units left in the admission bucket.",
+                           lambda kind=kind: capacity_guard.buckets[kind].level())
+cursor_codec = CursorCodec(os.getenv("CURSOR_SECRET"))
+
+presigner = BatchPresigner(s3_client)
+presign_cache = PresignedUrlCache(
+    max_size=int(os.getenv("PRESIGN_CACHE_SIZE", "10000")),
+    reuse_fraction=float(os.getenv("PRESIGN_CACHE_REUSE_FRACTION", "0.5")),
+)
+
+# Posts d'un utilisateur répartis sur USER_SHARDS partitions (user#0..) pour ne pas saturer une
+# partition avec un compte très actif ; 1 = un post est rangé sous son utilisateur, comme avant.
+shard_scheme = ShardScheme(
+    shards=int(os.getenv("USER_SHARDS", "1")),
+    legacy_reads=os.getenv("USER_SHARDS_LEGACY_READS", "1") == "1",
+)
+sharded_reader = ShardedReader(
+    table, shard_scheme, CREATED_AT_INDEX,
+    max_workers=int(os.getenv("SHARD_READ_WORKERS", "0")) or None,
+) if shard_scheme.enabled else None
+
+
+def fetch_posts(keys, projection=None):
+    """Lit les posts de `keys` (utilisateur réel, id) où qu'ils soient rangés, dans l'ordre de `keys`."""
+    candidates = [candidate for key in keys for candidate in shard_scheme.candidate_keys(key['user'], key['id'])]
+    items = batch_get_posts(table, candidates, projection)
+    return list({item['id']: item for item in items}.values())
+
+
+def get_post(user, post_id):
+    """L'item du post (sous sa clé de stockage, partition shardée ou non) ou None."""
+    for key in shard_scheme.candidate_keys(user, post_id):
+        item = table.get_item(Key=key).get('Item')
+        if item:
+            return item
+    return None
+
+
+# Index inversé label -> posts (table remplie par la lambda), pour GET /posts?label=...
+label_index_name = os.getenv("LABEL_INDEX_TABLE")
+label_index = LabelIndex(dynamodb.Table(label_index_name), table, fetch=fetch_posts) if label_index_name else None
+
+# Cache des réponses de /posts, invalidé par version à chaque écriture (ici et dans la lambda).
+feed_cache = FeedCache(
+    shared=shared_store_from_url(os.getenv("FEED_CACHE_URL")),
+    ttl=float(os.getenv("FEED_CACHE_TTL", "30")),
+    max_entries=int(os.getenv("FEED_CACHE_SIZE", "256")),
+)
+
+scanner = ParallelScanner(
+    table,
+    segments=int(os.getenv("SCAN_SEGMENTS", "4")),
+    max_workers=int(os.getenv("SCAN_MAX_WORKERS", "0")) or None,
+    page_size=int(os.getenv("SCAN_PAGE_SIZE", "0")) or None,
+)
+
+# Recherche plein texte sur titre et corps : index en mémoire, snapshot sur disque ou s3://bucket/key.
+search_index = SearchIndex()
+SEARCH_SNAPSHOT = os.getenv("SEARCH_SNAPSHOT")
+# Un scan complet par reconstruction et par instance : pas de reconstruction périodique par défaut,
+# et pas de scan au démarrage si le snapshot a moins de SEARCH_SNAPSHOT_MAX_AGE secondes (0 : sans limite).
+SEARCH_REBUILD_INTERVAL = float(os.getenv("SEARCH_REBUILD_INTERVAL", "0"))
+SEARCH_SNAPSHOT_MAX_AGE = float(os.getenv("SEARCH_SNAPSHOT_MAX_AGE", "86400"))
+SEARCH_SCAN_PROJECTION = projection(["title", "body"])
+
+# Validateurs de GET /posts : le navigateur revalide à chaque fois (no-cache) et reçoit 304 si rien n'a changé.
+FEED_CACHE_CONTROL = "private, no-cache"
+ETAG_URL_WINDOW = float(os.getenv("ETAG_URL_WINDOW", "900"))
+INSTANCE_ID = uuid.uuid4().hex
+
+# Flux SSE de fin de labellisation : version du feed de l'utilisateur relue souvent (incrémentée par
+# la lambda via le tier partagé), le post lui-même seulement quand elle change ou en filet de sécurité.
+# Ces relectures du post consomment la capacité de lecture : elles s'espacent (x2 à chaque fois, jusqu'à
+# SSE_FALLBACK_MAX_INTERVAL) et attendent quand la capacité laissée à l'instance est épuisée.
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", "0.5"))
+SSE_FALLBACK_INTERVAL = float(os.getenv("SSE_FALLBACK_INTERVAL", "2"))
+SSE_FALLBACK_MAX_INTERVAL = float(os.getenv("SSE_FALLBACK_MAX_INTERVAL", "16"))
+SSE_TIMEOUT = float(os.getenv("SSE_TIMEOUT", "120"))
+# Sous le délai d'inactivité de l'ALB (60 s).
+SSE_KEEPALIVE = 15
+
+def read_capacity_exceeded(request):
+    """429 si la capacité de lecture laissée à cette instance est épuisée, None pour lire la table.
+
+    Appelée juste avant la lecture : un 304 ou une réponse du cache de feed passent toujours.
+    """
+    wait = capacity_guard.wait("GET")
+    if not wait:
+        return None
+    metrics.admission_rejections.inc(request.scope.get("admission_route", metrics.current_route()), "capacity")
+    body, headers = rejection("capacity", wait)
+    return Response(content=body, status_code=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
+
+
 def create_presigned_url(bucket_name, object_name, expiration=3600):
     """Generate a presigned URL to share an S3 object (for GET requests)"""
     if not s3_client or not bucket_name or not object_name:
-        logger.warning(f"Skipping presigned URL generation for {object_name} due to missing client, bucket, or key.")
+        hot_log.warning("presign_skipped", key=object_name, reason="missing client, bucket or key")
         return None
 
+    signed = False
+
+    def sign():
+        nonlocal signed
+        signed = True
+        return presigner.presign_get(bucket_name, object_name, expiration)
+
     try:
-        response = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': object_name},
-            ExpiresIn=expiration
-        )
-        logger.debug(f"Generated presigned URL for {object_name}")
+        response = presign_cache.get_or_create(object_name, expiration, sign)
+        metrics.presigns.inc("signed" if signed else "cached")
+        hot_log.debug("presign", key=object_name, signed=signed)
         return response
     except ClientError as e:
         logger.error(f"S3 ClientError generating presigned URL for {object_name}: {e}", exc_info=True)
@@ -82,26 +309,31 @@ def create_presigned_url(bucket_name, object_name, expiration=3600):
         return None
 
 
-@app.post("/posts", status_code=status.HTTP_201_CREATED)
-async def post_a_post(post: Post, authorization: str | None = Header(default=None)):
-
-    user = authorization
-    post_id = str(uuid.uuid4())
-
-    logger.info(f"Creating post for user: {user}, post ID: {post_id}")
-    logger.info(f"Title: {post.title}, Body: {post.body}")
-
-    item = {
+def build_post_item(user, post):
+    """Item DynamoDB d'un nouveau post : l'image et les labels sont ajoutés ensuite par la lambda."""
+    return {
         'user': user,
-        'id': post_id,
+        'id': str(uuid.uuid4()),
         'title': post.title,
         'body': post.body,
         'image': None,
-        'labels': []
+        'labels': [],
+        'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
     }
+
+
+@app.post("/posts", status_code=status.HTTP_201_CREATED)
+async def post_a_post(post: Post, authorization: str | None = Header(default=None)):
+
+    user = authorization
+    item = build_post_item(user, post)
+    post_id = item['id']
+
     try:
-        res = table.put_item(Item=item)
-        logger.info(f"DynamoDB put_item successful. Metadata: {res.get('ResponseMetadata')}")
+        await io_executor.run(table.put_item, Item=shard_scheme.to_storage(item))
+        hot_log.info("post_created", user=user, id=post_id)
+        await io_executor.run(feed_cache.invalidate, user)
+        search_index.add(item)
         return item
     except ClientError as e:
         logger.error(f"DynamoDB ClientError during put_item: {e}", exc_info=True)
@@ -111,29 +343,405 @@ async def post_a_post(post: Post, authorization: str | None = Header(default=Non
         return JSONResponse(status_code=500, content={"message": "Internal server error during post creation"})
 
 
-@app.get("/posts")
-async def get_all_posts(user: Union[str, None] = None):
-    """Récupère les posts SANS utiliser de préfixes pour la query."""
-    logger.info(f"--- GET /posts --- Received request with user parameter: '{user}'")
+def image_url_for(item, size=None):
+    """Url présignée de l'image d'un post.
+
+    `size` choisit le dérivé (thumb, feed) calculé par la lambda ; à défaut on sert l'original.
+    """
+    image_key = item.get('image')
+    if not image_key:
+        return None
+    if size:
+        image_key = (item.get('derivatives') or {}).get(size, image_key)
+    if not bucket or not s3_client:
+        hot_log.warning("presign_skipped", key=image_key, reason="bucket or s3_client not configured")
+        return None
+    image_url = create_presigned_url(bucket, image_key)
+    if not image_url:
+        hot_log.warning("presign_failed", key=image_key)
+    return image_url
 
+
+@app.post("/posts:batch")
+async def post_posts_batch(request: Request, authorization: str | None = Header(default=None)):
+    """Crée plusieurs posts en une requête : tableau JSON, ou NDJSON (Content-Type application/x-ndjson).
+
+    Les posts sont écrits par batch_write_item, 25 à la fois et en parallèle. La réponse
+    donne pour chaque post reçu son id et son statut (created, invalid ou failed).
+    """
+    user = authorization
+    raw = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            records = [json.loads(line) for line in raw.splitlines() if line.strip()]
+        else:
+            records = json.loads(raw)
+            if not isinstance(records, list):
+                raise ValueError("expected a JSON array of posts")
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": f"Invalid batch body: {e}"})
+    if len(records) > BATCH_MAX_POSTS:
+        return JSONResponse(status_code=413, content={"message": f"At most {BATCH_MAX_POSTS} posts per batch"})
+
+    logger.info(f"Creating {len(records)} posts in batch for user: {user}")
+    metrics.record_items(len(records))
+
+    results = []
+    items = {}
+    for index, record in enumerate(records):
+        try:
+            post = Post.model_validate(record)
+        except ValidationError as e:
+            message = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'post'}: {err['msg']}" for err in e.errors())
+            results.append({'index': index, 'id': None, 'status': 'invalid', 'message': message})
+            continue
+        item = build_post_item(user, post)
+        items[item['id']] = item
+        results.append({'index': index, 'id': item['id'], 'status': 'created'})
+
+    groups = chunks([{'PutRequest': {'Item': shard_scheme.to_storage(item)}}
+                     for item in items.values()], BATCH_WRITE_SIZE)
+    outcomes = await asyncio.gather(*[io_executor.run(batch_write, table, group) for group in groups],
+                                    return_exceptions=True)
+    failed = {}
+    for group, outcome in zip(groups, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"DynamoDB batch_write_item failed for {len(group)} posts: {outcome}", exc_info=outcome)
+            message = outcome.response['Error']['Message'] if isinstance(outcome, ClientError) else "Internal server error"
+            failed.update({request['PutRequest']['Item']['id']: message for request in group})
+        else:
+            failed.update({request['PutRequest']['Item']['id']: "Unprocessed after retries" for request in outcome})
+    for result in results:
+        if result['id'] in failed:
+            result.update(status='failed', message=failed[result['id']])
+
+    created = [item for post_id, item in items.items() if post_id not in failed]
+    if created:
+        await io_executor.run(feed_cache.invalidate, user)
+        for item in created:
+            search_index.add(item)
+    counts = {status_: sum(r['status'] == status_ for r in results) for status_ in ('created', 'invalid', 'failed')}
+    logger.info(f"Batch for user {user}: {counts}")
+    # 207 dès qu'un post n'a pas été créé : le détail est dans `results`.
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED if counts['created'] == len(results) else status.HTTP_207_MULTI_STATUS,
+        content={**counts, 'results': results},
+    )
+
+
+def list_s3_keys(prefix):
+    """Toutes les clés S3 sous `prefix` (image originale, anciennes images et dérivés)."""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    return [obj['Key'] for page in paginator.paginate(Bucket=bucket, Prefix=prefix) for obj in page.get('Contents', [])]
+
+
+def delete_s3_keys(keys):
+    """Supprime au plus 1000 objets en un appel ; renvoie {clé: message} pour ceux en échec."""
+    response = s3_client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+    return {error['Key']: error.get('Message', error.get('Code')) for error in response.get('Errors', [])}
+
+
+def query_user_posts(user):
     items = []
+    for page_items, _ in iter_post_pages(user):
+        items.extend(page_items)
+    return items
+
+
+@app.post("/posts:batchDelete")
+async def delete_posts_batch(batch: BatchDelete, authorization: str | None = Header(default=None)):
+    """Supprime plusieurs posts de l'utilisateur : ceux de `ids`, ou tous avec `all: true`.
+
+    Les objets S3 des posts (tout le préfixe user/post_id/) partent par delete_objects,
+    1000 à la fois, puis les items par batch_write_item, 25 à la fois, chaque lot en
+    parallèle. La réponse donne le statut de chaque post (deleted, not_found ou failed).
+    """
+    user = authorization
+    if not user or bool(batch.ids) == batch.all:
+        return JSONResponse(status_code=400, content={"message": "Give either a list of ids or all: true, with an Authorization header"})
+    if batch.ids and len(batch.ids) > BATCH_MAX_POSTS:
+        return JSONResponse(status_code=413, content={"message": f"At most {BATCH_MAX_POSTS} posts per batch"})
+
+    logger.info(f"Batch delete for user {user}: {'all posts' if batch.all else f'{len(batch.ids)} ids'}")
     try:
+        if batch.all:
+            items = await io_executor.run(query_user_posts, user)
+            s3_keys = await io_executor.run(list_s3_keys, f"{user}/") if bucket else []
+        else:
+            post_ids = list(dict.fromkeys(batch.ids))
+            items = await io_executor.run(fetch_posts, [{'user': user, 'id': post_id} for post_id in post_ids])
+            listings = await asyncio.gather(*[io_executor.run(list_s3_keys, f"{user}/{item['id']}/") for item in items]) if bucket else []
+            s3_keys = [key for keys in listings for key in keys]
+    except ClientError as e:
+        logger.error(f"ClientError while gathering posts to delete for {user}: {e}", exc_info=True)
+        return JSONResponse(status_code=500, content={"message": f"Failed to read posts: {e.response['Error']['Message']}"})
+
+    results = {item['id']: {'id': item['id'], 'status': 'deleted'} for item in items}
+
+    s3_batches = chunks(s3_keys, S3_DELETE_BATCH_SIZE)
+    s3_outcomes = await asyncio.gather(*[io_executor.run(delete_s3_keys, keys) for keys in s3_batches], return_exceptions=True)
+    s3_errors = {}
+    for keys, outcome in zip(s3_batches, s3_outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"S3 delete_objects failed for {len(keys)} objects: {outcome}", exc_info=outcome)
+            s3_errors.update({key: str(outcome) for key in keys})
+        else:
+            s3_errors.update(outcome)
+    for key in s3_keys:
+        presign_cache.invalidate(key)
+    for key, message in s3_errors.items():
+        # L'item est tout de même supprimé, comme pour DELETE /posts/{post_id}.
+        post_id = key.split('/')[1] if key.count('/') >= 2 else None
+        if post_id in results:
+            results[post_id]['message'] = f"Some images could not be deleted: {message}"
+
+    groups = chunks([{'DeleteRequest': {'Key': {'user': item['user'], 'id': item['id']}}} for item in items], BATCH_WRITE_SIZE)
+    outcomes = await asyncio.gather(*[io_executor.run(batch_write, table, group) for group in groups], return_exceptions=True)
+    for group, outcome in zip(groups, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"DynamoDB batch_write_item failed for {len(group)} deletes: {outcome}", exc_info=outcome)
+            message = outcome.response['Error']['Message'] if isinstance(outcome, ClientError) else "Internal server error"
+            unprocessed = group
+        else:
+            message, unprocessed = "Unprocessed after retries", outcome
+        for delete_request in unprocessed:
+            results[delete_request['DeleteRequest']['Key']['id']].update(status='failed', message=message)
+
+    deleted = [item for item in items if results[item['id']]['status'] == 'deleted']
+    for item in deleted:
+        search_index.remove(user, item['id'])
+    if deleted:
+        await io_executor.run(feed_cache.invalidate, user)
+    if label_index and deleted:
+        try:
+            await asyncio.gather(*[io_executor.run(label_index.remove, item) for item in deleted])
+        except Exception as e:
+            logger.error(f"Failed to remove label index entries of deleted posts: {e}", exc_info=True)
+
+    if batch.ids:
+        ordered = [results.get(post_id, {'id': post_id, 'status': 'not_found'}) for post_id in dict.fromkeys(batch.ids)]
+    else:
+        ordered = list(results.values())
+    counts = {status_: sum(r['status'] == status_ for r in ordered) for status_ in ('deleted', 'not_found', 'failed')}
+    logger.info(f"Batch delete for user {user}: {counts}, {len(s3_keys)} S3 objects")
+    return {**counts, 's3_objects': len(s3_keys), 'results': ordered}
+
+
+def format_post(item, size=None, fields=None):
+    """JSON d'un post au format attendu par la webapp : sa vue stockée plus l'url présignée.
+
+    Avec `fields` (item lu avec la projection correspondante) seuls ces champs sont renvoyés.
+    """
+    if fields:
+        return render_fields(item, fields, image_url_for(item, size) if "image_url" in fields else None)
+    return render_post(item, image_url_for(item, size))
+
+
+def rebuild_search_index():
+    """Reconstruit l'index de recherche depuis un scan complet puis en sauve un snapshot."""
+    search_index.begin_rebuild()
+    started = time.time()
+    try:
+        # Seuls les champs indexés : le scan coûte des RCU proportionnels à ce qu'il lit.
+        items, report = scanner.scan(**SEARCH_SCAN_PROJECTION)
+    except Exception:
+        search_index.cancel_rebuild()
+        raise
+    search_index.finish_rebuild(SearchIndex().build(items, built_at=started))
+    logger.info(f"Search index rebuilt from {len(items)} posts in {report.duration_ms:.0f} ms")
+    if SEARCH_SNAPSHOT:
+        save_snapshot(search_index.to_snapshot(), SEARCH_SNAPSHOT, s3_client)
+
+
+def load_search_snapshot():
+    """Charge le snapshot s'il existe et date de moins de SEARCH_SNAPSHOT_MAX_AGE ; False sinon."""
+    raw = load_snapshot(SEARCH_SNAPSHOT, s3_client)
+    if not raw:
+        return False
+    snapshot = SearchIndex.from_snapshot(raw)
+    if SEARCH_SNAPSHOT_MAX_AGE > 0 and time.time() - (snapshot.built_at or 0) > SEARCH_SNAPSHOT_MAX_AGE:
+        logger.info(f"Search snapshot {SEARCH_SNAPSHOT} is older than {SEARCH_SNAPSHOT_MAX_AGE:.0f} s, rebuilding")
+        return False
+    search_index.finish_rebuild(snapshot)
+    logger.info(f"Search index loaded from snapshot {SEARCH_SNAPSHOT}: {search_index.stats()}")
+    return True
+
+
+async def maintain_search_index():
+    """Charge le dernier snapshot pour répondre sans scanner la table, sinon le reconstruit par un scan.
+
+    Les écritures de cette instance sont appliquées au fil de l'eau (et journalisées pendant le
+    chargement). Celles des autres instances de l'ASG n'arrivent qu'avec un snapshot plus récent ou
+    un nouveau scan : SEARCH_REBUILD_INTERVAL > 0 rescanne régulièrement, au prix d'une lecture
+    complète de la table par instance à chaque fois.
+    """
+    loaded = False
+    if SEARCH_SNAPSHOT:
+        search_index.begin_rebuild()
+        try:
+            loaded = await io_executor.run(load_search_snapshot)
+        except Exception as e:
+            logger.error(f"Could not load search snapshot {SEARCH_SNAPSHOT}: {e}", exc_info=True)
+        if not loaded:
+            search_index.cancel_rebuild()
+    while True:
+        if not loaded:
+            try:
+                await io_executor.run(rebuild_search_index)
+            except Exception as e:
+                logger.error(f"Search index rebuild failed: {e}", exc_info=True)
+        if SEARCH_REBUILD_INTERVAL <= 0:
+            return
+        await asyncio.sleep(SEARCH_REBUILD_INTERVAL)
+        loaded = False
+
+
+def iter_post_pages(user, start_key=None, limit=None, projection=None):
+    """Yield (items, last_evaluated_key) one DynamoDB page at a time, stopping after `limit` items."""
+    if user and sharded_reader:
+        # Posts de l'utilisateur sur plusieurs partitions : une seule page, fusionnée.
+        yield sharded_reader.query(user, limit, start_key, projection)
+        return
+    remaining = limit
+    while True:
+        kwargs = dict(projection or {})
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        if remaining is not None:
+            kwargs['Limit'] = remaining
         if user:
-            logger.info(f"Attempting DynamoDB Query for user: '{user}'")
-            response = table.query(
-                KeyConditionExpression=Key('user').eq(user) # Utilisation directe
-            )
-            items = response.get('Items', [])
-            logger.info(f"DynamoDB Query returned {len(items)} items.")
+            if CREATED_AT_INDEX:
+                kwargs['IndexName'] = CREATED_AT_INDEX
+                kwargs['ScanIndexForward'] = False
+            response = table.query(KeyConditionExpression=Key('user').eq(user), **kwargs)
         else:
-            logger.warning("Attempting DynamoDB Scan for all users (no user parameter provided)")
-            response = table.scan()
-            items = response.get('Items', [])
-            while 'LastEvaluatedKey' in response:
-                logger.debug(f"Scanning next page... (retrieved {len(items)} so far)")
-                response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-                items.extend(response.get('Items', []))
-            logger.info(f"DynamoDB Scan returned {len(items)} items total.")
+            response = table.scan(**kwargs)
+        items = response.get('Items', [])
+        start_key = response.get('LastEvaluatedKey')
+        if remaining is not None:
+            remaining -= len(items)
+        yield items, start_key
+        if not start_key or remaining == 0:
+            return
+
+
+async def stream_posts(pages, fmt, size=None, fields=None):
+    """Serialise the posts page by page, as NDJSON or as a chunked JSON array."""
+    first = True
+    count = 0
+    if fmt == "json":
+        yield "["
+    try:
+        while (page := await io_executor.run(next, pages, None)) is not None:
+            items, _ = page
+            count += len(items)
+            metrics.record_items(count)
+            for item in items:
+                line = format_post(item, size, fields)
+                if fmt == "json":
+                    yield line if first else "," + line
+                else:
+                    yield line + "\n"
+                first = False
+    except Exception as e:
+        # Les en-têtes sont déjà partis : on ne peut plus renvoyer de 500, on coupe le flux.
+        logger.error(f"Error while streaming posts: {e}", exc_info=True)
+        raise
+    if fmt == "json":
+        yield "]"
+
+
+@app.get("/posts")
+async def get_all_posts(
+    request: Request,
+    user: Union[str, None] = None,
+    limit: Union[int, None] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Union[str, None] = None,
+    stream: Union[Literal["ndjson", "json"], None] = None,
+    size: Union[Literal["thumb", "feed", "original"], None] = None,
+    label: Union[List[str], None] = Query(default=None),
+    match: Literal["any", "all"] = "any",
+    fields: Union[str, None] = None,
+    if_none_match: Union[str, None] = Header(default=None),
+):
+    """Récupère les posts SANS utiliser de préfixes pour la query.
+
+    Avec `limit`/`cursor` on ne lit qu'une page et le curseur suivant est renvoyé dans
+    l'en-tête X-Next-Cursor. Les posts d'un utilisateur sont lus du plus récent au plus ancien.
+    `size=thumb|feed` renvoie l'url d'une version réduite de l'image quand elle existe. Avec `stream` les posts sont envoyés au fil des pages DynamoDB (sans `limit` : le curseur suivant ne pourrait plus être renvoyé).
+    `label` (répétable) ne garde que les posts portant un de ces labels, ou tous avec `match=all`.
+    Hors `stream`, la réponse sérialisée est gardée dans le cache de feed jusqu'à la prochaine écriture,
+    et porte un ETag : avec If-None-Match la réponse est un 304 sans lecture de la table.
+    `fields=title,image_url` ne lit (ProjectionExpression) et ne renvoie que ces champs, plus `id`.
+    """
+    labels = sorted({normalize_label(l) for l in label or [] if l.strip()})
+    if labels and label_index is None:
+        return JSONResponse(status_code=503, content={"message": "Label search is not configured"})
+    if labels and stream:
+        return JSONResponse(status_code=400, content={"message": "stream is not supported with label"})
+    if stream and limit:
+        # Le curseur suivant n'est connu qu'après la dernière page, une fois les en-têtes partis.
+        return JSONResponse(status_code=400, content={"message": "stream is not supported with limit, page with limit and cursor instead"})
+
+    try:
+        selected = parse_fields(fields) if fields else None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    read_projection = projection(selected) if selected else {}
+
+    scope = f"user:{user}" if user else "scan"
+    if labels:
+        scope = f"labels:{match}:{user or ''}:{'|'.join(labels)}"
+    try:
+        start_key = cursor_codec.decode(cursor, scope)
+    except InvalidCursor as e:
+        logger.warning(f"Rejected cursor for scope '{scope}': {e}")
+        return JSONResponse(status_code=400, content={"message": "Invalid cursor"})
+
+    pages = iter_post_pages(user, start_key, limit, read_projection)
+
+    cache_key = None
+    headers = {}
+    if not stream:
+        feed_scope = user_scope(user) if user else GLOBAL_SCOPE
+        variant = f"{size}|{limit}|{cursor}|{match}|{'|'.join(labels)}|{','.join(selected or [])}"
+        version = await io_executor.run(feed_cache.version, feed_scope)
+        if version is not None:
+            headers['ETag'] = feed_etag(feed_scope, version, variant)
+            headers['Cache-Control'] = FEED_CACHE_CONTROL
+            if etag_matches(if_none_match, headers['ETag']):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        cached, cache_key = await io_executor.run(feed_cache.get_at, feed_scope, version, variant)
+        if cached is not None:
+            next_cursor, _, body = cached.partition(b"\n")
+            headers['X-Cache'] = 'HIT'
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor.decode("ascii")
+            return Response(content=body, media_type="application/json", headers=headers)
+
+    rejected = read_capacity_exceeded(request)
+    if rejected is not None:
+        return rejected
+
+    items = []
+    last_key = None
+    try:
+        if stream:
+            # La première page est lue avant d'envoyer les en-têtes pour pouvoir encore répondre 500.
+            first_page = await io_executor.run(next, pages)
+            media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+            return StreamingResponse(stream_posts(chain([first_page], pages), stream, size, selected), media_type=media_type)
+
+        if labels:
+            items, before = await io_executor.run(
+                label_index.search, labels, match, user, start_key and start_key['post'], limit, read_projection)
+            last_key = {'post': before} if before else None
+        elif not user and not limit and not start_key:
+            items, report = await io_executor.run(scanner.scan, **read_projection)
+            headers['Server-Timing'] = report.server_timing()
+        else:
+            for page_items, last_key in await io_executor.run(list, pages):
+                items.extend(page_items)
 
     except ClientError as e:
          logger.error(f"DynamoDB ClientError during table access: {e}", exc_info=True)
@@ -142,39 +750,177 @@ async def get_all_posts(user: Union[str, None] = None):
         logger.error(f"!!! UNEXPECTED EXCEPTION during DynamoDB access: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"message": "Internal server error during data retrieval"})
 
-    logger.info(f"Processing {len(items)} items for response...")
-    res = []
-    for item in items:
-        p_item = dict(item)
-
-        image_key = p_item.get('image')
-        p_item['image_url'] = None
-        if image_key and bucket and s3_client:
-             p_item['image_url'] = create_presigned_url(bucket, image_key)
-             if not p_item['image_url']:
-                 logger.warning(f"Failed to generate presigned URL for key: {image_key}")
-        elif image_key:
-             logger.warning(f"Cannot generate presigned URL for {image_key}, bucket or s3_client not configured.")
-
-        p_item['image_s3_key'] = p_item.pop('image', None)
-
-        raw_labels = p_item.get('labels', [])
-        simple_labels: List[str] = []
-        if isinstance(raw_labels, list):
-            for label_obj in raw_labels:
-                 if isinstance(label_obj, dict) and 'S' in label_obj:
-                     simple_labels.append(label_obj['S'])
-                 elif isinstance(label_obj, str):
-                      simple_labels.append(label_obj)
-                 else:
-                      logger.warning(f"Item ID {p_item.get('id', 'N/A')} contains unexpected label format: {label_obj}")
+    hot_log.info("get_posts", user=user, labels=labels, limit=limit, items=len(items))
+    metrics.record_items(len(items))
+    body = ("[" + ",".join([format_post(item, size, selected) for item in items]) + "]").encode("utf-8")
+
+    next_cursor = cursor_codec.encode(last_key, scope) if limit else None
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    headers['X-Cache'] = 'MISS'
+    await io_executor.run(feed_cache.set, cache_key, (next_cursor or "").encode("ascii") + b"\n" + body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/posts/search")
+async def search_posts(
+    request: Request,
+    q: str = Query(min_length=1),
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Union[str, None] = None,
+    size: Union[Literal["thumb", "feed", "original"], None] = None,
+):
+    """Recherche plein texte dans le titre et le corps des posts, les plus pertinents d'abord.
+
+    Accents et pluriels sont ignorés. Le nombre total de résultats est renvoyé dans
+    X-Total-Count et le curseur de la page suivante dans X-Next-Cursor.
+    """
+    if not search_index.ready:
+        return JSONResponse(status_code=503, content={"message": "Search index is warming up"}, headers={"Retry-After": "5"})
+
+    scope = f"search:{q}"
+    try:
+        start = cursor_codec.decode(cursor, scope)
+    except InvalidCursor as e:
+        logger.warning(f"Rejected cursor for scope '{scope}': {e}")
+        return JSONResponse(status_code=400, content={"message": "Invalid cursor"})
+    offset = int(start['offset']) if start else 0
+
+    hits, total = search_index.search(q, offset, limit)
+    rejected = read_capacity_exceeded(request) if hits else None
+    if rejected is not None:
+        return rejected
+    try:
+        items = await io_executor.run(fetch_posts, [{'user': u, 'id': i} for u, i, _ in hits])
+    except ClientError as e:
+        logger.error(f"DynamoDB ClientError during search: {e}", exc_info=True)
+        return JSONResponse(status_code=500, content={"message": f"Database error: {e.response['Error']['Message']}"})
+
+    metrics.record_items(len(items))
+    headers = {'X-Total-Count': str(total)}
+    if offset + limit < total:
+        headers['X-Next-Cursor'] = cursor_codec.encode({'offset': offset + limit}, scope)
+    body = ("[" + ",".join([format_post(item, size) for item in items]) + "]").encode("utf-8")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def feed_etag(feed_scope, version, variant):
+    """ETag fort d'une réponse de GET /posts, calculé sans lire la table.
+
+    La version du scope change à chaque écriture. Le corps contient des urls présignées : l'ETag change
+    aussi à chaque fenêtre de ETAG_URL_WINDOW secondes, pour qu'une copie revalidée ait toujours des urls
+    valides. Sans tier partagé les versions sont propres à l'instance et la lambda ne les incrémente pas :
+    l'instance fait alors partie de l'ETag et la fenêtre est le TTL du cache de feed.
+    """
+    if feed_cache.shared is not None:
+        origin, window = "shared", ETAG_URL_WINDOW
+    else:
+        origin, window = INSTANCE_ID, feed_cache.ttl
+    epoch = int(time.time() // window) if window > 0 else 0
+    digest = hashlib.sha1(f"{origin}|{feed_scope}|{version}|{epoch}|{variant}".encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match contient `etag`, tel quel, affaibli (W/) ou suffixé par l'encodage de CompressionMiddleware."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    accepted = {etag, etag[:-1] + '-br"', etag[:-1] + '-gzip"'}
+    return any(tag.strip().removeprefix("W/") in accepted for tag in if_none_match.split(","))
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def post_events(request, user, post_id, size):
+    """Attend que la lambda ait écrit l'image et les labels du post, puis les pousse en un seul événement."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SSE_TIMEOUT
+    next_keepalive = loop.time() + SSE_KEEPALIVE
+    next_read = 0.0
+    fallback_interval = SSE_FALLBACK_INTERVAL
+    last_version = None
+    yield "retry: 3000\n\n"
+    while loop.time() < deadline:
+        if await request.is_disconnected():
+            return
+        if feed_cache.shared is not None:
+            version = await io_executor.run(feed_cache.version, user_scope(user))
         else:
-            logger.warning(f"Item ID {p_item.get('id', 'N/A')} has non-list format for labels: {raw_labels}")
-        p_item['labels'] = simple_labels
-
-        res.append(p_item)
-
-    return res
+            version = feed_cache.version(user_scope(user))
+        now = loop.time()
+        if (version != last_version or now >= next_read) and not capacity_guard.wait("GET"):
+            last_version, next_read = version, now + fallback_interval
+            fallback_interval = min(fallback_interval * 2, SSE_FALLBACK_MAX_INTERVAL)
+            item = await io_executor.run(get_post, user, post_id)
+            if item is None:
+                yield sse_event("deleted", json.dumps({"id": post_id}))
+                return
+            if item.get('image'):
+                yield sse_event("labels", format_post(item, size))
+                return
+        if now >= next_keepalive:
+            next_keepalive = now + SSE_KEEPALIVE
+            yield ": keepalive\n\n"
+        await asyncio.sleep(SSE_POLL_INTERVAL)
+    yield sse_event("timeout", json.dumps({"id": post_id}))
+
+@app.get("/posts/{post_id}/events")
+async def get_post_events(
+    request: Request,
+    post_id: str,
+    user: Union[str, None] = None,
+    size: Union[Literal["thumb", "feed", "original"], None] = None,
+    authorization: str | None = Header(default=None),
+):
+    """Flux server-sent events qui se termine par un événement `labels` (le post, au format de GET /posts)
+    dès que la lambda a traité l'image envoyée, `deleted` si le post disparaît ou `timeout`.
+
+    EventSource ne peut pas envoyer d'en-tête : l'utilisateur peut aussi être passé dans `user`.
+    """
+    user = authorization or user
+    if not user:
+        return JSONResponse(status_code=400, content={"message": "user is required"})
+    rejected = read_capacity_exceeded(request)
+    if rejected is not None:
+        return rejected
+    try:
+        item = await io_executor.run(get_post, user, post_id)
+    except ClientError as e:
+        logger.error(f"DynamoDB ClientError reading post {post_id} for events: {e}", exc_info=True)
+        return JSONResponse(status_code=500, content={"message": f"Database error: {e.response['Error']['Message']}"})
+    if item is None:
+        return JSONResponse(status_code=404, content={"message": "Post not found"})
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if item.get('image'):
+        # Déjà traité (la lambda a fini avant l'ouverture du flux) : réponse immédiate.
+        return StreamingResponse(iter([sse_event("labels", format_post(item, size))]),
+                                 media_type="text/event-stream", headers=headers)
+    return StreamingResponse(post_events(request, user, post_id, size), media_type="text/event-stream", headers=headers)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Métriques au format texte de Prometheus (latences par route, capacité DynamoDB consommée...)."""
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats")
+async def get_stats():
+    """Statistiques internes pour régler le service (timings du scan parallèle, cache d'urls...)."""
+    return {
+        "scan": scanner.stats(),
+        "presign_cache": presign_cache.stats(),
+        "feed_cache": feed_cache.stats(),
+        "search_index": search_index.stats(),
+        "io_executor": io_executor.stats(),
+        "aws_clients": aws_clients.stats(),
+        "event_loop": loop_monitor.stats(),
+        "admission": {
+            "concurrency": route_limits.stats(),
+            "capacity": capacity_guard.stats(),
+            "users": user_limits.stats(),
+        },
+    }
 
 @app.delete("/posts/{post_id}")
 async def delete_post(post_id: str, authorization: str | None = Header(default=None)):
@@ -183,10 +929,7 @@ async def delete_post(post_id: str, authorization: str | None = Header(default=N
     logger.info(f"Attempting to delete post for user: {user}, post ID: {post_id}")
 
     try:
-        get_response = table.get_item(
-            Key={'user': user, 'id': post_id}
-        )
-        item_to_delete = get_response.get('Item')
+        item_to_delete = await io_executor.run(get_post, user, post_id)
 
         if not item_to_delete:
             logger.warning(f"Delete failed: Post not found for user='{user}', post_id='{post_id}'")
@@ -194,20 +937,38 @@ async def delete_post(post_id: str, authorization: str | None = Header(default=N
 
         image_s3_key = item_to_delete.get('image')
         if image_s3_key:
-            logger.info(f"Deleting associated image from S3 bucket '{bucket}': {image_s3_key}")
+            s3_keys = [image_s3_key, *(item_to_delete.get('derivatives') or {}).values()]
+            logger.info(f"Deleting associated images from S3 bucket '{bucket}': {s3_keys}")
             try:
-                s3_client.delete_object(Bucket=bucket, Key=image_s3_key)
-                logger.info(f"S3 delete_object call successful for {image_s3_key}")
+                await io_executor.run(
+                    s3_client.delete_objects,
+                    Bucket=bucket,
+                    Delete={'Objects': [{'Key': key} for key in s3_keys], 'Quiet': True}
+                )
+                for key in s3_keys:
+                    presign_cache.invalidate(key)
+                logger.info(f"S3 delete_objects call successful for {s3_keys}")
             except ClientError as e:
-                 logger.error(f"S3 ClientError deleting object {image_s3_key}: {e}", exc_info=True)
+                 logger.error(f"S3 ClientError deleting objects {s3_keys}: {e}", exc_info=True)
             except Exception as e:
-                 logger.error(f"Unexpected error deleting object {image_s3_key} from S3: {e}", exc_info=True)
-        delete_response = table.delete_item(
-            Key={'user': user, 'id': post_id},
+                 logger.error(f"Unexpected error deleting objects {s3_keys} from S3: {e}", exc_info=True)
+        delete_response = await io_executor.run(
+            table.delete_item,
+            Key={'user': item_to_delete['user'], 'id': post_id},
             ReturnValues='ALL_OLD'
         )
         logger.info(f"DynamoDB delete_item successful. Metadata: {delete_response.get('ResponseMetadata')}")
+        await io_executor.run(feed_cache.invalidate, user)
         item = dict(delete_response.get('Attributes', {}))
+        search_index.remove(user, post_id)
+        if label_index:
+            try:
+                await io_executor.run(label_index.remove, item_to_delete)
+            except Exception as e:
+                # Une entrée orpheline est ignorée à la lecture : le post est bien supprimé.
+                logger.error(f"Failed to remove label index entries of post {post_id}: {e}", exc_info=True)
+        if 'author' in item:
+            item['user'] = item.pop('author')
         return item
 
     except ClientError as e:
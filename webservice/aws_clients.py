@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger("uvicorn")
+
+REGION = "us-east-1"
+SIGNATURE_VERSIONS = {"s3": "s3v4"}
+
+_session = boto3.session.Session()
+_clients = {}
+_resources = {}
+_monitors = {}
+_lock = threading.Lock()
+
+
+def client_config(service):
+    """botocore Config shared by every client, tuned through the environment.
+
+    AWS_MAX_POOL_CONNECTIONS: sockets kept per endpoint (botocore's default, 10, is below
+    the IO executor's 16 threads); AWS_TCP_KEEPALIVE: keep idle sockets alive through NAT
+    and load balancers; AWS_RETRY_MODE / AWS_MAX_ATTEMPTS: retry strategy ("adaptive" also
+    rate-limits the client when DynamoDB throttles); AWS_CONNECT_TIMEOUT / AWS_READ_TIMEOUT:
+    fail fast instead of botocore's 60 s.
+    """
+    return Config(
+        region_name=REGION,
+        signature_version=SIGNATURE_VERSIONS.get(service, "v4"),
+        max_pool_connections=int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50")),
+        tcp_keepalive=os.getenv("AWS_TCP_KEEPALIVE", "true").lower() in ("1", "true", "yes"),
+        retries={
+            "mode": os.getenv("AWS_RETRY_MODE", "adaptive"),
+            "total_max_attempts": int(os.getenv("AWS_MAX_ATTEMPTS", "5")),
+        },
+        connect_timeout=float(os.getenv("AWS_CONNECT_TIMEOUT", "2")),
+        read_timeout=float(os.getenv("AWS_READ_TIMEOUT", "10")),
+    )
+
+
+class PoolMonitor:
+    """Counts the HTTP attempts a client has on the wire, to see when its pool is the bottleneck.
+
+    `saturated` counts the attempts sent while every pooled socket was already busy: those
+    waited for a socket or opened a connection outside the pool.
+    """
+
+    def __init__(self, service, max_pool_connections):
+        self.service = service
+        self.max_pool_connections = max_pool_connections
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.saturated = 0
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        client.meta.events.register("before-send", self._before_send)
+        client.meta.events.register("needs-retry", self._after_attempt)
+
+    def _before_send(self, **kwargs):
+        with self._lock:
+            self.requests += 1
+            if self.in_flight >= self.max_pool_connections:
+                self.saturated += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _after_attempt(self, **kwargs):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def stats(self):
+        return {
+            "max_pool_connections": self.max_pool_connections,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "requests": self.requests,
+            "saturated": self.saturated,
+        }
+
+
+def _monitor(service, client):
+    if service not in _monitors:
+        monitor = PoolMonitor(service, client.meta.config.max_pool_connections)
+        monitor.attach(client)
+        _monitors[service] = monitor
+
+
+def client(service):
+    """The process-wide client for `service` (clients are thread-safe)."""
+    with _lock:
+        if service not in _clients:
+            _clients[service] = _session.client(service, config=client_config(service))
+            _monitor(service, _clients[service])
+        return _clients[service]
+
+
+def resource(service):
+    """The process-wide resource for `service`; its low-level client is monitored like the others."""
+    with _lock:
+        if service not in _resources:
+            _resources[service] = _session.resource(service, config=client_config(service))
+            _monitor(service, _resources[service].meta.client)
+        return _resources[service]
+
+
+def prewarm(calls, connections=None):
+    """Open `connections` sockets per endpoint before the first request by running cheap calls in parallel.
+
+    `calls` maps a name to a no-argument function issuing one request (e.g. head_bucket).
+    Failures are logged only: a cold pool is slower, not broken.
+    """
+    connections = connections if connections is not None else int(os.getenv("AWS_PREWARM_CONNECTIONS", "4"))
+    if connections <= 0 or not calls:
+        return
+    with ThreadPoolExecutor(max_workers=connections * len(calls)) as pool:
+        futures = [(name, pool.submit(call)) for name, call in calls.items() for _ in range(connections)]
+    failed = {name for name, future in futures if future.exception() is not None}
+    for name in failed:
+        logger.warning(f"Could not pre-warm connections to {name}: {next(f.exception() for n, f in futures if n == name)}")
+    logger.info(f"Pre-warmed {connections} connection(s) to {sorted(set(calls) - failed)}")
+
+
+def stats():
+    return {service: monitor.stats() for service, monitor in _monitors.items()}
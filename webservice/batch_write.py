@@ -0,0 +1,28 @@
+import random
+import time
+
+BATCH_WRITE_SIZE = 25
+
+
+def chunks(values, size):
+    return [values[start:start + size] for start in range(0, len(values), size)]
+
+
+def batch_write(table, requests, max_attempts=8, base_backoff=0.05):
+    """Send up to 25 PutRequest/DeleteRequest to `table` with batch_write_item.
+
+    UnprocessedItems (throttling, partition limits) are resent with exponential
+    backoff and jitter. Returns the requests still unprocessed after `max_attempts`.
+    """
+    if len(requests) > BATCH_WRITE_SIZE:
+        raise ValueError(f"batch_write_item accepts at most {BATCH_WRITE_SIZE} requests, got {len(requests)}")
+    client = table.meta.client
+    pending = requests
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(random.uniform(0, base_backoff * 2 ** attempt))
+        response = client.batch_write_item(RequestItems={table.name: pending})
+        pending = response.get('UnprocessedItems', {}).get(table.name, [])
+    return pending
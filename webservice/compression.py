@@ -0,0 +1,139 @@
+import zlib
+
+try:
+    # Brotli compresse mieux que gzip le JSON des feeds ; gzip sert de repli.
+    import brotli
+except ImportError:
+    brotli = None
+
+# Jamais compressés : déjà compressés, ou flux dont chaque message doit partir tout de suite.
+SKIPPED_CONTENT_TYPES = ("text/event-stream", "image/", "application/zip", "application/gzip")
+
+
+def accepted_encodings(header):
+    """Encodings of an Accept-Encoding header with a non-zero q value."""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class _Gzip:
+    def __init__(self, level):
+        # wbits 16+ : en-tête et somme de contrôle gzip plutôt que zlib brut.
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, final):
+        out = self._compressor.compress(data)
+        # SYNC_FLUSH garde le dictionnaire : un flux NDJSON part au fil de l'eau sans repartir de zéro.
+        return out + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, final):
+        out = self._compressor.process(data)
+        return out + (self._compressor.finish() if final else self._compressor.flush())
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with brotli or gzip, as the client accepts.
+
+    Bodies sent in one message are compressed only from `minimum_size` bytes (below it the
+    headers cost more than what is saved); streamed bodies are always compressed, one flush per
+    message. A strong ETag gets the encoding appended ("abc" -> "abc-br") since the compressed
+    bytes are another representation; the handlers accept both forms in If-None-Match. Such a
+    response is compressed whatever its size, and a 304 gets the same suffix, so that it matches
+    the 200 it validates. Every compressible response varies on Accept-Encoding, compressed or not.
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough or start is None:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                response_headers = {k.lower(): v for k, v in start.get("headers", [])}
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                if (b"content-encoding" in response_headers
+                        or start["status"] == 204
+                        or content_type.startswith(SKIPPED_CONTENT_TYPES)):
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                etag = response_headers.get(b"etag", b"")
+                strong_etag = etag.endswith(b'"') and not etag.startswith(b"W/")
+                compress = encoding is not None and start["status"] != 304 and (
+                    more_body or strong_etag or len(body) >= self.minimum_size)
+                suffix = encoding is not None and strong_etag and (compress or start["status"] == 304)
+                out_headers = []
+                for name, value in start.get("headers", []):
+                    lowered = name.lower()
+                    if lowered == b"vary" or (compress and lowered == b"content-length"):
+                        continue
+                    if lowered == b"etag" and suffix:
+                        value = value[:-1] + b"-" + encoding.encode() + b'"'
+                    out_headers.append((name, value))
+                vary = response_headers.get(b"vary")
+                if not vary:
+                    out_headers.append((b"vary", b"Accept-Encoding"))
+                elif b"accept-encoding" in vary.lower() or vary.strip() == b"*":
+                    out_headers.append((b"vary", vary))
+                else:
+                    out_headers.append((b"vary", vary + b", Accept-Encoding"))
+                if not compress:
+                    passthrough = True
+                    await send({**start, "headers": out_headers})
+                    return await send(message)
+                compressor = _Brotli(self.brotli_quality) if encoding == "br" else _Gzip(self.gzip_level)
+                out_headers.append((b"content-encoding", encoding.encode()))
+                compressed = compressor.compress(body, final=not more_body)
+                if not more_body:
+                    out_headers.append((b"content-length", str(len(compressed)).encode()))
+                await send({**start, "headers": out_headers})
+                return await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+            await send({"type": "http.response.body", "body": compressor.compress(body, final=not more_body),
+                        "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,217 @@
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger("uvicorn")
+
+GLOBAL_SCOPE = "all"
+
+
+def user_scope(user):
+    return f"user:{user}"
+
+
+class FileStore:
+    """Shared tier kept in a directory, for instances sharing a disk (or local tests)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                expires_at, _, value = f.read().partition(b"\n")
+        except FileNotFoundError:
+            return None
+        if float(expires_at) < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(f"{time.time() + ttl}\n".encode("ascii") + value)
+        os.replace(tmp_path, self._path(key))
+
+    def get_version(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                # Verrou partagé : incr vide puis réécrit le fichier sous verrou exclusif, une lecture
+                # sans verrou pourrait le voir vide et repartir de la version 0 (réponse périmée servie).
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def incr(self, key):
+        with open(self._path(key), "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            version = int(f.read() or 0) + 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(version).encode("ascii"))
+            return version
+
+
+class RedisStore:
+    """Shared tier in Redis, also reachable from the lambda to bump versions."""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def get_version(self, key):
+        return int(self.client.get(key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+def shared_store_from_url(url):
+    """Build the shared tier from FEED_CACHE_URL (redis://... or file:///path), None if unset."""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    try:
+        if parsed.scheme in ("redis", "rediss"):
+            return RedisStore(url)
+        if parsed.scheme == "file":
+            return FileStore(parsed.path)
+    except ImportError:
+        logger.error("FEED_CACHE_URL uses redis but the redis package is not installed, using the in-process cache only.")
+        return None
+    raise ValueError(f"Unsupported FEED_CACHE_URL scheme: {parsed.scheme}")
+
+
+class FeedCache:
+    """Read-through cache of serialized /posts responses.
+
+    Every scope (the global feed, each user's feed) has a version number that writers bump;
+    the version is part of the cache key, so a write makes every cached response of the scope
+    unreachable at once. With a shared tier the versions live there and a write on one instance
+    (or in the lambda) is seen by all of them; without it they are local to the process and
+    other instances only catch up after `ttl` seconds. A `ttl` of 0 disables the cache: there
+    is no version, hence no cached response and no ETag (several instances without shared tier).
+    """
+
+    def __init__(self, shared=None, ttl=30, max_entries=256):
+        self.shared = shared
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = OrderedDict()
+        self._local_versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def version(self, scope):
+        if not self.enabled:
+            return None
+        if self.shared is not None:
+            try:
+                return self.shared.get_version(f"feed-version:{scope}")
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Feed cache version lookup failed for {scope}: {e}")
+                return None
+        return self._local_versions.get(scope, 0)
+
+    def _key(self, scope, version, variant):
+        return f"feed:{scope}:v{version}:{variant}"
+
+    def get(self, scope, variant):
+        """Return (cached_value or None, key to store the fresh value under or None)."""
+        return self.get_at(scope, self.version(scope), variant)
+
+    def get_at(self, scope, version, variant):
+        """Like get() with a version the caller already looked up (e.g. to build an ETag)."""
+        if version is None:
+            return None, None
+        key = self._key(scope, version, variant)
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[1] > now:
+                self._local.move_to_end(key)
+                self.hits += 1
+                return entry[0], key
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Feed cache read failed for {key}: {e}")
+                value = None
+            if value is not None:
+                self._set_local(key, value, now)
+                self.shared_hits += 1
+                return value, key
+        self.misses += 1
+        return None, key
+
+    def _set_local(self, key, value, now):
+        with self._lock:
+            self._local[key] = (value, now + self.ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def set(self, key, value):
+        if key is None:
+            return
+        self._set_local(key, value, time.time())
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Feed cache write failed for {key}: {e}")
+
+    def invalidate(self, user):
+        """Bump the versions of the global feed and of `user`'s feed after a write."""
+        for scope in (GLOBAL_SCOPE, user_scope(user)):
+            with self._lock:
+                self._local_versions[scope] = self._local_versions.get(scope, 0) + 1
+            if self.shared is not None:
+                try:
+                    self.shared.incr(f"feed-version:{scope}")
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Feed cache invalidation failed for {scope}: {e}")
+
+    def stats(self):
+        with self._lock:
+            size = len(self._local)
+        return {
+            "enabled": self.enabled,
+            "shared_tier": type(self.shared).__name__ if self.shared is not None else None,
+            "ttl": self.ttl,
+            "local_size": size,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
@@ -6,16 +6,19 @@
 
 
 import logging
-import boto3
 from boto3.dynamodb.conditions import Key
 import os
 import json
 import uuid
 from pathlib import Path
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+import aws_clients
+from presigner import BatchPresigner
 
 bucket = os.getenv("BUCKET")
-s3_client = boto3.client('s3', config=boto3.session.Config(signature_version='s3v4'))
+s3_client = aws_clients.client('s3')
+presigner = BatchPresigner(s3_client)
 logger = logging.getLogger("uvicorn")
 
 def getSignedUrl(filename: str, filetype: str, postId: str, user: str, bucket: str):
@@ -23,17 +26,10 @@ def getSignedUrl(filename: str, filetype: str, postId: str, user: str, bucket: s
     unique_filename = f'{uuid.uuid4()}{Path(filename).suffix}'
     object_name = f"{user}/{postId}/{unique_filename}"
 
+    url = None
     try:
-        url = s3_client.generate_presigned_url(
-            ClientMethod='put_object',
-            Params={
-                'Bucket': bucket,
-                'Key': object_name,
-                'ContentType': filetype
-                },
-            ExpiresIn=3600
-            )
-    except ClientError as e:
+        url = presigner.presign_put(bucket, object_name, content_type=filetype, expires_in=3600)
+    except (BotoCoreError, ClientError) as e:
         logging.error(e)
     
     logger.info(f'Url: {url}')
@@ -0,0 +1,110 @@
+import heapq
+import logging
+import time
+from itertools import groupby, islice
+
+from boto3.dynamodb.conditions import Key
+
+from sharding import author
+
+logger = logging.getLogger("uvicorn")
+
+MAX_BATCH_GET = 100
+
+
+def normalize_label(label):
+    return " ".join(label.split()).lower()
+
+
+def post_sort_key(item):
+    """Sort key of a post in the index: newest first, then unique per post."""
+    return f"{item.get('created_at') or ''}#{author(item)}#{item['id']}"
+
+
+def item_labels(item):
+    return {normalize_label(label) for label in item.get('labels') or [] if isinstance(label, str)}
+
+
+def batch_get_posts(posts_table, keys, projection=None):
+    """Read the posts of `keys` with batch_get_item, in the order of `keys`.
+
+    `projection` ({'ProjectionExpression': ..., 'ExpressionAttributeNames': ...}) must keep `user` and `id`.
+    """
+    client = posts_table.meta.client
+    found = {}
+    for start in range(0, len(keys), MAX_BATCH_GET):
+        request = {posts_table.name: {'Keys': keys[start:start + MAX_BATCH_GET], **(projection or {})}}
+        attempt = 0
+        while request:
+            response = client.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(posts_table.name, []):
+                found[(item['user'], item['id'])] = item
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+    # Une clé sans post (suppression en cours) est simplement ignorée.
+    return [found[(key['user'], key['id'])] for key in keys if (key['user'], key['id']) in found]
+
+
+class LabelIndex:
+    """Inverted index label -> posts, stored in its own DynamoDB table.
+
+    One entry per (label, post) with the post's key; the lambda writes them when it
+    labels an image and DELETE /posts removes them. A query reads the entries of the
+    requested labels, newest first, then fetches only the matching posts, so it costs
+    O(matches) whatever the size of the posts table.
+    """
+
+    def __init__(self, index_table, posts_table, page_size=100, fetch=None):
+        self.index_table = index_table
+        self.posts_table = posts_table
+        self.page_size = page_size
+        # fetch(keys, projection) -> posts, pour lire les posts rangés sous d'autres clés (partitions shardées).
+        self.fetch = fetch or (lambda keys, projection=None: batch_get_posts(posts_table, keys, projection))
+
+    def _entries(self, label, before=None):
+        condition = Key('label').eq(label)
+        if before:
+            condition = condition & Key('post').lt(before)
+        start_key = None
+        while True:
+            kwargs = {'ExclusiveStartKey': start_key} if start_key else {}
+            response = self.index_table.query(
+                KeyConditionExpression=condition, ScanIndexForward=False, Limit=self.page_size, **kwargs)
+            yield from response.get('Items', [])
+            start_key = response.get('LastEvaluatedKey')
+            if not start_key:
+                return
+
+    def matches(self, labels, match="any", user=None, before=None):
+        """Yield the index entries of the posts carrying any (or all) of `labels`, newest first."""
+        streams = [self._entries(label, before) for label in labels]
+        # Chaque flux est trié : la fusion regroupe les entrées d'un même post côte à côte.
+        merged = heapq.merge(*streams, key=lambda entry: entry['post'], reverse=True)
+        for _, group in groupby(merged, key=lambda entry: entry['post']):
+            entries = list(group)
+            if match == "all" and len(entries) < len(labels):
+                continue
+            if user and entries[0]['user'] != user:
+                continue
+            yield entries[0]
+
+    def fetch_posts(self, entries, projection=None):
+        return self.fetch([{'user': entry['user'], 'id': entry['id']} for entry in entries], projection)
+
+    def search(self, labels, match="any", user=None, before=None, limit=None, projection=None):
+        """Return (posts, sort key to resume after or None)."""
+        entries = list(islice(self.matches(labels, match, user, before), limit + 1 if limit else None))
+        next_before = None
+        if limit and len(entries) > limit:
+            entries = entries[:limit]
+            next_before = entries[-1]['post']
+        return self.fetch_posts(entries, projection), next_before
+
+    def remove(self, item):
+        """Drop the index entries of a deleted post."""
+        sort_key = post_sort_key(item)
+        with self.index_table.batch_writer() as batch:
+            for label in item_labels(item):
+                batch.delete_item(Key={'label': label, 'post': sort_key})
@@ -0,0 +1,259 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Route de la requête en cours, vue aussi depuis les threads de l'IOExecutor (il copie le contexte).
+_request = contextvars.ContextVar("postagram_request", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [counts par bucket (dernier = +Inf), somme]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read when /metrics is scraped, e.g. from an existing stats() dict."""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, read):
+        return self.register(Gauge(name, help, read))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+request_duration = registry.histogram(
+    "postagram_http_request_duration_seconds", "Time to the last byte of the response.", ("method", "route", "status"))
+response_bytes = registry.histogram(
+    "postagram_http_response_bytes", "Size of the response body.", ("method", "route"), SIZE_BUCKETS)
+response_items = registry.histogram(
+    "postagram_http_response_items", "Posts returned per response.", ("method", "route"), COUNT_BUCKETS)
+dynamodb_capacity = registry.counter(
+    "postagram_dynamodb_consumed_capacity_units_total",
+    "Capacity units consumed, as reported by ReturnConsumedCapacity.", ("table", "operation", "route"))
+dynamodb_calls = registry.counter(
+    "postagram_dynamodb_calls_total", "DynamoDB API calls.", ("operation", "route"))
+presigns = registry.counter(
+    "postagram_s3_presign_total", "Presigned GET urls served, signed or from the cache.", ("result",))
+admission_rejections = registry.counter(
+    "postagram_http_rejected_total", "Requests answered 429 by admission control.", ("route", "reason"))
+
+
+def route_of(scope):
+    # Renseigné par le routeur sur le scope partagé : le template (/posts/{post_id}) plutôt que le chemin brut.
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+def current_route():
+    request = _request.get()
+    return route_of(request["scope"]) if request else "background"
+
+
+def record_items(count):
+    """Number of posts in the current response, observed by the middleware when it completes."""
+    request = _request.get()
+    if request is not None:
+        request["items"] = count
+
+
+# Opérations DynamoDB qui acceptent ReturnConsumedCapacity.
+CAPACITY_OPERATIONS = (
+    "GetItem", "PutItem", "UpdateItem", "DeleteItem", "Query", "Scan",
+    "BatchGetItem", "BatchWriteItem", "TransactGetItems", "TransactWriteItems",
+)
+
+
+# listener(table, operation, units, route) appelé pour chaque ConsumedCapacity, depuis le thread de l'appel.
+_capacity_listeners = []
+
+
+def add_capacity_listener(listener):
+    """Also hand the consumed capacity of every instrumented call to `listener`, e.g. admission control."""
+    _capacity_listeners.append(listener)
+
+
+def _request_capacity(params, **kwargs):
+    params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _record_capacity(http_response, parsed, model, **kwargs):
+    route = current_route()
+    dynamodb_calls.inc(model.name, route)
+    consumed = parsed.get("ConsumedCapacity")
+    # Les opérations batch renvoient une liste, une entrée par table.
+    for capacity in consumed if isinstance(consumed, list) else [consumed] if consumed else []:
+        table, units = capacity.get("TableName", ""), capacity.get("CapacityUnits", 0)
+        dynamodb_capacity.inc(table, model.name, route, amount=units)
+        for listener in _capacity_listeners:
+            listener(table, model.name, units, route)
+
+
+def instrument_dynamodb(client):
+    """Ask DynamoDB for the consumed capacity of every call and count it per table, operation and route."""
+    for operation in CAPACITY_OPERATIONS:
+        client.meta.events.register(f"provide-client-params.dynamodb.{operation}", _request_capacity)
+        client.meta.events.register(f"after-call.dynamodb.{operation}", _record_capacity)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every request to its last body byte, labelled with the route template.
+
+    Pure ASGI rather than BaseHTTPMiddleware so streamed responses are neither buffered nor
+    cut short. Requests matching no route are grouped under "unmatched" to bound cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        request = {"scope": scope, "items": None}
+        token = _request.set(request)
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
+            method, route = scope["method"], route_of(scope)
+            request_duration.observe(time.perf_counter() - started, method, route, status)
+            response_bytes.observe(size, method, route)
+            if request["items"] is not None:
+                response_items.observe(request["items"], method, route)
+
+
+class SampledLogger:
+    """Structured (one JSON object per line) logging for hot paths, level-gated then sampled.
+
+    The level check comes first so a disabled level costs a method call; `sample_rate` keeps
+    one event out of 1/rate at the enabled levels. Errors are never sampled.
+    """
+
+    def __init__(self, logger, sample_rate=None):
+        self.logger = logger
+        self.sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.01")) if sample_rate is None else sample_rate
+
+    def _log(self, level, event, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.ERROR and random.random() >= self.sample_rate:
+            return
+        fields = {"event": event, "route": current_route(), **fields}
+        if level < logging.ERROR:
+            fields["sample_rate"] = self.sample_rate
+        self.logger.log(level, json.dumps(fields, default=str, ensure_ascii=False, separators=(",", ":")))
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
@@ -0,0 +1,67 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+from decimal import Decimal
+
+logger = logging.getLogger("uvicorn")
+
+
+class InvalidCursor(ValueError):
+    """The continuation token is malformed, was tampered with or belongs to another query."""
+
+
+def json_default(value):
+    """Serialise the Decimal values boto3 returns for DynamoDB numbers."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class CursorCodec:
+    """Wraps DynamoDB's LastEvaluatedKey in an opaque, HMAC-signed continuation token.
+
+    The token is bound to a scope (e.g. the full scan or one user's query) so a cursor
+    issued for one listing cannot be replayed against another one.
+    """
+
+    def __init__(self, secret: str | None = None):
+        if not secret:
+            logger.warning("CURSOR_SECRET is not set, cursors will only be valid on this instance.")
+            secret = os.urandom(32).hex()
+        self._secret = secret.encode("utf-8")
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()[:16]
+
+    def encode(self, last_key: dict | None, scope: str) -> str | None:
+        if not last_key:
+            return None
+        payload = json.dumps({"s": scope, "k": last_key}, default=json_default, separators=(",", ":")).encode("utf-8")
+        return f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}"
+
+    def decode(self, cursor: str | None, scope: str) -> dict | None:
+        if not cursor:
+            return None
+        try:
+            encoded_payload, encoded_signature = cursor.split(".", 1)
+            payload = _b64decode(encoded_payload)
+            signature = _b64decode(encoded_signature)
+        except ValueError as e:
+            raise InvalidCursor("Malformed cursor") from e
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidCursor("Bad cursor signature")
+        data = json.loads(payload, parse_float=Decimal, parse_int=Decimal)
+        if data.get("s") != scope:
+            raise InvalidCursor("Cursor does not belong to this query")
+        return data["k"]
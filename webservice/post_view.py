@@ -0,0 +1,114 @@
+import json
+import logging
+from typing import List
+
+from fastapi.responses import JSONResponse
+
+from pagination import json_default
+from sharding import author
+
+try:
+    # Encodeur JSON en Rust, plusieurs fois plus rapide que json ; json sert de repli.
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("uvicorn")
+
+# Attributs internes qui ne font pas partie de la réponse.
+HIDDEN_ATTRIBUTES = ("image", "derivatives", "author")
+
+# Champs publics d'un post (GET /posts?fields=...) -> attributs DynamoDB à lire pour les produire.
+POST_FIELDS = {
+    "id": ("id",),
+    "user": ("user",),
+    "title": ("title",),
+    "body": ("body",),
+    "labels": ("labels",),
+    "created_at": ("created_at",),
+    "image_s3_key": ("image",),
+    "image_url": ("image", "derivatives"),
+}
+
+
+def dumps(value) -> str:
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default).decode("utf-8")
+    return json.dumps(value, default=json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        return dumps(content).encode("utf-8")
+
+
+def post_view(item) -> dict:
+    """Response shape of a post, minus its presigned url, built from the item's attributes.
+
+    Nothing derived is stored on the item: a second copy of the post would double the size,
+    hence the capacity units, of every read and write of the table.
+    """
+    view = {k: v for k, v in item.items() if k not in HIDDEN_ATTRIBUTES}
+    view["user"] = author(item)
+    view["image_s3_key"] = item.get("image")
+
+    raw_labels = item.get("labels", [])
+    simple_labels: List[str] = []
+    if isinstance(raw_labels, list):
+        for label_obj in raw_labels:
+            if isinstance(label_obj, dict) and "S" in label_obj:
+                simple_labels.append(label_obj["S"])
+            elif isinstance(label_obj, str):
+                simple_labels.append(label_obj)
+            else:
+                logger.debug(f"Item ID {item.get('id', 'N/A')} contains unexpected label format: {label_obj}")
+    else:
+        logger.debug(f"Item ID {item.get('id', 'N/A')} has non-list format for labels: {raw_labels}")
+    view["labels"] = simple_labels
+    return view
+
+
+def parse_fields(raw) -> List[str]:
+    """Validate a comma-separated `fields` parameter against POST_FIELDS; `id` is always returned."""
+    fields = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = sorted(set(fields) - POST_FIELDS.keys())
+    if unknown:
+        raise ValueError(f"Unknown field(s) {', '.join(unknown)}, expected some of {', '.join(POST_FIELDS)}")
+    return ["id"] + sorted(set(fields) - {"id"})
+
+
+def projection(fields):
+    """ProjectionExpression reading only what `fields` needs, plus the key (batch_get_posts matches on it),
+    the author of sharded posts and created_at (merge order of sharded reads).
+
+    Every name goes through ExpressionAttributeNames: `user` is a DynamoDB reserved word.
+    """
+    attributes = sorted({"user", "id", "author", "created_at"}.union(*(POST_FIELDS[name] for name in fields)))
+    return {
+        "ProjectionExpression": ", ".join(f"#{attribute}" for attribute in attributes),
+        "ExpressionAttributeNames": {f"#{attribute}": attribute for attribute in attributes},
+    }
+
+
+def render_fields(item, fields, image_url) -> str:
+    """JSON of the requested `fields` of a post read with projection(fields)."""
+    view = {}
+    for name in fields:
+        if name == "image_url":
+            view[name] = image_url
+        elif name == "image_s3_key":
+            view[name] = item.get("image")
+        elif name == "user":
+            view[name] = author(item)
+        elif name == "labels":
+            view[name] = [label for label in item.get("labels") or [] if isinstance(label, str)]
+        else:
+            view[name] = item.get(name)
+    return dumps(view)
+
+
+def render_post(item, image_url) -> str:
+    """JSON of one post, serialised in one pass (orjson when installed)."""
+    return dumps({"image_url": image_url, **post_view(item)})
@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PresignedUrlCache:
+    """In-process LRU cache of presigned GET URLs, keyed by S3 object key.
+
+    A URL is reused while more than `reuse_fraction` of its ExpiresIn is left, so a client
+    always gets a link that stays valid for a reasonable time. Entries past that age are
+    evicted when they are looked up, the least recently used ones when `max_size` is reached.
+    """
+
+    def __init__(self, max_size=10000, reuse_fraction=0.5):
+        if not 0 <= reuse_fraction < 1:
+            raise ValueError("reuse_fraction must be in [0, 1)")
+        self.max_size = max_size
+        self.reuse_fraction = reuse_fraction
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_create(self, object_key, expires_in, factory):
+        """Return a cached URL for `object_key` or sign a new one with `factory()`."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(object_key)
+            if entry is not None:
+                url, signed_at, entry_expires_in = entry
+                if entry_expires_in == expires_in and now - signed_at < expires_in * (1 - self.reuse_fraction):
+                    self._entries.move_to_end(object_key)
+                    self.hits += 1
+                    return url
+                del self._entries[object_key]
+                self.evictions += 1
+            self.misses += 1
+
+        url = factory()
+        if url is None:
+            return None
+
+        with self._lock:
+            self._entries[object_key] = (url, now, expires_in)
+            self._entries.move_to_end(object_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return url
+
+    def invalidate(self, object_key):
+        with self._lock:
+            if self._entries.pop(object_key, None) is not None:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
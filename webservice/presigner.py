@@ -0,0 +1,122 @@
+import datetime
+import hashlib
+import hmac
+import threading
+from urllib.parse import parse_qs, quote, urlsplit
+
+import boto3
+from botocore.exceptions import NoCredentialsError
+
+ALGORITHM = "AWS4-HMAC-SHA256"
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+SAFE_QUERY_CHARS = "-._~"
+SAFE_KEY_CHARS = "/~"
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+class BatchPresigner:
+    """SigV4 query-string presigner producing the same URLs as `generate_presigned_url`.
+
+    botocore rebuilds the operation model, runs its event hooks and resolves the endpoint on
+    every call. Here the endpoint (scheme, host, path prefix, signing region) is resolved once
+    per bucket through botocore itself, and the signing key is derived once per
+    day/region/service, so signing a URL is down to one SHA-256 hash and one HMAC.
+    """
+
+    def __init__(self, s3_client, credentials=None):
+        self._client = s3_client
+        self._credentials = credentials or boto3.session.Session().get_credentials()
+        self._endpoints = {}
+        self._signing_keys = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, bucket):
+        endpoint = self._endpoints.get(bucket)
+        if endpoint is None:
+            # botocore fait la résolution d'endpoint (virtual host / path style, région) une seule fois.
+            probe = urlsplit(self._client.generate_presigned_url(
+                "get_object", Params={"Bucket": bucket, "Key": "_"}, ExpiresIn=1))
+            credential_scope = parse_qs(probe.query)["X-Amz-Credential"][0].split("/")
+            default_port = {"http": 80, "https": 443}.get(probe.scheme)
+            host = probe.hostname if probe.port == default_port else probe.netloc.rsplit("@", 1)[-1]
+            endpoint = (f"{probe.scheme}://{probe.netloc}", host, probe.path[:-1], credential_scope[2], credential_scope[3])
+            self._endpoints[bucket] = endpoint
+        return endpoint
+
+    def _signing_key(self, secret_key, date, region, service):
+        cache_key = (secret_key, date, region, service)
+        key = self._signing_keys.get(cache_key)
+        if key is None:
+            key = _hmac(_hmac(_hmac(_hmac(f"AWS4{secret_key}".encode("utf-8"), date), region), service), "aws4_request")
+            with self._lock:
+                # On ne garde que les clés du jour : la date fait partie de la clé de signature.
+                self._signing_keys = {k: v for k, v in self._signing_keys.items() if k[1] == date}
+                self._signing_keys[cache_key] = key
+        return key
+
+    def _frozen_credentials(self):
+        if self._credentials is None:
+            raise NoCredentialsError()
+        return self._credentials.get_frozen_credentials()
+
+    def _sign(self, method, bucket, object_key, expires_in, headers, credentials, now):
+        base_url, host, path_prefix, region, service = self._endpoint(bucket)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+
+        signed_headers = {"host": host}
+        for name, value in headers.items():
+            signed_headers[name.lower()] = " ".join(value.split())
+        header_names = sorted(signed_headers)
+        signed_header_list = ";".join(header_names)
+
+        params = [
+            ("X-Amz-Algorithm", ALGORITHM),
+            ("X-Amz-Credential", f"{credentials.access_key}/{date}/{region}/{service}/aws4_request"),
+            ("X-Amz-Date", amz_date),
+            ("X-Amz-Expires", str(expires_in)),
+            ("X-Amz-SignedHeaders", signed_header_list),
+        ]
+        if credentials.token is not None:
+            params.append(("X-Amz-Security-Token", credentials.token))
+        encoded_params = [(quote(k, safe=SAFE_QUERY_CHARS), quote(v, safe=SAFE_QUERY_CHARS)) for k, v in params]
+        query = "&".join(f"{k}={v}" for k, v in encoded_params)
+
+        path = path_prefix + quote(object_key.encode("utf-8"), safe=SAFE_KEY_CHARS)
+        canonical_request = "\n".join([
+            method,
+            path,
+            "&".join(f"{k}={v}" for k, v in sorted(encoded_params)),
+            "".join(f"{name}:{signed_headers[name]}\n" for name in header_names),
+            signed_header_list,
+            UNSIGNED_PAYLOAD,
+        ])
+        string_to_sign = "\n".join([
+            ALGORITHM,
+            amz_date,
+            f"{date}/{region}/{service}/aws4_request",
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        signing_key = self._signing_key(credentials.secret_key, date, region, service)
+        signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"{base_url}{path}?{query}&X-Amz-Signature={signature}"
+
+    def presign_get(self, bucket, object_key, expires_in=3600, now=None):
+        """Presigned URL for get_object."""
+        return self.presign_many(bucket, [object_key], expires_in, now=now)[0]
+
+    def presign_put(self, bucket, object_key, content_type=None, expires_in=3600, now=None):
+        """Presigned URL for put_object, signing Content-Type like botocore does."""
+        headers = {"Content-Type": content_type} if content_type else {}
+        credentials = self._frozen_credentials()
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return self._sign("PUT", bucket, object_key, expires_in, headers, credentials, now)
+
+    def presign_many(self, bucket, object_keys, expires_in=3600, now=None):
+        """Presign get_object URLs for many keys with one credential snapshot and timestamp."""
+        credentials = self._frozen_credentials()
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return [self._sign("GET", bucket, key, expires_in, {}, credentials, now) for key in object_keys]
@@ -0,0 +1,123 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger("uvicorn")
+
+THROTTLING_ERRORS = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+
+
+@dataclass
+class SegmentStats:
+    segment: int
+    duration_ms: float = 0.0
+    pages: int = 0
+    items: int = 0
+    throttles: int = 0
+    page_size: int | None = None
+
+
+@dataclass
+class ScanReport:
+    duration_ms: float = 0.0
+    segments: list[SegmentStats] = field(default_factory=list)
+
+    def server_timing(self):
+        """Format the timings as a Server-Timing header value."""
+        parts = [f"scan;dur={self.duration_ms:.1f}"]
+        parts += [f'seg{s.segment};dur={s.duration_ms:.1f};desc="{s.items} items, {s.pages} pages, {s.throttles} throttles"'
+                  for s in self.segments]
+        return ", ".join(parts)
+
+
+class ParallelScanner:
+    """Scan a DynamoDB table with Segment/TotalSegments in a bounded thread pool.
+
+    Each segment shrinks its page size (Limit) when it gets throttled and grows it back
+    after successful pages, so a small provisioned table is not hammered by all segments
+    at full speed. The timings of the last scan are kept in `last_report`.
+    """
+
+    def __init__(self, table, segments=4, max_workers=None, page_size=None,
+                 min_page_size=10, max_throttle_retries=8, base_backoff=0.05):
+        # Le client du resource est thread-safe et renvoie déjà des items désérialisés.
+        self.client = table.meta.client
+        self.table_name = table.name
+        self.segments = max(1, segments)
+        self.page_size = page_size
+        self.min_page_size = min_page_size
+        self.max_throttle_retries = max_throttle_retries
+        self.base_backoff = base_backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or self.segments, thread_name_prefix="scan")
+        self._lock = threading.Lock()
+        self.last_report: ScanReport | None = None
+
+    def _scan_segment(self, segment, scan_kwargs):
+        stats = SegmentStats(segment=segment, page_size=self.page_size)
+        items = []
+        start_key = None
+        throttle_retries = 0
+        started = time.perf_counter()
+        while True:
+            kwargs = dict(scan_kwargs, TableName=self.table_name, Segment=segment, TotalSegments=self.segments)
+            if start_key:
+                kwargs["ExclusiveStartKey"] = start_key
+            if stats.page_size:
+                kwargs["Limit"] = stats.page_size
+            try:
+                response = self.client.scan(**kwargs)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERRORS or throttle_retries >= self.max_throttle_retries:
+                    raise
+                throttle_retries += 1
+                stats.throttles += 1
+                # Page plus petite = moins de RCU consommées d'un coup par ce segment.
+                current = stats.page_size or (stats.items // stats.pages if stats.pages else 100)
+                stats.page_size = max(min(self.min_page_size, current), current // 2)
+                time.sleep(self.base_backoff * (2 ** throttle_retries) * random.uniform(0.5, 1.5))
+                continue
+
+            throttle_retries = 0
+            page = response.get("Items", [])
+            items.extend(page)
+            stats.pages += 1
+            stats.items += len(page)
+            if stats.throttles and stats.page_size and (self.page_size is None or stats.page_size < self.page_size):
+                stats.page_size = min(stats.page_size * 2, self.page_size or stats.page_size * 2)
+            start_key = response.get("LastEvaluatedKey")
+            if not start_key:
+                break
+        stats.duration_ms = (time.perf_counter() - started) * 1000
+        return items, stats
+
+    def scan(self, **scan_kwargs):
+        """Return (items, report) for the whole table, segments merged in segment order."""
+        started = time.perf_counter()
+        # Un contexte par segment : un Context ne peut être exécuté que par un thread à la fois.
+        futures = [self._executor.submit(contextvars.copy_context().run, self._scan_segment, segment, scan_kwargs)
+                   for segment in range(self.segments)]
+        items = []
+        report = ScanReport()
+        for future in futures:
+            segment_items, stats = future.result()
+            items.extend(segment_items)
+            report.segments.append(stats)
+        report.duration_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.last_report = report
+        logger.debug(f"Parallel scan of {self.table_name}: {len(items)} items in {report.duration_ms:.1f} ms")
+        return items, report
+
+    def stats(self):
+        with self._lock:
+            report = self.last_report
+        return {
+            "total_segments": self.segments,
+            "last_scan": asdict(report) if report else None,
+        }
@@ -0,0 +1,235 @@
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+import zlib
+from collections import Counter
+from urllib.parse import urlparse
+
+from sharding import author
+
+logger = logging.getLogger("uvicorn")
+
+SNAPSHOT_VERSION = 1
+TITLE_WEIGHT = 2
+
+# Mots vides français (et quelques anglais) après suppression des accents.
+STOPWORDS = frozenset("""
+au aux avec ce ces cet cette dans de des du elle elles en est et il ils je la le les leur leurs lui ma
+mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une
+vos votre vous y a the and of to in is
+""".split())
+
+# Suffixes retirés par le racinisateur, du plus long au plus court : un dérivationnel puis un flexionnel.
+DERIVATIONAL_SUFFIXES = (
+    "issement", "atrice", "ation", "ement", "euse", "ment", "isme", "iste", "ique", "able", "eur", "ite",
+)
+INFLECTIONAL_SUFFIXES = ("ee", "er", "ez", "e")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text):
+    """Lower-case `text` and strip its accents (é -> e, ç -> c, œ -> oe)."""
+    text = text.lower().replace("œ", "oe").replace("æ", "ae")
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def stem(word):
+    """Light French stemmer: plural, then one derivational and one inflectional suffix."""
+    if len(word) > 5 and word.endswith("aux"):
+        return word[:-3] + "al"
+    if len(word) > 3 and word[-1] in "sx":
+        word = word[:-1]
+    for suffixes in (DERIVATIONAL_SUFFIXES, INFLECTIONAL_SUFFIXES):
+        for suffix in suffixes:
+            if len(word) > 4 and word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)]
+                break
+    return word
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_RE.findall(fold(text or "")) if len(token) > 1 and token not in STOPWORDS]
+
+
+def doc_key(user, post_id):
+    return f"{user}\x1f{post_id}"
+
+
+class SearchIndex:
+    """In-memory BM25 inverted index over the title and body of the posts.
+
+    Each instance keeps its own copy, updated by POST and DELETE /posts. A snapshot
+    (zlib-compressed JSON, on disk or in S3) lets a new instance start from the index
+    built by another one instead of scanning the table; `built_at` is the time of the
+    scan the content comes from, so that a stale snapshot can be rebuilt.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._docs = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self._journal = None
+        self.built_at = None
+        self.ready = False
+
+    def _add(self, item):
+        key = doc_key(author(item), item['id'])
+        self._remove(key)
+        terms = Counter(tokenize(item.get('title')))
+        for term in terms:
+            terms[term] *= TITLE_WEIGHT
+        terms.update(tokenize(item.get('body')))
+        length = sum(terms.values())
+        self._docs[key] = (item.get('created_at') or "", length, list(terms))
+        self._total_length += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[key] = tf
+
+    def _remove(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        self._total_length -= doc[1]
+        for term in doc[2]:
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+
+    def add(self, item):
+        with self._lock:
+            self._add(item)
+            if self._journal is not None:
+                self._journal.append(("add", item))
+
+    def remove(self, user, post_id):
+        with self._lock:
+            self._remove(doc_key(user, post_id))
+            if self._journal is not None:
+                self._journal.append(("remove", (user, post_id)))
+
+    def begin_rebuild(self):
+        """Start journaling writes so that a rebuild from a scan does not lose them."""
+        with self._lock:
+            self._journal = []
+
+    def cancel_rebuild(self):
+        with self._lock:
+            self._journal = None
+
+    def finish_rebuild(self, other):
+        """Take over the content of `other` (built from a scan) and replay the journaled writes."""
+        with self._lock:
+            journal, self._journal = self._journal or [], None
+            for op, arg in journal:
+                if op == "add":
+                    other._add(arg)
+                else:
+                    other._remove(doc_key(*arg))
+            self._postings, self._docs, self._total_length = other._postings, other._docs, other._total_length
+            self.built_at = other.built_at
+            self.ready = True
+
+    def build(self, items, built_at=None):
+        self.built_at = built_at
+        for item in items:
+            self._add(item)
+        self.ready = True
+        return self
+
+    def search(self, query, offset=0, limit=20):
+        """Return ([(user, post_id, score)], total matches) ranked by BM25, newest first on ties."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._docs)
+            if not terms or not n_docs:
+                return [], 0
+            avg_length = self._total_length / n_docs
+            scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._docs[key][1] / avg_length)
+                    scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+            # Deux tris stables : le plus récent d'abord, puis par score décroissant.
+            ranked = sorted(scores.items(), key=lambda kv: self._docs[kv[0]][0], reverse=True)
+            ranked.sort(key=lambda kv: kv[1], reverse=True)
+        page = ranked[offset:offset + limit]
+        return [(*key.split("\x1f", 1), round(score, 4)) for key, score in page], len(ranked)
+
+    def stats(self):
+        return {"ready": self.ready, "documents": len(self._docs), "terms": len(self._postings)}
+
+    def to_snapshot(self):
+        with self._lock:
+            keys = list(self._docs)
+            positions = {key: i for i, key in enumerate(keys)}
+            data = {
+                "v": SNAPSHOT_VERSION,
+                "t": self.built_at,
+                "docs": [[key, *self._docs[key][:2]] for key in keys],
+                "terms": {term: [x for key, tf in postings.items() for x in (positions[key], tf)]
+                          for term, postings in self._postings.items()},
+            }
+        return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), 6)
+
+    @classmethod
+    def from_snapshot(cls, raw, **kwargs):
+        data = json.loads(zlib.decompress(raw))
+        if data.get("v") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported search snapshot version {data.get('v')}")
+        index = cls(**kwargs)
+        index.built_at = data.get("t")
+        keys = [doc[0] for doc in data["docs"]]
+        doc_terms = {key: [] for key in keys}
+        for term, flat in data["terms"].items():
+            postings = {}
+            for i in range(0, len(flat), 2):
+                key = keys[flat[i]]
+                postings[key] = flat[i + 1]
+                doc_terms[key].append(term)
+            index._postings[term] = postings
+        for key, created_at, length in data["docs"]:
+            index._docs[key] = (created_at, length, doc_terms[key])
+            index._total_length += length
+        index.ready = True
+        return index
+
+
+def save_snapshot(raw, location, s3_client=None):
+    """Write a snapshot to a local path or to s3://bucket/key."""
+    parsed = urlparse(location)
+    if parsed.scheme == "s3":
+        s3_client.put_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"), Body=raw)
+        return
+    directory = os.path.dirname(os.path.abspath(location))
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(raw)
+    os.replace(tmp_path, location)
+
+
+def load_snapshot(location, s3_client=None):
+    """Read a snapshot from a local path or s3://bucket/key, None if there is none yet."""
+    parsed = urlparse(location)
+    if parsed.scheme == "s3":
+        try:
+            return s3_client.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))["Body"].read()
+        except s3_client.exceptions.NoSuchKey:
+            return None
+    try:
+        with open(location, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
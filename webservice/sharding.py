@@ -0,0 +1,121 @@
+import contextvars
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from boto3.dynamodb.conditions import Key
+
+
+def author(item):
+    """Real user of a post as stored: sharded items keep it in `author`, their `user` being `user#shard`."""
+    return item.get('author') or item['user']
+
+
+def order_key(item):
+    # Ordre des feeds : du plus récent au plus ancien, l'id départage deux posts de la même microseconde.
+    return item.get('created_at') or '', item['id']
+
+
+class ShardScheme:
+    """Where the posts of a user are stored: partition `user`, or `user#0` .. `user#{shards-1}`.
+
+    The shard is derived from the post id, so a point read or write still needs nothing but
+    (user, id), and a prolific user's writes spread over `shards` partitions. With
+    `legacy_reads`, readers also look in the unsharded partition, for the items the backfill
+    (terraform/shard_posts.py) has not moved yet.
+    """
+
+    def __init__(self, shards=1, legacy_reads=True):
+        self.shards = max(1, shards)
+        self.legacy_reads = legacy_reads and self.shards > 1
+
+    @property
+    def enabled(self):
+        return self.shards > 1
+
+    def shard_of(self, post_id):
+        # crc32 plutôt que hash() : stable d'un processus à l'autre, et la lambda fait le même calcul.
+        return zlib.crc32(post_id.encode("utf-8")) % self.shards
+
+    def partition(self, user, post_id):
+        return f"{user}#{self.shard_of(post_id)}" if self.enabled else user
+
+    def key(self, user, post_id):
+        return {'user': self.partition(user, post_id), 'id': post_id}
+
+    def candidate_keys(self, user, post_id):
+        """Keys a post may be stored under, the current scheme's first."""
+        keys = [self.key(user, post_id)]
+        if self.legacy_reads:
+            keys.append({'user': user, 'id': post_id})
+        return keys
+
+    def partitions(self, user):
+        if not self.enabled:
+            return [user]
+        return [f"{user}#{shard}" for shard in range(self.shards)] + ([user] if self.legacy_reads else [])
+
+    def to_storage(self, item):
+        """The item to write for a post whose `user` is the real user."""
+        if not self.enabled:
+            return item
+        return {**item, 'user': self.partition(item['user'], item['id']), 'author': item['user']}
+
+
+class ShardedReader:
+    """Scatter-gather read of one user's posts: every partition of the user is queried
+    concurrently on the (user, created_at) LSI, and the results are merged newest first.
+
+    A page reads up to `limit` items from each partition, so a page costs up to
+    `limit` x partitions items read instead of `limit`. The thread pool is shared by all
+    requests: by default it runs the queries of `concurrent_pages` pages at once.
+    """
+
+    def __init__(self, table, scheme, index_name, max_workers=None, concurrent_pages=8):
+        self.table = table
+        self.scheme = scheme
+        self.index_name = index_name
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or concurrent_pages * len(scheme.partitions("_")), thread_name_prefix="shard-read")
+
+    def _query_partition(self, partition, limit, after, projection):
+        condition = Key('user').eq(partition)
+        if after:
+            # <= puis filtre : les posts de la même microseconde que le curseur ne sont ni perdus ni répétés.
+            condition = condition & Key('created_at').lte(after['created_at'])
+        items = []
+        start_key = None
+        while True:
+            kwargs = dict(projection or {}, KeyConditionExpression=condition, ScanIndexForward=False)
+            if self.index_name:
+                kwargs['IndexName'] = self.index_name
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+            if limit:
+                kwargs['Limit'] = limit
+            response = self.table.query(**kwargs)
+            for item in response.get('Items', []):
+                if after and order_key(item) >= (after['created_at'], after['id']):
+                    continue
+                items.append(item)
+            start_key = response.get('LastEvaluatedKey')
+            if not start_key or (limit and len(items) >= limit):
+                break
+        return sorted(items, key=order_key, reverse=True)
+
+    def query(self, user, limit=None, after=None, projection=None):
+        """Return (posts newest first, {'created_at', 'id'} to resume after or None)."""
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, self._query_partition, partition, limit, after, projection)
+            for partition in self.scheme.partitions(user)
+        ]
+        merged = heapq.merge(*[future.result() for future in futures], key=order_key, reverse=True)
+        # Un post présent deux fois (backfill interrompu entre l'écriture et la suppression) n'est servi qu'une fois.
+        seen = set()
+        unique = (item for item in merged if not (item['id'] in seen or seen.add(item['id'])))
+        items = list(islice(unique, limit)) if limit else list(unique)
+        next_after = None
+        if limit and len(items) == limit:
+            next_after = {'created_at': items[-1].get('created_at') or '', 'id': items[-1]['id']}
+        return items, next_after
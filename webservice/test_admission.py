@@ -0,0 +1,161 @@
+import types
+
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import admission
+from admission import (AdmissionMiddleware, CapacityGuard, ConcurrencyLimits, KeyedRateLimiter, TokenBucket,
+                       parse_limits, rejection)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_parse_limits():
+    assert parse_limits("GET /posts (scan)=4, GET /posts/{post_id}/events=256,") == {
+        "GET /posts (scan)": 4, "GET /posts/{post_id}/events": 256}
+    assert parse_limits(None) == {}
+
+
+def test_rejection():
+    body, headers = rejection("capacity", 0.2)
+
+    assert body == b'{"message": "Too many requests (capacity), retry later"}'
+    assert headers == {"content-type": "application/json", "retry-after": "1"}
+    assert rejection("user_rate", 2.1)[1]["retry-after"] == "3"
+
+
+def test_token_bucket_take_and_refill(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.take() == 0
+    clock.now += 60
+    assert bucket.level() == 3
+
+
+def test_token_bucket_debt_is_capped(clock):
+    bucket = TokenBucket(rate=2, burst=4)
+
+    bucket.consume(10)
+    assert bucket.debt() == pytest.approx(3)
+    bucket.consume(100, max_debt=4)
+    assert bucket.level() == -4
+    clock.now += 2
+    assert bucket.debt() == 0
+
+
+def test_keyed_rate_limiter_is_per_key_and_bounded(clock):
+    limiter = KeyedRateLimiter(rate=1, burst=2, max_keys=2)
+
+    assert [limiter.wait("a") for _ in range(3)] == [0, 0, pytest.approx(1)]
+    assert limiter.wait("b") == 0
+    limiter.wait("c")
+    # "a", le moins récent, est oublié : il repart avec un seau plein.
+    assert limiter.stats() == {"rate": 1, "burst": 2, "keys": 2}
+    assert limiter.wait("a") == 0
+    assert not KeyedRateLimiter(rate=0, burst=0).enabled
+
+
+def test_concurrency_limits():
+    limits = ConcurrencyLimits({"GET /posts (scan)": 1}, default=2)
+
+    assert limits.try_acquire("GET /posts (scan)")
+    assert not limits.try_acquire("GET /posts (scan)")
+    assert limits.try_acquire("POST /posts") and limits.try_acquire("POST /posts")
+    assert not limits.try_acquire("POST /posts")
+    limits.release("GET /posts (scan)")
+    assert limits.try_acquire("GET /posts (scan)")
+    assert limits.stats()["POST /posts"] == {"in_progress": 2, "limit": 2}
+
+    unlimited = ConcurrencyLimits()
+    assert all(unlimited.try_acquire("GET /posts") for _ in range(100))
+
+
+def test_capacity_guard_charges_requests_of_its_table_only(clock):
+    guard = CapacityGuard("posts", rcu=2, wcu=1, burst_seconds=2)
+
+    guard.record("posts", "Scan", 5, "/posts")
+    guard.record("labels", "Query", 50, "/posts")
+    guard.record("posts", "Scan", 50, "background")
+    guard.record("posts", "PutItem", 0.5, "/posts")
+
+    assert guard.wait("GET") == pytest.approx(0.5)
+    assert guard.wait("POST") == 0
+    assert not CapacityGuard("posts").enabled
+
+
+def make_app(**kwargs):
+    async def ok(request):
+        return JSONResponse({"route": request.scope.get("admission_route")})
+
+    routes = [Route("/posts", ok, methods=["GET", "POST"]), Route("/stats", ok)]
+    return Starlette(routes=routes, middleware=[Middleware(AdmissionMiddleware, routes=routes, **kwargs)])
+
+
+def test_middleware_rejects_a_caller_over_its_rate(clock):
+    client = TestClient(make_app(users=KeyedRateLimiter(rate=0.5, burst=1)))
+
+    assert client.post("/posts", headers={"authorization": "Deku"}).status_code == 200
+    response = client.post("/posts", headers={"authorization": "Deku"})
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+    assert response.json() == {"message": "Too many requests (user_rate), retry later"}
+    # Sans Authorization, pas de limite par appelant.
+    assert all(client.post("/posts").status_code == 200 for _ in range(3))
+
+
+def test_middleware_checks_capacity_for_writes_only(clock):
+    guard = CapacityGuard("posts", rcu=1, wcu=1, burst_seconds=1)
+    guard.record("posts", "Query", 3, "/posts")
+    guard.record("posts", "PutItem", 3, "/posts")
+    client = TestClient(make_app(capacity=guard))
+
+    response = client.post("/posts")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    # Les lectures vérifient la capacité dans le handler, une fois sûres de lire la table.
+    assert client.get("/posts").status_code == 200
+
+
+def test_middleware_rejects_over_the_route_concurrency(clock):
+    limits = ConcurrencyLimits({"GET /posts (scan)": 1})
+    client = TestClient(make_app(concurrency=limits, route_key=lambda scope, route: f"{route} (scan)"))
+    limits.try_acquire("GET /posts (scan)")
+
+    response = client.get("/posts")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+
+    limits.release("GET /posts (scan)")
+    assert client.get("/posts").json() == {"route": "GET /posts (scan)"}
+    assert limits.in_progress["GET /posts (scan)"] == 0
+
+
+def test_middleware_lets_exempt_and_preflight_requests_through(clock):
+    limits = ConcurrencyLimits(default=1)
+    limits.try_acquire("GET /stats")
+    limits.try_acquire("OPTIONS /posts")
+    client = TestClient(make_app(concurrency=limits, users=KeyedRateLimiter(rate=0.001, burst=1)))
+
+    assert all(client.get("/stats", headers={"authorization": "Deku"}).status_code == 200 for _ in range(3))
+    assert client.options("/posts").status_code != 429
@@ -0,0 +1,63 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, accepted_encodings
+
+FEED = [{"id": f"p{i}", "title": "Gundam", "body": "maquette peinte"} for i in range(100)]
+
+
+def make_client():
+    async def feed(request):
+        headers = {"ETag": '"v1"'}
+        if request.headers.get("if-none-match") == '"v1-gzip"':
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(FEED, headers=headers)
+
+    async def small(request):
+        return JSONResponse({"id": "p1"})
+
+    routes = [Route("/posts", feed), Route("/small", small)]
+    return TestClient(Starlette(routes=routes, middleware=[Middleware(CompressionMiddleware)]))
+
+
+def test_accepted_encodings_skip_zero_q():
+    assert accepted_encodings("gzip;q=0, br, deflate;q=0.5") == {"br", "deflate"}
+
+
+@pytest.mark.parametrize("encoding", ["gzip", pytest.param("br", marks=pytest.mark.skipif(
+    compression.brotli is None, reason="brotli is not installed"))])
+def test_compressed_response_suffixes_its_etag(encoding):
+    response = make_client().get("/posts", headers={"Accept-Encoding": encoding})
+
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["etag"] == f'"v1-{encoding}"'
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == FEED
+
+
+def test_not_modified_has_the_etag_of_the_response_it_validates():
+    client = make_client()
+    etag = client.get("/posts", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+
+    response = client.get("/posts", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert "content-encoding" not in response.headers
+
+
+def test_uncompressed_responses_still_vary_on_accept_encoding():
+    client = make_client()
+
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    identity = client.get("/posts", headers={"Accept-Encoding": "identity"})
+
+    assert "content-encoding" not in small.headers and small.headers["vary"] == "Accept-Encoding"
+    assert "content-encoding" not in identity.headers and identity.headers["vary"] == "Accept-Encoding"
+    assert identity.headers["etag"] == '"v1"'
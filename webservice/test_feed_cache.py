@@ -0,0 +1,31 @@
+from feed_cache import GLOBAL_SCOPE, FeedCache, FileStore, user_scope
+
+
+def test_a_write_makes_the_cached_response_unreachable():
+    cache = FeedCache()
+    _, key = cache.get(GLOBAL_SCOPE, "feed")
+    cache.set(key, b"[]")
+
+    assert cache.get(GLOBAL_SCOPE, "feed") == (b"[]", key)
+    cache.invalidate("Deku")
+    assert cache.get(GLOBAL_SCOPE, "feed")[0] is None
+    assert cache.version(user_scope("Deku")) == 1
+
+
+def test_versions_are_shared_between_instances(tmp_path):
+    writer, reader = FeedCache(FileStore(str(tmp_path))), FeedCache(FileStore(str(tmp_path)))
+    _, key = reader.get(GLOBAL_SCOPE, "feed")
+    reader.set(key, b"[]")
+
+    writer.invalidate("Deku")
+
+    assert reader.get(GLOBAL_SCOPE, "feed")[0] is None
+
+
+def test_zero_ttl_disables_the_cache_and_the_versions():
+    cache = FeedCache(ttl=0)
+    cache.invalidate("Deku")
+
+    assert not cache.enabled
+    assert cache.version(GLOBAL_SCOPE) is None
+    assert cache.get(GLOBAL_SCOPE, "feed") == (None, None)
@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+import pytest
+
+from pagination import CursorCodec, InvalidCursor
+
+LAST_KEY = {"user": "Deku", "id": "60888533-cc26-4e59-93ab-6964850ed447", "created_at": "2025-05-04T10:00:00.000000Z"}
+
+
+def test_round_trip():
+    codec = CursorCodec("secret")
+    cursor = codec.encode(LAST_KEY, "user:Deku")
+
+    assert codec.decode(cursor, "user:Deku") == LAST_KEY
+
+
+def test_numbers_come_back_as_decimal():
+    codec = CursorCodec("secret")
+
+    assert codec.decode(codec.encode({"offset": 40}, "search:q"), "search:q") == {"offset": Decimal(40)}
+
+
+def test_no_key_no_cursor():
+    codec = CursorCodec("secret")
+
+    assert codec.encode(None, "scan") is None
+    assert codec.decode(None, "scan") is None
+    assert codec.decode("", "scan") is None
+
+
+def test_cursor_is_valid_on_every_instance_sharing_the_secret():
+    cursor = CursorCodec("secret").encode(LAST_KEY, "scan")
+
+    assert CursorCodec("secret").decode(cursor, "scan") == LAST_KEY
+    with pytest.raises(InvalidCursor):
+        CursorCodec("other secret").decode(cursor, "scan")
+
+
+def test_tampered_payload_is_rejected():
+    codec = CursorCodec("secret")
+    payload, signature = codec.encode(LAST_KEY, "user:Deku").split(".")
+    forged_payload, _ = codec.encode({**LAST_KEY, "user": "Setsuna"}, "user:Deku").split(".")
+
+    with pytest.raises(InvalidCursor, match="signature"):
+        codec.decode(f"{forged_payload}.{signature}", "user:Deku")
+
+
+def test_tampered_signature_is_rejected():
+    codec = CursorCodec("secret")
+    payload, signature = codec.encode(LAST_KEY, "scan").split(".")
+    flipped = ("A" if signature[0] != "A" else "B") + signature[1:]
+
+    with pytest.raises(InvalidCursor, match="signature"):
+        codec.decode(f"{payload}.{flipped}", "scan")
+
+
+def test_cursor_of_another_query_is_rejected():
+    codec = CursorCodec("secret")
+    cursor = codec.encode(LAST_KEY, "user:Deku")
+
+    with pytest.raises(InvalidCursor, match="this query"):
+        codec.decode(cursor, "user:Setsuna")
+
+
+@pytest.mark.parametrize("cursor", ["no-dot", "a.b.c", "!!!.???", "é.é"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        CursorCodec("secret").decode(cursor, "scan")
@@ -0,0 +1,82 @@
+import datetime
+
+import boto3
+import botocore.auth
+import pytest
+from botocore.credentials import Credentials
+
+from presigner import BatchPresigner
+
+NOW = datetime.datetime(2025, 5, 4, 14, 32, 55, tzinfo=datetime.timezone.utc)
+
+KEYS = [
+    "Deku/60888533-cc26-4e59-93ab-6964850ed447/ec3cd817-4655-4e30-9f90-860f716bc7b1all might.jpeg",
+    "Setsuna/48d6fb25-0685-4236-bf21-477aa7e66023/f9547e91-431e-425a-894f-e55224c7ef92gundam quanT.jpg",
+    "Link/épée/légendaire+~!*'()&=?#.png",
+    "u/p/日本語 ファイル.webp",
+    "a//double/slash",
+]
+BUCKETS = ["my-cdtf-test-bucket20250504143255658800000001", "Not_DNS_Compatible"]
+CREDENTIALS = [
+    Credentials("AKIDEXAMPLE", "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY"),
+    Credentials("ASIAEXAMPLE", "secret/with+chars", token="IQoJb3JpZ2luX2VjE//token+=="),
+]
+
+
+def make_client(credentials, region="us-east-1", **kwargs):
+    return boto3.client(
+        "s3",
+        region_name=region,
+        aws_access_key_id=credentials.access_key,
+        aws_secret_access_key=credentials.secret_key,
+        aws_session_token=credentials.token,
+        config=boto3.session.Config(signature_version="s3v4"),
+        **kwargs,
+    )
+
+
+@pytest.fixture(autouse=True)
+def frozen_botocore_clock(monkeypatch):
+    monkeypatch.setattr(botocore.auth, "get_current_datetime", lambda: NOW.replace(tzinfo=None))
+
+
+@pytest.mark.parametrize("credentials", CREDENTIALS)
+@pytest.mark.parametrize("bucket", BUCKETS)
+@pytest.mark.parametrize("key", KEYS)
+def test_get_url_matches_botocore(credentials, bucket, key):
+    client = make_client(credentials)
+    expected = client.generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=3600)
+
+    assert BatchPresigner(client, credentials).presign_get(bucket, key, 3600, now=NOW) == expected
+
+
+@pytest.mark.parametrize("credentials", CREDENTIALS)
+@pytest.mark.parametrize("content_type", ["image/jpeg", "image/png", None])
+def test_put_url_matches_botocore(credentials, content_type):
+    client = make_client(credentials)
+    key = KEYS[0]
+    params = {"Bucket": BUCKETS[0], "Key": key}
+    if content_type:
+        params["ContentType"] = content_type
+    expected = client.generate_presigned_url(ClientMethod="put_object", Params=params, ExpiresIn=3600)
+
+    presigner = BatchPresigner(client, credentials)
+    assert presigner.presign_put(BUCKETS[0], key, content_type=content_type, now=NOW) == expected
+
+
+@pytest.mark.parametrize("region", ["us-east-1", "eu-west-3"])
+@pytest.mark.parametrize("endpoint_url", [None, "http://localhost:4566"])
+def test_endpoint_resolution_matches_botocore(region, endpoint_url):
+    client = make_client(CREDENTIALS[0], region=region, endpoint_url=endpoint_url)
+    expected = [client.generate_presigned_url("get_object", Params={"Bucket": BUCKETS[0], "Key": key}, ExpiresIn=900)
+                for key in KEYS]
+
+    assert BatchPresigner(client, CREDENTIALS[0]).presign_many(BUCKETS[0], KEYS, 900, now=NOW) == expected
+
+
+def test_signing_key_is_derived_once_per_day():
+    presigner = BatchPresigner(make_client(CREDENTIALS[0]), CREDENTIALS[0])
+    presigner.presign_many(BUCKETS[0], KEYS, now=NOW)
+    presigner.presign_get(BUCKETS[0], KEYS[0], now=NOW + datetime.timedelta(days=1))
+
+    assert len(presigner._signing_keys) == 1
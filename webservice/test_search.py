@@ -0,0 +1,130 @@
+import json
+import zlib
+
+import pytest
+
+from search import SearchIndex, fold, load_snapshot, save_snapshot, stem, tokenize
+
+
+def post(post_id, title, body="", user="Deku", created_at="2025-05-04T10:00:00.000000Z"):
+    return {"user": user, "id": post_id, "title": title, "body": body, "created_at": created_at}
+
+
+def test_fold_strips_accents_and_case():
+    assert fold("Élève ÇA Œuvre Ægis") == "eleve ca oeuvre aegis"
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("chevaux", "cheval"),
+    ("chats", "chat"),
+    ("animation", "anim"),
+    ("rapidement", "rapid"),
+    ("mangee", "mang"),
+    ("chanter", "chant"),
+    ("mer", "mer"),
+])
+def test_stem(word, expected):
+    assert stem(word) == expected
+
+
+def test_singular_and_plural_share_a_stem():
+    assert stem("gundams") == stem("gundam")
+    assert stem(fold("héroïques")) == stem(fold("héroïque"))
+
+
+def test_tokenize_drops_stopwords_and_single_letters():
+    assert tokenize("Le Chat de la Maison, à l'école !") == ["chat", "maison", "ecol"]
+    assert tokenize(None) == []
+
+
+def test_bm25_ranks_title_and_frequency_first():
+    index = SearchIndex().build([
+        post("body-once", "Vacances", "un gundam au musee"),
+        post("title", "Gundam", "photo"),
+        post("body-twice", "Maquette", "gundam gundam"),
+        post("other", "Chat", "rien a voir"),
+    ])
+
+    hits, total = index.search("gundam")
+
+    assert total == 3
+    assert [post_id for _, post_id, _ in hits][0] == "title"
+    assert [post_id for _, post_id, _ in hits][-1] == "body-once"
+    assert hits[0][2] > hits[1][2] > hits[2][2]
+
+
+def test_ties_are_newest_first_and_paged():
+    index = SearchIndex().build([
+        post("old", "Gundam", created_at="2025-05-01T10:00:00.000000Z"),
+        post("new", "Gundam", created_at="2025-05-03T10:00:00.000000Z"),
+        post("mid", "Gundam", created_at="2025-05-02T10:00:00.000000Z"),
+    ])
+
+    hits, total = index.search("gundams", offset=1, limit=1)
+
+    assert total == 3
+    assert [(user, post_id) for user, post_id, _ in hits] == [("Deku", "mid")]
+
+
+def test_remove_and_readd_replace_the_document():
+    index = SearchIndex().build([post("a", "Gundam"), post("b", "Chat")])
+
+    index.add(post("a", "Chien"))
+    index.remove("Deku", "b")
+
+    assert index.search("gundam") == ([], 0)
+    assert index.search("chat") == ([], 0)
+    assert index.stats() == {"ready": True, "documents": 1, "terms": 1}
+
+
+def test_finish_rebuild_replays_the_writes_made_during_the_scan():
+    index = SearchIndex().build([post("kept", "Chat"), post("deleted", "Chat")])
+    index.begin_rebuild()
+    # Écritures pendant le scan : absentes de son résultat (ou encore présentes pour la suppression).
+    index.add(post("written", "Chat"))
+    index.remove("Deku", "deleted")
+    scanned = SearchIndex().build([post("kept", "Chat"), post("deleted", "Chat")], built_at=123.0)
+
+    index.finish_rebuild(scanned)
+    index.add(post("after", "Chat"))
+
+    assert sorted(post_id for _, post_id, _ in index.search("chat")[0]) == ["after", "kept", "written"]
+    assert index.built_at == 123.0
+
+
+def test_cancel_rebuild_stops_journaling():
+    index = SearchIndex()
+    index.begin_rebuild()
+    index.cancel_rebuild()
+    index.add(post("a", "Chat"))
+
+    index.finish_rebuild(SearchIndex().build([]))
+
+    assert index.search("chat") == ([], 0)
+
+
+def test_snapshot_round_trip(tmp_path):
+    index = SearchIndex().build([
+        post("a", "Gundam quanT", "maquette peinte", user="Setsuna"),
+        post("b", "Chevaux", "au galop", user="Link", created_at="2025-05-05T10:00:00.000000Z"),
+        post("c", "", ""),
+    ], built_at=1746352375.5)
+    location = str(tmp_path / "search-index.snap")
+
+    save_snapshot(index.to_snapshot(), location)
+    restored = SearchIndex.from_snapshot(load_snapshot(location))
+
+    assert restored.ready
+    assert restored.built_at == 1746352375.5
+    assert restored.stats() == index.stats()
+    for query in ("gundam", "cheval", "maquette galop", "absent"):
+        assert restored.search(query) == index.search(query)
+    restored.remove("Setsuna", "a")
+    assert restored.search("gundam") == ([], 0)
+
+
+def test_missing_snapshot_and_unknown_version(tmp_path):
+    assert load_snapshot(str(tmp_path / "missing.snap")) is None
+
+    with pytest.raises(ValueError, match="version"):
+        SearchIndex.from_snapshot(zlib.compress(json.dumps({"v": 999}).encode()))